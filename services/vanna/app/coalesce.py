@@ -0,0 +1,123 @@
+# Single-flight coalescing of identical in-flight work and bounded LLM dispatch
+
+import asyncio
+import os
+
+
+class SingleFlight:
+    """
+    Share one in-flight task between concurrent callers using the same key.
+
+    The first caller for a key starts the work; callers arriving while it
+    runs await the same task. A caller that is cancelled (e.g. its client
+    disconnected) only detaches itself: the shared task is cancelled once
+    no caller is waiting for it any more.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._inflight: dict = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, key, factory):
+        """Run `factory()` (a coroutine function) once per concurrent `key`"""
+        if not self.enabled:
+            return await factory()
+
+        entry = self._inflight.get(key)
+        if entry is None:
+            task = asyncio.ensure_future(factory())
+            entry = self._inflight[key] = [task, 0]
+            task.add_done_callback(lambda _t, key=key, entry=entry: self._forget(key, entry))
+            self.leaders += 1
+        else:
+            self.followers += 1
+
+        task = entry[0]
+        entry[1] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done() and entry[1] == 1:
+                task.cancel()
+            raise
+        finally:
+            entry[1] -= 1
+
+    def _forget(self, key, entry):
+        if self._inflight.get(key) is entry:
+            del self._inflight[key]
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._inflight),
+            "leaders": self.leaders,
+            "coalesced": self.followers,
+        }
+
+
+class LLMDispatcher:
+    """
+    Bounded-concurrency gateway for LLM calls with an optional micro-batch window.
+
+    With a window, calls arriving within `window_ms` of the first one are
+    released together as one batch; every call then waits for one of
+    `max_concurrency` slots so bursts stay under the provider's rate limits
+    without being queued strictly one after another.
+    """
+
+    def __init__(self, max_concurrency: int = 4, window_ms: float = 0.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.window = max(0.0, window_ms) / 1000
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._gate = None
+        self._gate_size = 0
+        self.active = 0
+        self.dispatched = 0
+        self.batches = 0
+        self.largest_batch = 0
+
+    @classmethod
+    def from_env(cls) -> "LLMDispatcher":
+        return cls(
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "4")),
+            window_ms=float(os.getenv("LLM_BATCH_WINDOW_MS", "0")),
+        )
+
+    def _release(self, gate: asyncio.Event):
+        if self._gate is gate:
+            self.batches += 1
+            self.largest_batch = max(self.largest_batch, self._gate_size)
+            self._gate = None
+            self._gate_size = 0
+        gate.set()
+
+    async def submit(self, factory):
+        """Await `factory()` once the batch window has closed and a slot is free"""
+        if self.window > 0:
+            gate = self._gate
+            if gate is None:
+                gate = self._gate = asyncio.Event()
+                asyncio.get_running_loop().call_later(self.window, self._release, gate)
+            self._gate_size += 1
+            await gate.wait()
+
+        async with self._semaphore:
+            self.active += 1
+            self.dispatched += 1
+            try:
+                return await factory()
+            finally:
+                self.active -= 1
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "batch_window_ms": self.window * 1000,
+            "active": self.active,
+            "dispatched": self.dispatched,
+            "batches": self.batches,
+            "largest_batch": self.largest_batch,
+        }
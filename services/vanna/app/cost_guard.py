@@ -0,0 +1,261 @@
+# Pre-execution cost guard: EXPLAIN generated SQL before running it
+#
+# PostgreSQL only: the planner's JSON plan gives total cost and row
+# estimates. Plans over the configured limits are rejected (the caller can
+# regenerate the SQL with the returned hint); accepted plans run with a
+# per-statement timeout scaled to their cost. Verdicts are cached per SQL
+# hash so repeated queries skip the EXPLAIN round trip.
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class PlanVerdict:
+    __slots__ = ("allowed", "cost", "rows", "reason", "hint", "timeout_ms", "checked_at")
+
+    def __init__(self, allowed: bool, cost: float, rows: float, reason: str | None = None,
+                 hint: str | None = None, timeout_ms: int | None = None):
+        self.allowed = allowed
+        self.cost = cost
+        self.rows = rows
+        self.reason = reason
+        self.hint = hint
+        self.timeout_ms = timeout_ms
+        self.checked_at = time.monotonic()
+
+
+class QueryTooExpensive(Exception):
+    """Raised instead of executing a statement whose plan is over the limits"""
+
+    def __init__(self, verdict: PlanVerdict):
+        self.verdict = verdict
+        super().__init__(f"Query rejected by cost guard: {verdict.reason}")
+
+    @property
+    def hint(self) -> str | None:
+        return self.verdict.hint
+
+
+def _nodes(plan: dict):
+    yield plan
+    for child in plan.get("Plans", ()):
+        yield from _nodes(child)
+
+
+def _relations(plan: dict) -> list[str]:
+    names = []
+    for node in _nodes(plan):
+        name = node.get("Relation Name")
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def _aliases(plan: dict) -> set[str]:
+    return {node["Alias"] for node in _nodes(plan) if "Alias" in node}
+
+
+_CONDITIONS = ("Index Cond", "Recheck Cond", "Filter", "Hash Cond", "Merge Cond", "Join Filter", "Cache Key")
+
+
+def cross_joins(plan: dict) -> list[list[str]]:
+    """
+    Relations joined by a nested loop with no join condition (a cartesian
+    product): no join filter, and nothing on the inner side refers to the
+    outer side. Single-row inputs, such as an aggregate, are not reported.
+    """
+    found = []
+    for node in _nodes(plan):
+        if node.get("Node Type") != "Nested Loop" or "Join Filter" in node:
+            continue
+        children = [child for child in node.get("Plans", ()) if child.get("Parent Relationship") in ("Outer", "Inner")]
+        if len(children) != 2 or any(float(child.get("Plan Rows", 0)) <= 1 for child in children):
+            continue
+        outer, inner = children
+        outer_refs = tuple(f"{alias}." for alias in _aliases(outer))
+        conditions = " ".join(str(child[key]) for child in _nodes(inner) for key in _CONDITIONS if key in child)
+        if not any(ref in conditions for ref in outer_refs):
+            found.append(_relations(node))
+    return found
+
+
+def _explain_plan(row) -> dict:
+    """Top plan node of an EXPLAIN (FORMAT JSON) result row"""
+    document = row[0]
+    if isinstance(document, (str, bytes)):
+        document = json.loads(document)
+    return document[0]["Plan"]
+
+
+class CostGuard:
+    """
+    EXPLAIN-based admission control for generated SQL.
+
+    A statement is rejected when the planner estimates a total cost above
+    `max_cost`, more than `max_rows` result rows, or a cross join. Accepted
+    statements get `SET LOCAL statement_timeout` of `cost * ms_per_cost`,
+    clamped to [min_timeout_ms, max_timeout_ms].
+    """
+
+    def __init__(
+        self,
+        max_cost: float = 1_000_000,
+        max_rows: float = 1_000_000,
+        reject_cross_joins: bool = True,
+        min_timeout_ms: int = 5000,
+        max_timeout_ms: int = 30000,
+        ms_per_cost: float = 0.01,
+        max_entries: int = 4096,
+        ttl_seconds: float = 600,
+    ):
+        self.max_cost = max_cost
+        self.max_rows = max_rows
+        self.reject_cross_joins = reject_cross_joins
+        self.min_timeout_ms = min_timeout_ms
+        self.max_timeout_ms = max_timeout_ms
+        self.ms_per_cost = ms_per_cost
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._verdicts: OrderedDict[str, PlanVerdict] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+
+    @classmethod
+    def from_env(cls) -> "CostGuard":
+        """Build a guard from QUERY_MAX_* / QUERY_TIMEOUT_* / PLAN_CACHE_* environment variables"""
+        return cls(
+            max_cost=float(os.getenv("QUERY_MAX_COST", "1000000")),
+            max_rows=float(os.getenv("QUERY_MAX_ROWS_ESTIMATE", "1000000")),
+            reject_cross_joins=os.getenv("QUERY_REJECT_CROSS_JOINS", "true").lower() in ("1", "true", "yes"),
+            min_timeout_ms=int(os.getenv("QUERY_TIMEOUT_MIN_MS", "5000")),
+            max_timeout_ms=int(os.getenv("QUERY_TIMEOUT_MAX_MS", os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))),
+            ms_per_cost=float(os.getenv("QUERY_TIMEOUT_MS_PER_COST", "0.01")),
+            max_entries=int(os.getenv("PLAN_CACHE_MAX_ENTRIES", "4096")),
+            ttl_seconds=float(os.getenv("PLAN_CACHE_TTL_SECONDS", "600")),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_cost > 0 or self.max_rows > 0 or self.reject_cross_joins or self.max_timeout_ms > 0
+
+    def judge(self, plan: dict) -> PlanVerdict:
+        """Verdict for the top node of an EXPLAIN (FORMAT JSON) plan"""
+        cost = float(plan.get("Total Cost", 0))
+        rows = float(plan.get("Plan Rows", 0))
+        timeout_ms = None
+        if self.max_timeout_ms > 0:
+            timeout_ms = int(min(self.max_timeout_ms, max(self.min_timeout_ms, cost * self.ms_per_cost)))
+
+        if self.reject_cross_joins:
+            for relations in cross_joins(plan):
+                joined = " and ".join([", ".join(relations[:-1]), relations[-1]] if len(relations) > 2 else relations) or "two inputs"
+                return PlanVerdict(
+                    False, cost, rows,
+                    reason=f"{joined} are joined without a join condition (cross join)",
+                    hint=f"The previous query joined {joined} without a join condition, producing a cross join. "
+                         "Join tables only on their foreign keys (e.g. line_items.invoiceId = invoices.id).",
+                )
+        if self.max_cost > 0 and cost > self.max_cost:
+            return PlanVerdict(
+                False, cost, rows,
+                reason=f"estimated cost {cost:,.0f} exceeds the limit of {self.max_cost:,.0f}",
+                hint="The previous query was estimated to be too expensive to run. Aggregate in SQL, "
+                     "filter to the rows the question needs and avoid joining tables that are not required.",
+            )
+        if self.max_rows > 0 and rows > self.max_rows:
+            return PlanVerdict(
+                False, cost, rows,
+                reason=f"about {rows:,.0f} result rows estimated, over the limit of {self.max_rows:,.0f}",
+                hint=f"The previous query would return about {rows:,.0f} rows. "
+                     "Aggregate or filter so the result is a summary the user can read.",
+            )
+        return PlanVerdict(True, cost, rows, timeout_ms=timeout_ms)
+
+    @staticmethod
+    def _key(statement: str) -> str:
+        return hashlib.sha1(statement.encode("utf-8")).hexdigest()
+
+    def _cached(self, key: str) -> PlanVerdict | None:
+        with self._lock:
+            verdict = self._verdicts.get(key)
+            if verdict is not None and time.monotonic() - verdict.checked_at <= self.ttl_seconds:
+                self._verdicts.move_to_end(key)
+                self.hits += 1
+                return verdict
+            self.misses += 1
+            return None
+
+    def _remember(self, key: str, verdict: PlanVerdict):
+        with self._lock:
+            self._verdicts[key] = verdict
+            self._verdicts.move_to_end(key)
+            while len(self._verdicts) > self.max_entries:
+                self._verdicts.popitem(last=False)
+
+    def _admit(self, verdict: PlanVerdict) -> str | None:
+        """Timeout statement for an accepted plan; raises QueryTooExpensive otherwise"""
+        if not verdict.allowed:
+            with self._lock:
+                self.rejected += 1
+            print(f"Cost guard rejected query: {verdict.reason}")
+            raise QueryTooExpensive(verdict)
+        if verdict.timeout_ms:
+            return f"SET LOCAL statement_timeout = {verdict.timeout_ms}"
+        return None
+
+    def _applies(self, conn) -> bool:
+        return self.enabled and conn.dialect.name == "postgresql"
+
+    def check(self, conn, statement: str, params: dict | None = None) -> PlanVerdict | None:
+        """EXPLAIN `statement` on `conn` (or reuse a cached verdict), then reject it or set its timeout"""
+        if not self._applies(conn):
+            return None
+        # Imported here: app.main imports QueryTooExpensive and must not pull in SQLAlchemy at startup
+        from sqlalchemy import text
+        key = self._key(statement)
+        verdict = self._cached(key)
+        if verdict is None:
+            row = conn.execute(text("EXPLAIN (FORMAT JSON) " + statement), params or {}).fetchone()
+            verdict = self.judge(_explain_plan(row))
+            self._remember(key, verdict)
+        timeout = self._admit(verdict)
+        if timeout:
+            conn.execute(text(timeout))
+        return verdict
+
+    async def acheck(self, conn, statement: str, params: dict | None = None) -> PlanVerdict | None:
+        """Async variant of `check` for an AsyncConnection"""
+        if not self._applies(conn):
+            return None
+        from sqlalchemy import text
+        key = self._key(statement)
+        verdict = self._cached(key)
+        if verdict is None:
+            row = (await conn.execute(text("EXPLAIN (FORMAT JSON) " + statement), params or {})).fetchone()
+            verdict = self.judge(_explain_plan(row))
+            self._remember(key, verdict)
+        timeout = self._admit(verdict)
+        if timeout:
+            await conn.execute(text(timeout))
+        return verdict
+
+    def clear(self):
+        with self._lock:
+            self._verdicts.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._verdicts),
+                "hits": self.hits,
+                "misses": self.misses,
+                "rejected": self.rejected,
+                "max_cost": self.max_cost,
+                "max_rows": self.max_rows,
+            }
@@ -0,0 +1,273 @@
+# Shared database engines and connection pool metrics
+#
+# SQLAlchemy is imported inside the functions that need it so importing this
+# module (and app.main) stays cheap; engines are built during warm-up.
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+
+_engines: dict = {}
+_async_engines: dict = {}
+_engines_lock = threading.Lock()
+
+# Async drivers used for the non-blocking execution path
+_ASYNC_DRIVERS = {
+    "postgresql": "postgresql+psycopg",
+    "postgres": "postgresql+psycopg",
+    "postgresql+psycopg2": "postgresql+psycopg",
+    "postgresql+psycopg": "postgresql+psycopg",
+    "postgresql+asyncpg": "postgresql+asyncpg",
+    "mysql+pymysql": "mysql+aiomysql",
+    "mysql+aiomysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def normalize_database_url(database_url: str) -> str:
+    """Convert mysql:// to mysql+pymysql:// for SQLAlchemy; other URLs are kept as-is"""
+    if database_url.startswith("mysql://"):
+        return database_url.replace("mysql://", "mysql+pymysql://", 1)
+    # PostgreSQL driver is handled automatically by SQLAlchemy (psycopg2 by default)
+    return database_url
+
+
+def database_url_from_env() -> str:
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        raise ValueError("DATABASE_URL environment variable is required. Please set it in your .env file.")
+    return normalize_database_url(database_url)
+
+
+def async_database_url(database_url: str) -> str | None:
+    """Map a sync SQLAlchemy URL onto its async driver, or None if unsupported"""
+    scheme, sep, rest = database_url.partition("://")
+    driver = _ASYNC_DRIVERS.get(scheme)
+    return f"{driver}{sep}{rest}" if driver and sep else None
+
+
+class PoolSettings:
+    """Connection pool configuration read from DB_POOL_* / DB_STATEMENT_TIMEOUT_MS"""
+
+    def __init__(self):
+        self.pool_size = int(os.getenv("DB_POOL_SIZE", "5"))
+        self.max_overflow = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+        self.pool_timeout = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+        self.pool_recycle = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+        self.pool_pre_ping = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+        self.statement_timeout_ms = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+        self.prewarm = int(os.getenv("DB_POOL_PREWARM", "2"))
+
+    def engine_kwargs(self, database_url: str) -> dict:
+        if database_url.startswith("sqlite"):
+            # SQLite has no server, so only the pre-ping setting is meaningful
+            return {"pool_pre_ping": self.pool_pre_ping}
+        return {
+            "pool_size": self.pool_size,
+            "max_overflow": self.max_overflow,
+            "pool_timeout": self.pool_timeout,
+            "pool_recycle": self.pool_recycle,
+            "pool_pre_ping": self.pool_pre_ping,
+        }
+
+    def statement_timeout_sql(self, database_url: str) -> str | None:
+        """Session statement applying the statement timeout, or None when unsupported/disabled"""
+        ms = self.statement_timeout_ms
+        if ms <= 0:
+            return None
+        if database_url.startswith("postgres"):
+            return f"SET statement_timeout = {ms}"
+        if database_url.startswith("mysql"):
+            return f"SET SESSION max_execution_time = {ms}"
+        return None
+
+
+def _install_statement_timeout(sync_engine, statement: str | None):
+    """Run the statement timeout SET on every new DBAPI connection.
+
+    A session SET (rather than a startup `options` parameter) also works
+    behind PgBouncer-style poolers such as Neon's.
+    """
+    if not statement:
+        return
+    from sqlalchemy import event
+
+    @event.listens_for(sync_engine, "connect", insert=True)
+    def _set_timeout(dbapi_connection, connection_record):
+        autocommit = getattr(dbapi_connection, "autocommit", None)
+        if isinstance(autocommit, bool):
+            dbapi_connection.autocommit = True
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(statement)
+        finally:
+            cursor.close()
+            if isinstance(autocommit, bool):
+                dbapi_connection.autocommit = autocommit
+
+
+class PoolMetrics:
+    """Checkout wait time and saturation for one engine's pool"""
+
+    def __init__(self, pool, capacity: int | None):
+        self.pool = pool
+        self.capacity = capacity
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.slow_waits = 0
+        self.connects = 0
+        self._lock = threading.Lock()
+        from sqlalchemy import event
+        event.listen(pool, "connect", self._on_connect)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connects += 1
+
+    def record_wait(self, seconds: float):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            if seconds > 0.1:
+                self.slow_waits += 1
+
+    def stats(self) -> dict:
+        pool = self.pool
+        checked_out = pool.checkedout() if hasattr(pool, "checkedout") else None
+        with self._lock:
+            return {
+                "pool": type(pool).__name__,
+                "size": pool.size() if hasattr(pool, "size") else None,
+                "checked_out": checked_out,
+                "overflow": pool.overflow() if hasattr(pool, "overflow") else None,
+                "capacity": self.capacity,
+                "saturation": round(checked_out / self.capacity, 4) if self.capacity and checked_out is not None else None,
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkout_wait_avg_ms": round(1000 * self.wait_total / self.checkouts, 3) if self.checkouts else 0.0,
+                "checkout_wait_max_ms": round(1000 * self.wait_max, 3),
+                "checkout_waits_over_100ms": self.slow_waits,
+            }
+
+
+def metrics_for(engine) -> PoolMetrics:
+    """PoolMetrics of a sync or async engine created by this module"""
+    return getattr(engine, "sync_engine", engine).pool_metrics
+
+
+def _capacity(settings: PoolSettings, database_url: str) -> int | None:
+    if database_url.startswith("sqlite"):
+        return None
+    return settings.pool_size + max(settings.max_overflow, 0)
+
+
+def get_engine(database_url: str):
+    """Return the process-wide sync engine for a URL, creating it on first use"""
+    with _engines_lock:
+        engine = _engines.get(database_url)
+        if engine is None:
+            from sqlalchemy import create_engine
+            settings = PoolSettings()
+            engine = create_engine(database_url, **settings.engine_kwargs(database_url))
+            _install_statement_timeout(engine, settings.statement_timeout_sql(database_url))
+            engine.pool_metrics = PoolMetrics(engine.pool, _capacity(settings, database_url))
+            _engines[database_url] = engine
+        return engine
+
+
+def get_async_engine(database_url: str):
+    """Return the process-wide async engine for a URL, or None if no async driver is available"""
+    async_url = async_database_url(database_url)
+    if not async_url:
+        return None
+    with _engines_lock:
+        if async_url in _async_engines:
+            return _async_engines[async_url]
+        from sqlalchemy.ext.asyncio import create_async_engine
+        settings = PoolSettings()
+        try:
+            engine = create_async_engine(async_url, **settings.engine_kwargs(async_url))
+            _install_statement_timeout(engine.sync_engine, settings.statement_timeout_sql(async_url))
+            engine.sync_engine.pool_metrics = PoolMetrics(engine.sync_engine.pool, _capacity(settings, async_url))
+        except Exception as e:
+            print(f"Warning: Async database driver unavailable ({e}); using thread offload for SQL")
+            engine = None
+        _async_engines[async_url] = engine
+        return engine
+
+
+@contextmanager
+def connect(engine):
+    """engine.connect() that records how long the pool checkout waited"""
+    start = time.perf_counter()
+    conn = engine.connect()
+    metrics_for(engine).record_wait(time.perf_counter() - start)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+@asynccontextmanager
+async def aconnect(engine):
+    """Async counterpart of `connect`"""
+    start = time.perf_counter()
+    conn = await engine.connect().start()
+    metrics_for(engine).record_wait(time.perf_counter() - start)
+    try:
+        yield conn
+    finally:
+        await conn.close()
+
+
+def warm_pool(engine, connections: int):
+    """Open `connections` pooled connections in parallel so first requests skip the TLS handshake"""
+    if connections <= 0:
+        return
+    from sqlalchemy import text
+    # Hold every connection until all are open, otherwise the pool would hand out the same one
+    barrier = threading.Barrier(connections, timeout=30)
+
+    def ping(_):
+        with connect(engine) as conn:
+            conn.execute(text("SELECT 1"))
+            barrier.wait()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=connections) as executor:
+        list(executor.map(ping, range(connections)))
+    print(f"Warmed {connections} pooled connections in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+
+async def awarm_pool(engine, connections: int):
+    """Async counterpart of `warm_pool`"""
+    if connections <= 0:
+        return
+    from sqlalchemy import text
+    barrier = asyncio.Barrier(connections)
+
+    async def ping():
+        async with aconnect(engine) as conn:
+            await conn.execute(text("SELECT 1"))
+            await barrier.wait()
+
+    start = time.perf_counter()
+    await asyncio.wait_for(asyncio.gather(*(ping() for _ in range(connections))), 30)
+    print(f"Warmed {connections} async pooled connections in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+
+def pool_stats() -> dict:
+    """Metrics for every engine created by this module"""
+    with _engines_lock:
+        stats = {}
+        for url, engine in _engines.items():
+            stats[f"sync:{url.partition('://')[0]}"] = metrics_for(engine).stats()
+        for url, engine in _async_engines.items():
+            if engine is not None:
+                stats[f"async:{url.partition('://')[0]}"] = metrics_for(engine).stats()
+        return stats
@@ -0,0 +1,147 @@
+# Response encoders for /query: row-dict JSON (default), columnar JSON, Arrow IPC and Parquet
+#
+# orjson serializes datetimes/UUIDs natively and is used when installed;
+# pyarrow is optional and only needed for the Arrow/Parquet formats.
+
+import importlib.util
+import io
+import json
+from datetime import date, datetime, time as dt_time
+from decimal import Decimal
+
+from fastapi import Response
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+JSON = "application/json"
+COLUMNAR_JSON = "application/vnd.vanna.columnar+json"
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+ARROW_FILE = "application/vnd.apache.arrow.file"
+PARQUET = "application/vnd.apache.parquet"
+
+# Accept media types -> response format
+_FORMATS = {
+    JSON: JSON,
+    COLUMNAR_JSON: COLUMNAR_JSON,
+    ARROW_STREAM: ARROW_STREAM,
+    ARROW_FILE: ARROW_FILE,
+    PARQUET: PARQUET,
+    "application/x-parquet": PARQUET,
+}
+BINARY_FORMATS = (ARROW_STREAM, ARROW_FILE, PARQUET)
+
+# pyarrow is imported on first Arrow/Parquet response, not at startup
+_HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None
+
+
+class NotAcceptable(Exception):
+    pass
+
+
+def json_default(value):
+    """Encode values orjson/json cannot, the way FastAPI's jsonable_encoder does"""
+    if isinstance(value, Decimal):
+        # Same rule as FastAPI: integral decimals become ints, the rest floats
+        return int(value) if value.as_tuple().exponent >= 0 else float(value)
+    if isinstance(value, (datetime, date, dt_time)):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return "<binary data>"
+    return str(value)
+
+
+def dumps(obj) -> bytes:
+    """Compact JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=json_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=json_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """JSONResponse backed by orjson (stdlib json when orjson is not installed)"""
+
+    media_type = JSON
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def negotiate(accept: str | None) -> str:
+    """
+    Response format for an Accept header: the first listed supported type
+    wins (q-values are not weighed). Row-dict JSON is the default, including
+    for */* and missing headers. Raises NotAcceptable for Arrow/Parquet
+    without pyarrow.
+    """
+    for part in (accept or "").split(","):
+        media_type = part.split(";")[0].strip().lower()
+        fmt = _FORMATS.get(media_type)
+        if fmt is None:
+            continue
+        if fmt in BINARY_FORMATS and not _HAS_PYARROW:
+            raise NotAcceptable(f"{media_type} needs pyarrow, which is not installed on this server")
+        return fmt
+    return JSON
+
+
+def to_columns(rows: list[dict]) -> tuple[list, list[list]]:
+    """Row dicts -> (column names, one value list per column)"""
+    if not rows:
+        return [], []
+    columns = list(rows[0].keys())
+    return columns, [[row.get(column) for row in rows] for column in columns]
+
+
+def _arrow_table(columns: list, arrays: list, metadata: dict):
+    import pyarrow
+    fields = []
+    for values in arrays:
+        try:
+            fields.append(pyarrow.array(values))
+        except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+            # Mixed-type column: fall back to its JSON text representation
+            text = [v if v is None or isinstance(v, str) else str(json_default(v)) for v in values]
+            fields.append(pyarrow.array(text, type=pyarrow.string()))
+    meta = {key: value if isinstance(value, str) else dumps(value).decode("utf-8")
+            for key, value in metadata.items() if value is not None}
+    return pyarrow.table(fields, names=columns).replace_schema_metadata(meta)
+
+
+def encode_query_result(fmt: str, result: dict) -> Response:
+    """
+    Encode a /query result ({"sql", "data", "chartType", "message",
+    "nextPage", "truncated"}) in the negotiated format.
+    """
+    if fmt == JSON:
+        return FastJSONResponse(result)
+
+    columns, arrays = to_columns(result["data"])
+    if fmt == COLUMNAR_JSON:
+        body = {key: value for key, value in result.items() if key != "data"}
+        body.update({"columns": columns, "data": arrays, "rowCount": len(result["data"])})
+        return Response(content=dumps(body), media_type=COLUMNAR_JSON)
+
+    # Binary formats carry the query metadata in the schema and in headers
+    metadata = {key: value for key, value in result.items() if key != "data"}
+    table = _arrow_table(columns, arrays, metadata)
+    sink = io.BytesIO()
+    if fmt == ARROW_STREAM:
+        import pyarrow.ipc
+        with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    elif fmt == ARROW_FILE:
+        import pyarrow.ipc
+        with pyarrow.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        import pyarrow.parquet as pq
+        pq.write_table(table, sink)
+    headers = {"X-Row-Count": str(table.num_rows), "X-Truncated": str(bool(result.get("truncated"))).lower()}
+    if result.get("nextPage"):
+        headers["X-Next-Page"] = result["nextPage"]
+    if result.get("chartType"):
+        headers["X-Chart-Type"] = result["chartType"]
+    return Response(content=sink.getvalue(), media_type=fmt, headers=headers)
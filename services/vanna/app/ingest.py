@@ -0,0 +1,422 @@
+"""
+Bulk load of the invoice dataset (data/Analytics_Test_Data.json) into PostgreSQL.
+
+    python -m app.ingest [path] [--batch-size 1000] [--workers 4] [--on-conflict update|skip]
+
+Documents are stream-parsed (with ijson when it is installed) and mapped as
+apps/web/prisma/seed.ts does. Vendors and customers are deduplicated by
+name in memory. Batches of invoices with their line items and payments are
+COPYed into temporary staging tables by parallel workers and merged with
+one INSERT ... ON CONFLICT ("invoiceNumber") per table, so re-running a
+load is idempotent.
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+DEFAULT_DATA = os.path.join(REPO_ROOT, "data", "Analytics_Test_Data.json")
+
+
+def _value(node, *path):
+    for key in path:
+        if not isinstance(node, dict):
+            return None
+        node = node.get(key)
+    return node
+
+
+def _date(value) -> datetime | None:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def _text(value) -> str | None:
+    return str(value) if value not in (None, "") else None
+
+
+def map_document(document: dict) -> dict | None:
+    """
+    One extraction document as {vendor, customer, invoice, line_items, payments},
+    or None for documents the Prisma seed skips (no vendor name or invoice number).
+    """
+    llm = _value(document, "extractedData", "llmData")
+    if not isinstance(llm, dict):
+        return None
+    vendor_name = _value(llm, "vendor", "value", "vendorName", "value")
+    invoice_number = _value(llm, "invoice", "value", "invoiceId", "value") or document.get("_id")
+    if not vendor_name or not invoice_number:
+        return None
+    customer_name = _value(llm, "customer", "value", "customerName", "value")
+
+    invoice_date = _date(_value(llm, "invoice", "value", "invoiceDate", "value")) or \
+        _date(_value(document, "createdAt", "$date")) or datetime.now()
+    sub_total = _value(llm, "summary", "value", "subTotal", "value") or 0
+    tax = _value(llm, "summary", "value", "totalTax", "value") or 0
+    total = _value(llm, "summary", "value", "invoiceTotal", "value") or sub_total
+    items = _value(llm, "lineItems", "value", "items", "value") or []
+    # The seed reads no payments from extraction documents; exports that carry them use its InvoiceData shape
+    payments = document.get("payments") or []
+    return {
+        "vendor": {"name": str(vendor_name), "address": _value(llm, "vendor", "value", "vendorAddress", "value") or None},
+        "customer": {"name": str(customer_name), "address": _value(llm, "customer", "value", "customerAddress", "value") or None}
+        if customer_name else None,
+        "invoice": {
+            "invoiceNumber": str(invoice_number),
+            "date": invoice_date,
+            "dueDate": _date(_value(llm, "payment", "value", "dueDate", "value")),
+            "amount": abs(float(sub_total)),
+            "tax": abs(float(tax)) if tax else None,
+            "total": abs(float(total)),
+            # The seed marks every imported invoice as pending
+            "status": "pending",
+            "notes": document.get("name") or None,
+        },
+        "line_items": [
+            {
+                "description": _value(item, "description", "value") or "Item",
+                "quantity": float(_value(item, "quantity", "value") or 1),
+                "unitPrice": abs(float(_value(item, "unitPrice", "value") or 0)),
+                "amount": abs(float(_value(item, "totalPrice", "value") or 0)),
+                # The seed uses the booking account (Sachkonto) as the category
+                "category": _text(_value(item, "Sachkonto", "value")),
+            }
+            for item in items if isinstance(item, dict)
+        ],
+        "payments": [
+            {
+                "amount": abs(float(payment.get("amount") or 0)),
+                "paymentDate": _date(payment.get("payment_date")),
+                "method": _text(payment.get("method")),
+                "reference": _text(payment.get("reference")),
+                "notes": _text(payment.get("notes")),
+            }
+            for payment in payments if isinstance(payment, dict) and _date(payment.get("payment_date"))
+        ],
+    }
+
+
+def load_documents(path: str) -> list:
+    """All documents of a file, parsed at once"""
+    with open(path, encoding="utf-8") as f:
+        parsed = json.load(f)
+    return parsed if isinstance(parsed, list) else (parsed.get("invoices") or parsed.get("data") or [])
+
+
+def iter_documents(path: str):
+    """
+    Yield the documents of a top-level array (or of an object's `invoices`
+    or `data` array) one at a time. Without ijson the file is parsed at once.
+    """
+    if ijson is None:
+        yield from load_documents(path)
+        return
+    with open(path, "rb") as f:
+        head = f.read(4096).lstrip()
+    prefixes = ("item",) if head.startswith(b"[") else ("invoices.item", "data.item")
+    for prefix in prefixes:
+        found = False
+        with open(path, "rb") as f:
+            for document in ijson.items(f, prefix, use_float=True):
+                found = True
+                yield document
+        if found:
+            return
+
+
+_STAGING_SQL = """
+CREATE TEMP TABLE stage_invoices (
+    id text, "invoiceNumber" text, date timestamp, "dueDate" timestamp, amount numeric, tax numeric,
+    total numeric, status text, "vendorId" text, "customerId" text, notes text
+) ON COMMIT DROP;
+CREATE TEMP TABLE stage_line_items (
+    id text, "invoiceNumber" text, description text, quantity numeric, "unitPrice" numeric, amount numeric,
+    category text
+) ON COMMIT DROP;
+CREATE TEMP TABLE stage_payments (
+    id text, "invoiceNumber" text, amount numeric, "paymentDate" timestamp, method text, reference text,
+    notes text
+) ON COMMIT DROP;
+CREATE TEMP TABLE stage_merged (id text, "invoiceNumber" text, inserted boolean) ON COMMIT DROP;
+"""
+
+_INVOICE_COLUMNS = ("id", "invoiceNumber", "date", "dueDate", "amount", "tax", "total", "status",
+                    "vendorId", "customerId", "notes")
+_LINE_ITEM_COLUMNS = ("id", "invoiceNumber", "description", "quantity", "unitPrice", "amount", "category")
+_PAYMENT_COLUMNS = ("id", "invoiceNumber", "amount", "paymentDate", "method", "reference", "notes")
+
+_MERGE_INVOICES_SQL = """
+WITH merged AS (
+    INSERT INTO invoices (id, "invoiceNumber", date, "dueDate", amount, tax, total, status, "vendorId",
+                          "customerId", notes, "createdAt", "updatedAt")
+    SELECT id, "invoiceNumber", date, "dueDate", amount, tax, total, status, "vendorId", "customerId", notes,
+           now(), now()
+    FROM stage_invoices
+    ON CONFLICT ("invoiceNumber") DO {action}
+    RETURNING id, "invoiceNumber", xmax = 0
+)
+INSERT INTO stage_merged SELECT * FROM merged
+"""
+
+_UPDATE_ACTION = """UPDATE SET date = EXCLUDED.date, "dueDate" = EXCLUDED."dueDate", amount = EXCLUDED.amount,
+        tax = EXCLUDED.tax, total = EXCLUDED.total, status = EXCLUDED.status, "vendorId" = EXCLUDED."vendorId",
+        "customerId" = EXCLUDED."customerId", notes = EXCLUDED.notes, "updatedAt" = now()"""
+
+_MERGE_CHILDREN_SQL = (
+    'DELETE FROM line_items WHERE "invoiceId" IN (SELECT id FROM stage_merged WHERE NOT inserted)',
+    'DELETE FROM payments WHERE "invoiceId" IN (SELECT id FROM stage_merged WHERE NOT inserted)',
+    """INSERT INTO line_items (id, "invoiceId", description, quantity, "unitPrice", amount, category, "createdAt")
+       SELECT s.id, m.id, s.description, s.quantity, s."unitPrice", s.amount, s.category, now()
+       FROM stage_line_items s JOIN stage_merged m ON m."invoiceNumber" = s."invoiceNumber\"""",
+    """INSERT INTO payments (id, "invoiceId", amount, "paymentDate", method, reference, notes, "createdAt")
+       SELECT s.id, m.id, s.amount, s."paymentDate", s.method, s.reference, s.notes, now()
+       FROM stage_payments s JOIN stage_merged m ON m."invoiceNumber" = s."invoiceNumber\"""",
+)
+
+
+class _Batch:
+    __slots__ = ("number", "invoices", "line_items", "payments")
+
+    def __init__(self, number: int):
+        self.number = number
+        self.invoices: list[tuple] = []
+        self.line_items: list[tuple] = []
+        self.payments: list[tuple] = []
+
+
+def _copy_rows(cursor, table: str, columns: tuple, rows: list):
+    column_list = ", ".join(f'"{c}"' for c in columns)
+    with cursor.copy(f"COPY {table} ({column_list}) FROM STDIN") as copy:
+        for row in rows:
+            copy.write_row(row)
+
+
+class Ingestor:
+    """
+    Loads mapped documents in batches over `workers` pooled connections.
+
+    Mapping, deduplication and vendor/customer creation happen on the
+    calling thread, so workers only ever see distinct invoice numbers and
+    existing parties. With `on_conflict="update"` existing invoices are
+    updated and their line items and payments replaced; with "skip" they
+    are left as they are (the seed's `upsert` with an empty update).
+    """
+
+    def __init__(self, engine, batch_size: int = 1000, workers: int = 4, on_conflict: str = "update"):
+        if engine.dialect.name != "postgresql":
+            raise Exception(f"Failed to start ingestion: COPY needs PostgreSQL, not {engine.dialect.name}")
+        if on_conflict not in ("update", "skip"):
+            raise ValueError(f"on_conflict must be 'update' or 'skip', not {on_conflict!r}")
+        self.engine = engine
+        self.batch_size = max(1, batch_size)
+        self.workers = max(1, workers)
+        self.on_conflict = on_conflict
+        self._merge_sql = _MERGE_INVOICES_SQL.format(action=_UPDATE_ACTION if on_conflict == "update" else "NOTHING")
+        self._lock = threading.Lock()
+        self.counts = {
+            "documents": 0, "skipped": 0, "duplicates": 0, "vendors": 0, "customers": 0,
+            "inserted": 0, "updated": 0, "unchanged": 0, "line_items": 0, "payments": 0, "failed_batches": 0,
+        }
+
+    def _execute(self, work):
+        """Run `work(cursor)` in one transaction on a raw psycopg connection"""
+        connection = self.engine.raw_connection()
+        try:
+            driver = connection.driver_connection
+            try:
+                with driver.cursor() as cursor:
+                    # Large batches may take longer than the service's per-statement limit
+                    cursor.execute("SET LOCAL statement_timeout = 0")
+                    result = work(cursor)
+                driver.commit()
+                return result
+            except Exception:
+                driver.rollback()
+                raise
+        finally:
+            connection.close()
+
+    def _known_parties(self, table: str) -> dict:
+        """name -> id of existing rows, the oldest per name as the seed's findFirst returns"""
+        def read(cursor):
+            cursor.execute(f'SELECT DISTINCT ON (name) name, id FROM {table} ORDER BY name, "createdAt", id')
+            return dict(cursor.fetchall())
+        return self._execute(read)
+
+    def _create_parties(self, vendors: list, customers: list):
+        now = datetime.now()
+
+        def write(cursor):
+            if vendors:
+                _copy_rows(cursor, "vendors", ("id", "name", "address", "createdAt", "updatedAt"),
+                           [(vid, name, address, now, now) for vid, name, address in vendors])
+            if customers:
+                _copy_rows(cursor, "customers", ("id", "name", "address", "createdAt", "updatedAt"),
+                           [(cid, name, address, now, now) for cid, name, address in customers])
+        self._execute(write)
+        self.counts["vendors"] += len(vendors)
+        self.counts["customers"] += len(customers)
+
+    def _load_batch(self, batch: _Batch) -> dict:
+        def write(cursor):
+            cursor.execute(_STAGING_SQL)
+            _copy_rows(cursor, "stage_invoices", _INVOICE_COLUMNS, batch.invoices)
+            _copy_rows(cursor, "stage_line_items", _LINE_ITEM_COLUMNS, batch.line_items)
+            _copy_rows(cursor, "stage_payments", _PAYMENT_COLUMNS, batch.payments)
+            cursor.execute(self._merge_sql)
+            cursor.execute("SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM stage_merged")
+            inserted, updated = cursor.fetchone()
+            written = []
+            for statement in _MERGE_CHILDREN_SQL:
+                cursor.execute(statement)
+                written.append(cursor.rowcount)
+            return {"inserted": inserted, "updated": updated, "unchanged": len(batch.invoices) - inserted - updated,
+                    "line_items": written[2], "payments": written[3]}
+        return self._execute(write)
+
+    def _finished(self, future, batch: _Batch):
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"Warning: Batch {batch.number} ({len(batch.invoices)} invoices) failed: {e}")
+            with self._lock:
+                self.counts["failed_batches"] += 1
+            return
+        with self._lock:
+            for key, value in result.items():
+                self.counts[key] += value
+
+    def run(self, documents) -> dict:
+        """Load an iterable of extraction documents; returns row counts and rows per second"""
+        start = time.perf_counter()
+        vendors = self._known_parties("vendors")
+        customers = self._known_parties("customers")
+        seen: set[str] = set()
+        new_vendors, new_customers = [], []
+        pending: dict = {}
+        batch = _Batch(1)
+        last_report = start
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            def submit(current: _Batch):
+                # Parties first: the batch's invoices reference them
+                if new_vendors or new_customers:
+                    self._create_parties(new_vendors, new_customers)
+                    new_vendors.clear()
+                    new_customers.clear()
+                # At most two batches per worker in memory
+                while len(pending) >= 2 * self.workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._finished(future, pending.pop(future))
+                pending[executor.submit(self._load_batch, current)] = current
+
+            for document in documents:
+                self.counts["documents"] += 1
+                record = map_document(document) if isinstance(document, dict) else None
+                if record is None:
+                    self.counts["skipped"] += 1
+                    continue
+                invoice = record["invoice"]
+                number = invoice["invoiceNumber"]
+                if number in seen:
+                    # As in the seed, the first document with an invoice number wins
+                    self.counts["duplicates"] += 1
+                    continue
+                seen.add(number)
+
+                vendor = record["vendor"]
+                vendor_id = vendors.get(vendor["name"])
+                if vendor_id is None:
+                    vendor_id = vendors[vendor["name"]] = str(uuid.uuid4())
+                    new_vendors.append((vendor_id, vendor["name"], vendor["address"]))
+                customer_id = None
+                if record["customer"]:
+                    customer = record["customer"]
+                    customer_id = customers.get(customer["name"])
+                    if customer_id is None:
+                        customer_id = customers[customer["name"]] = str(uuid.uuid4())
+                        new_customers.append((customer_id, customer["name"], customer["address"]))
+
+                batch.invoices.append((
+                    str(uuid.uuid4()), number, invoice["date"], invoice["dueDate"], invoice["amount"], invoice["tax"],
+                    invoice["total"], invoice["status"], vendor_id, customer_id, invoice["notes"],
+                ))
+                for item in record["line_items"]:
+                    batch.line_items.append((str(uuid.uuid4()), number, item["description"], item["quantity"],
+                                             item["unitPrice"], item["amount"], item["category"]))
+                for payment in record["payments"]:
+                    batch.payments.append((str(uuid.uuid4()), number, payment["amount"], payment["paymentDate"],
+                                           payment["method"], payment["reference"], payment["notes"]))
+
+                if len(batch.invoices) >= self.batch_size:
+                    submit(batch)
+                    batch = _Batch(batch.number + 1)
+                    now = time.perf_counter()
+                    if now - last_report >= 5:
+                        last_report = now
+                        print(f"Ingest: {self.counts['documents']} documents read, "
+                              f"{self.counts['inserted'] + self.counts['updated']} invoices written")
+            if batch.invoices:
+                submit(batch)
+            for future in list(pending):
+                self._finished(future, pending.pop(future))
+
+        elapsed = time.perf_counter() - start
+        counts = dict(self.counts)
+        rows = (counts["vendors"] + counts["customers"] + counts["inserted"] + counts["updated"]
+                + counts["line_items"] + counts["payments"])
+        counts["rows"] = rows
+        counts["seconds"] = round(elapsed, 3)
+        counts["rows_per_second"] = round(rows / elapsed, 1) if elapsed > 0 else None
+        return counts
+
+
+def main():
+    from dotenv import load_dotenv
+    from app import db
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("path", nargs="?", default=DEFAULT_DATA)
+    parser.add_argument("--database-url", default=None, help="defaults to DATABASE_URL")
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("INGEST_BATCH_SIZE", "1000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("INGEST_WORKERS", "4")))
+    parser.add_argument("--on-conflict", choices=("update", "skip"), default="update",
+                        help="existing invoiceNumber: update it and replace its items, or leave it as is")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        sys.exit(f"{args.path} not found")
+    database_url = db.normalize_database_url(args.database_url) if args.database_url else db.database_url_from_env()
+    if ijson is None:
+        print("Warning: ijson is not installed; the whole file is parsed in memory (pip install ijson)")
+    try:
+        ingestor = Ingestor(db.get_engine(database_url), args.batch_size, args.workers, args.on_conflict)
+        counts = ingestor.run(iter_documents(args.path))
+    except Exception as e:
+        sys.exit(str(e))
+    print(json.dumps(counts))
+    print(f"Loaded {counts['rows']} rows in {counts['seconds']}s ({counts['rows_per_second']} rows/s)")
+    if counts["failed_batches"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
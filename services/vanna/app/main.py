@@ -1,17 +1,196 @@
-from fastapi import FastAPI, HTTPException
+import time
+
+# Measured from the top of this module so startup regressions show up in /ready
+_MODULE_START = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
+import asyncio
 import os
 import socket
-import time
 import re
+import sys
+from contextlib import asynccontextmanager
 from urllib.parse import urlparse
 from dotenv import load_dotenv
-from app.vanna_config import get_vanna_instance
+from app import db, encoding, metrics
+from app.cost_guard import QueryTooExpensive
+from app.pagination import InvalidPageToken
+from app.sql_errors import classify_sql_error
 
 load_dotenv()
 
-app = FastAPI(title="Vanna AI Service", version="1.0.0")
+
+def get_vanna_instance():
+    """Return the shared Vanna instance; app.vanna_config (SQLAlchemy, Groq) is imported on first use"""
+    from app.vanna_config import get_vanna_instance as _get_vanna_instance
+    return _get_vanna_instance()
+
+
+# Build the Vanna instance, warm pools and load the schema at startup instead of on the first /query
+EAGER_INIT = os.getenv("VANNA_EAGER_INIT", "true").lower() in ("1", "true", "yes")
+# Seconds between warm-up attempts while the database or Groq configuration is unavailable
+WARMUP_RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", "10"))
+# Seconds between background schema catalog refreshes (0 disables)
+SCHEMA_REFRESH_SECONDS = float(os.getenv("SCHEMA_REFRESH_SECONDS", "300"))
+# Seconds between metric snapshots published for /metrics when several workers run
+METRICS_PUBLISH_SECONDS = float(os.getenv("METRICS_PUBLISH_SECONDS", "5"))
+
+
+class WarmupState:
+    """Readiness and startup timings reported by /ready"""
+
+    def __init__(self):
+        self.ready = False
+        self.error: str | None = None
+        self.attempts = 0
+        self.import_ms: float | None = None
+        self.warmup_ms: float | None = None
+        self.ready_ms: float | None = None
+
+    def as_dict(self) -> dict:
+        return {
+            "ready": self.ready,
+            "error": self.error,
+            "attempts": self.attempts,
+            "startup": {
+                "import_ms": self.import_ms,
+                "warmup_ms": self.warmup_ms,
+                "ready_ms": self.ready_ms,
+            },
+        }
+
+
+warmup_state = WarmupState()
+
+
+async def warm_up():
+    """Build the Vanna instance, warm the pools and schema; retries until it succeeds"""
+    while True:
+        warmup_state.attempts += 1
+        start = time.perf_counter()
+        try:
+            vanna = await asyncio.to_thread(get_vanna_instance)
+            await vanna.awarm_up()
+        except Exception as e:
+            warmup_state.error = str(e).splitlines()[0] if str(e) else type(e).__name__
+            print(f"Warm-up attempt {warmup_state.attempts} failed: {warmup_state.error}")
+            await asyncio.sleep(WARMUP_RETRY_SECONDS)
+            continue
+        now = time.perf_counter()
+        warmup_state.warmup_ms = round((now - start) * 1000, 1)
+        warmup_state.ready_ms = round((now - _MODULE_START) * 1000, 1)
+        warmup_state.error = None
+        warmup_state.ready = True
+        print(f"Warm-up finished in {warmup_state.warmup_ms}ms ({warmup_state.ready_ms}ms since start)")
+        return
+
+
+async def refresh_schema_periodically():
+    """Re-read the schema catalog every SCHEMA_REFRESH_SECONDS once the instance exists"""
+    from app import vanna_config
+    while True:
+        await asyncio.sleep(SCHEMA_REFRESH_SECONDS)
+        vanna = vanna_config._vanna_instance
+        if vanna is None:
+            continue
+        try:
+            await asyncio.to_thread(vanna.refresh_schema)
+        except Exception as e:
+            print(f"Warning: Schema refresh failed: {e}")
+
+
+async def publish_metrics_periodically():
+    """Publish this worker's metric snapshot every METRICS_PUBLISH_SECONDS for the other workers' /metrics"""
+    while True:
+        await asyncio.sleep(METRICS_PUBLISH_SECONDS)
+        try:
+            await asyncio.to_thread(_publish_metrics)
+        except Exception as e:
+            print(f"Warning: Could not publish metrics: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warmup_state.import_ms = round((time.perf_counter() - _MODULE_START) * 1000, 1)
+    print(f"Service modules imported in {warmup_state.import_ms}ms")
+    tasks = []
+    if EAGER_INIT:
+        tasks.append(asyncio.create_task(warm_up()))
+    if SCHEMA_REFRESH_SECONDS > 0:
+        tasks.append(asyncio.create_task(refresh_schema_periodically()))
+    from app.shared_store import worker_count
+    multi_worker = worker_count() > 1
+    if multi_worker and METRICS_PUBLISH_SECONDS > 0:
+        tasks.append(asyncio.create_task(publish_metrics_periodically()))
+    yield
+    for task in tasks:
+        if not task.done():
+            task.cancel()
+    if multi_worker:
+        try:
+            await asyncio.to_thread(_retire_metrics)
+        except Exception as e:
+            print(f"Warning: Could not retire metrics: {e}")
+
+
+app = FastAPI(title="Vanna AI Service", version="1.0.0", lifespan=lifespan)
+
+# Per-stage time budgets for the /query pipeline (seconds)
+GENERATE_SQL_TIMEOUT = float(os.getenv("GENERATE_SQL_TIMEOUT", "60"))
+RUN_SQL_TIMEOUT = float(os.getenv("RUN_SQL_TIMEOUT", "30"))
+# Rows per batch emitted by /query/stream
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+# /query/batch: questions per request, concurrent SQL generations and executions, overall budget
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "100"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+BATCH_SQL_CONCURRENCY = int(os.getenv("BATCH_SQL_CONCURRENCY", "4"))
+BATCH_TIMEOUT = float(os.getenv("BATCH_TIMEOUT", "300"))
+# How often an in-flight stage checks whether the client has gone away
+DISCONNECT_POLL_INTERVAL = 0.5
+
+
+class StageTimeout(Exception):
+    def __init__(self, stage: str, timeout: float):
+        super().__init__(f"{stage} timeout after {timeout:g}s")
+        self.stage = stage
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+async def _wait_for_disconnect(request: Request):
+    while not await request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+
+async def run_stage(request: Request | None, stage: str, awaitable, timeout: float):
+    """
+    Await one pipeline stage with a time budget.
+
+    The stage is cancelled if it exceeds `timeout` (StageTimeout) or if the
+    client disconnects first (ClientDisconnected), so abandoned questions stop
+    consuming Groq and database capacity. With `request=None` only the time
+    budget applies (the caller already watches the connection).
+    """
+    task = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(_wait_for_disconnect(request)) if request is not None else None
+    try:
+        done, _ = await asyncio.wait({task, watcher} - {None}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if task in done:
+            return task.result()
+        task.cancel()
+        if watcher in done:
+            raise ClientDisconnected(stage)
+        raise StageTimeout(stage, timeout)
+    finally:
+        if not task.done():
+            task.cancel()
+        if watcher is not None:
+            watcher.cancel()
 
 
 def format_sql_error(error_msg: str, sql: str) -> str:
@@ -25,10 +204,11 @@ def format_sql_error(error_msg: str, sql: str) -> str:
     Returns:
         A friendly, actionable error message
     """
-    error_lower = error_msg.lower()
+    category = classify_sql_error(error_msg)
+    metrics.SQL_ERRORS.inc(category)
     
     # Column does not exist
-    if "column" in error_lower and ("does not exist" in error_lower or "not found" in error_lower or "undefinedcolumn" in error_lower):
+    if category == "column_not_found":
         # Extract column name from error
         match = re.search(r"column ['\"]?(\w+\.)?(\w+)['\"]? does not exist", error_msg, re.IGNORECASE)
         if match:
@@ -45,7 +225,7 @@ def format_sql_error(error_msg: str, sql: str) -> str:
         )
     
     # Table does not exist
-    if "table" in error_lower and ("does not exist" in error_lower or "not found" in error_lower):
+    if category == "table_not_found":
         match = re.search(r"table ['\"]?(\w+\.)?(\w+)['\"]?", error_msg, re.IGNORECASE)
         if match:
             table_name = match.group(2)
@@ -60,56 +240,64 @@ def format_sql_error(error_msg: str, sql: str) -> str:
         )
     
     # Syntax error
-    if "syntax error" in error_lower or "syntaxerror" in error_lower:
+    if category == "syntax":
         return (
             "I generated SQL with a syntax error. This usually happens when the question is ambiguous "
             "or uses terms that are hard to translate to SQL. Could you try rephrasing your question more simply?"
         )
     
     # Ambiguous column reference
-    if "ambiguous" in error_lower:
+    if category == "ambiguous_column":
         return (
             "I generated a query that references a column name that exists in multiple tables. "
             "Try being more specific about which table you want to query, or simplify your question."
         )
     
     # Permission denied
-    if "permission denied" in error_lower or "access denied" in error_lower:
+    if category == "permission":
         return (
             "I don't have permission to access that data. This might be a database permissions issue. "
             "Please contact your administrator if you need access to this information."
         )
     
     # Division by zero
-    if "division by zero" in error_lower or "divide by zero" in error_lower:
+    if category == "division_by_zero":
         return (
             "The calculation resulted in a division by zero. This can happen when filtering returns no results "
             "or when computing averages/percentages with empty datasets. Try adjusting your filters."
         )
     
     # Type mismatch
-    if "type" in error_lower and ("mismatch" in error_lower or "cannot" in error_lower or "invalid" in error_lower):
+    if category == "type_mismatch":
         return (
             "I tried to compare or combine values of different types (like comparing text to numbers). "
             "This usually means the question needs to be rephrased or the data types are unexpected."
         )
     
     # Aggregate function error
-    if any(func in error_lower for func in ["sum", "avg", "count", "min", "max"]) and ("group by" in error_lower or "aggregate" in error_lower):
+    if category == "aggregate":
         return (
             "There's an issue with how I'm grouping or aggregating the data. "
             "Try simplifying your question or asking for one metric at a time."
         )
     
+    # Rejected before execution by the EXPLAIN cost guard
+    if category == "too_expensive":
+        return (
+            "This question would need a very expensive query (for example joining large tables without a "
+            "link between them), so I didn't run it. Try narrowing it down, e.g. to a date range, a vendor "
+            "or a single total."
+        )
+    
     # Connection/timeout errors
-    if any(word in error_lower for word in ["timeout", "connection", "network", "connect"]):
+    if category == "connection_or_timeout":
         return (
             "I couldn't connect to the database or the query took too long to execute. "
             "The database might be busy or temporarily unavailable. Please try again in a moment."
         )
     
     # Foreign key constraint
-    if "foreign key" in error_lower or "constraint" in error_lower:
+    if category == "constraint":
         return (
             "There's a data relationship issue preventing this operation. "
             "This usually happens when trying to reference data that doesn't exist or violates database rules."
@@ -130,6 +318,38 @@ def format_sql_error(error_msg: str, sql: str) -> str:
     )
 
 
+def detect_chart_type(row_count: int, first_row) -> str | None:
+    """Simple chart type detection from the row count and the first row"""
+    chart_type = None
+    if row_count > 0 and row_count <= 20:
+        if any(key in str(first_row).lower() for key in ['date', 'time', 'month']):
+            chart_type = "line"
+        elif row_count <= 10:
+            chart_type = "bar"
+    return chart_type
+
+
+def summarize_results(row_count: int, first_row) -> str:
+    """Build a short human-friendly message summarizing the results"""
+    if not row_count:
+        return "I ran the generated SQL but didn't find any matching rows. You can try rephrasing your question or broadening the filters."
+
+    # columns present in the first row
+    cols = list(first_row.keys()) if isinstance(first_row, dict) else []
+    # create a concise sample row for display
+    sample = None
+    try:
+        sample = {k: (str(v) if v is not None else "") for k, v in list(first_row.items())[:5]}
+    except Exception:
+        sample = str(first_row)
+
+    return (
+        f"I ran the SQL and found {row_count} row{'s' if row_count != 1 else ''}. "
+        f"Columns returned: {', '.join(cols[:8]) + (', ...' if len(cols) > 8 else '')}. "
+        f"Here's a sample row: {sample}"
+    )
+
+
 # CORS configuration
 origins = [
     "http://localhost:3000",
@@ -146,16 +366,44 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def request_context(request: Request, call_next):
+    """Tag the request with an id (X-Request-ID) for structured logs and record its latency"""
+    request_id = metrics.new_request_id(request.headers.get("x-request-id"))
+    token = metrics.request_id_var.set(request_id)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        # Route templates keep the label set bounded
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        metrics.REQUEST_SECONDS.observe(request.method, path, str(status), value=time.perf_counter() - start)
+        metrics.request_id_var.reset(token)
+
+
 class QueryRequest(BaseModel):
     question: str
 
 
+class BatchQueryRequest(BaseModel):
+    questions: list[str]
+
+
 class QueryResponse(BaseModel):
     sql: str
     data: list
     chartType: str | None = None
     # A short, human-friendly message describing the results (chat-style)
     message: str | None = None
+    # Signed continuation token for `/query?page=...` when more rows are available
+    nextPage: str | None = None
+    # True when rows beyond QUERY_ROW_LIMIT were cut off from this page
+    truncated: bool = False
 
 
 @app.get("/health")
@@ -163,6 +411,166 @@ async def health():
     return {"status": "healthy"}
 
 
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 503 until the startup warm-up has finished"""
+    if not EAGER_INIT and not warmup_state.ready:
+        # Lazy mode: ready once the first request has built the instance
+        from app import vanna_config
+        warmup_state.ready = vanna_config._vanna_instance is not None
+    return JSONResponse(warmup_state.as_dict(), status_code=200 if warmup_state.ready else 503)
+
+
+class InvalidateRequest(BaseModel):
+    # Tables whose cached results should be dropped; all tables when omitted
+    tables: list[str] | None = None
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss counters for the caches, in-flight coalescing and LLM dispatch"""
+    try:
+        vanna = get_vanna_instance()
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Vanna not initialized: {e}")
+    return {
+        "sql": vanna.sql_cache.stats(),
+        "results": vanna.result_cache.stats(),
+        "coalescing": {
+            "questions": vanna.inflight_questions.stats(),
+            "sql": vanna.inflight_sql.stats(),
+        },
+        "llm": vanna.llm_dispatcher.stats(),
+        "translation": vanna.translator.stats(),
+        "plans": vanna.cost_guard.stats(),
+        "repair": vanna.sql_repairer.stats(),
+        "rollups": vanna.rollups.stats(),
+        "shared": vanna.shared_store.stats() if vanna.shared_store is not None else None,
+    }
+
+
+@app.post("/cache/invalidate")
+async def cache_invalidate(request: InvalidateRequest):
+    """Drop cached query results, e.g. after seeding new invoices"""
+    try:
+        vanna = get_vanna_instance()
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Vanna not initialized: {e}")
+    return {"removed": vanna.invalidate_results(request.tables)}
+
+
+@app.get("/schema")
+async def schema():
+    """Cached schema catalog: columns with types, keys, indexes and the fingerprint"""
+    try:
+        vanna = await asyncio.to_thread(get_vanna_instance)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Vanna not initialized: {e}")
+    return vanna.catalog.describe()
+
+
+@app.post("/schema/refresh")
+async def schema_refresh():
+    """Re-read the schema now; cached SQL is dropped when it changed"""
+    try:
+        vanna = await asyncio.to_thread(get_vanna_instance)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Vanna not initialized: {e}")
+    changed = await asyncio.to_thread(vanna.refresh_schema, True)
+    return {"changed": changed, "fingerprint": vanna.schema_fingerprint, "tables": len(vanna.schema_info)}
+
+
+@app.get("/pool/stats")
+async def pool_stats():
+    """Connection pool size, saturation and checkout wait times"""
+    return db.pool_stats()
+
+
+def _loaded_vanna_instance():
+    """The Vanna instance if it has already been built; never triggers initialization"""
+    module = sys.modules.get("app.vanna_config")
+    return getattr(module, "_vanna_instance", None) if module else None
+
+
+def _metric_cache_stats(vanna) -> dict:
+    if vanna is None:
+        return {}
+    return {
+        "sql": vanna.sql_cache.stats(),
+        "results": vanna.result_cache.stats(),
+        "coalesce_questions": vanna.inflight_questions.stats(),
+        "coalesce_sql": vanna.inflight_sql.stats(),
+        "llm": vanna.llm_dispatcher.stats(),
+        "translation": vanna.translator.stats(),
+        "plans": vanna.cost_guard.stats(),
+        "repair": vanna.sql_repairer.stats(),
+        "rollups": vanna.rollups.stats(),
+        "shared": vanna.shared_store.stats() if vanna.shared_store is not None else None,
+    }
+
+
+# One metric snapshot per live worker, plus the retired totals, under a namespace of this
+# server (host and uvicorn parent process): other servers sharing a Redis are scraped separately
+_METRICS_NAMESPACE = f"metrics:{socket.gethostname()}:{os.getppid()}"
+_RETIRED_KEY = "retired"
+
+
+def _metrics_store():
+    """The shared store when several workers run and the instance exists, else None"""
+    from app.shared_store import worker_count
+    vanna = _loaded_vanna_instance()
+    if worker_count() <= 1 or vanna is None:
+        return None
+    return vanna.shared_store
+
+
+def _publish_metrics() -> dict | None:
+    """Store this worker's snapshot; it expires if the worker dies without retiring it"""
+    store = _metrics_store()
+    if store is None:
+        return None
+    snapshot = metrics.snapshot(_metric_cache_stats(_loaded_vanna_instance()), db.pool_stats())
+    store.set(_METRICS_NAMESPACE, snapshot["worker"], snapshot, ttl_seconds=max(3 * METRICS_PUBLISH_SECONDS, 30))
+    return snapshot
+
+
+def _retire_metrics():
+    """On a clean exit, add this worker's counters to the retired totals so merged counters never drop"""
+    store = _metrics_store()
+    if store is None:
+        return
+    final = metrics.snapshot()
+    store.set(_METRICS_NAMESPACE, _RETIRED_KEY, metrics.retire(store.get(_METRICS_NAMESPACE, _RETIRED_KEY), final))
+    store.delete(_METRICS_NAMESPACE, final["worker"])
+
+
+def _render_metrics() -> str:
+    own = _publish_metrics()
+    if own is None:
+        # One worker (or not initialized yet): this process's numbers are the whole picture
+        return metrics.render(cache_stats=_metric_cache_stats(_loaded_vanna_instance()), pool_stats=db.pool_stats())
+    store = _metrics_store()
+    workers, retired = {own["worker"]: own}, None
+    for key, value in store.items(_METRICS_NAMESPACE):
+        if key == _RETIRED_KEY:
+            retired = value
+        elif key != own["worker"]:
+            workers[key] = value
+    return metrics.render(workers=list(workers.values()), retired=retired)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """
+    Prometheus scrape endpoint: stage/request latency histograms, error counts, cache and pool stats.
+
+    With several workers the counters and histograms are summed over all of
+    them (from snapshots in the shared store), and gauges carry a `worker` label.
+    """
+    body = await asyncio.to_thread(_render_metrics)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+
 @app.get("/diag-db")
 async def diag_db():
     """Diagnostic endpoint: attempt a TCP connect to the configured DATABASE_URL host:port
@@ -210,56 +618,187 @@ async def diag_db():
         return {"ok": False, "host": host, "port": port, "error": str(e)}
 
 
-@app.post("/query", response_model=QueryResponse)
-async def query(request: QueryRequest):
+def _run_sql_direct(sql: str):
+    """Execute SQL on the shared engine for Vanna objects without run_sql/run"""
+    from sqlalchemy import text
+    engine = db.get_engine(db.database_url_from_env())
+    with db.connect(engine) as conn:
+        result = conn.execute(text(sql))
+        return [dict(row._mapping) for row in result]
+
+
+def _generate_sql(vanna, question: str):
+    """Awaitable SQL generation for whichever API the Vanna object has"""
+    if hasattr(vanna, 'agenerate_sql'):
+        return vanna.agenerate_sql(question=question)
+    if hasattr(vanna, 'generate_sql'):
+        return asyncio.to_thread(vanna.generate_sql, question=question)
+    if hasattr(vanna, 'ask'):
+        return asyncio.to_thread(vanna.ask, question)
+    # Fallback: try calling it directly
+    return asyncio.to_thread(vanna, question)
+
+
+async def execute_sql(http_request: Request | None, vanna, question: str | None, sql: str | None,
+                      page: str | None = None):
+    """
+    Run generated SQL (or continue a page) as the run_sql stage of /query.
+    Returns the final SQL and the results (a page dict or rows).
+
+    A plan rejected by the cost guard gets one regeneration with the reason as
+    a hint; SQL that fails to execute goes through the repair stage (local
+    fixes, then the model).
+    """
+    regenerated = False
+    repair = vanna.repair_session(question) if not page and hasattr(vanna, 'repair_session') else None
+    while True:
+        if hasattr(vanna, 'arun_sql_page'):
+            pending = vanna.arun_sql_page(sql=sql, page_token=page)
+        elif page:
+            raise HTTPException(status_code=400, detail="Pagination is not supported by this Vanna instance")
+        elif hasattr(vanna, 'arun_sql'):
+            pending = vanna.arun_sql(sql=sql)
+        elif hasattr(vanna, 'run_sql'):
+            pending = asyncio.to_thread(vanna.run_sql, sql=sql)
+        elif hasattr(vanna, 'run'):
+            pending = asyncio.to_thread(vanna.run, sql)
+        else:
+            # Fallback: execute directly using database connection
+            pending = asyncio.to_thread(_run_sql_direct, sql)
+        try:
+            with metrics.span("run_sql"):
+                results = await run_stage(http_request, "run_sql", pending, RUN_SQL_TIMEOUT)
+            break
+        except QueryTooExpensive as rejected:
+            if regenerated or page or not hasattr(vanna, 'aregenerate_sql'):
+                raise
+            regenerated = True
+            metrics.log_event("query.rejected", sql=sql, reason=rejected.verdict.reason)
+            with metrics.span("regenerate_sql"):
+                sql = await run_stage(
+                    http_request, "generate_sql",
+                    vanna.aregenerate_sql(question, sql, rejected.hint), GENERATE_SQL_TIMEOUT,
+                )
+            metrics.log_event("query.sql_generated", sql=sql, regenerated=True)
+        except (InvalidPageToken, ClientDisconnected, StageTimeout):
+            raise
+        except Exception as exec_error:
+            if repair is None:
+                raise
+            with metrics.span("repair_sql"):
+                repaired = await run_stage(http_request, "repair_sql", repair.next(sql, str(exec_error)), GENERATE_SQL_TIMEOUT)
+            if repaired is None:
+                raise
+            metrics.log_event("query.repaired", sql=repaired, error=str(exec_error).splitlines()[0])
+            sql = repaired
+    if repair is not None:
+        repair.succeeded(sql)
+    return sql, results
+
+
+def _rows_as_dicts(results) -> list:
+    """Convert results to list of dicts"""
+    if not results:
+        return []
+    if isinstance(results[0], dict):
+        return results
+    if isinstance(results[0], tuple) or isinstance(results[0], list):
+        # If results are tuples/lists, try to get column names
+        try:
+            # Try to get column names from result object
+            if hasattr(results, 'keys'):
+                columns = list(results.keys())
+            else:
+                # Fallback: use generic column names
+                columns = [f"column_{i+1}" for i in range(len(results[0]))]
+            return [dict(zip(columns, row)) for row in results]
+        except Exception:
+            return [{"result": str(row)} for row in results]
+    return [{"result": str(row)} for row in results]
+
+
+def _query_payload(sql: str, data: list, page_result: dict | None) -> dict:
+    """The QueryResponse body: rows plus chart type, summary message and paging fields"""
+    with metrics.span("chart"):
+        chart_type = detect_chart_type(len(data), data[0] if data else None)
+        message = summarize_results(len(data), data[0] if data else None)
+    truncated = bool(page_result and page_result["truncated"])
+    if truncated:
+        message += f" Showing the first {len(data)} rows; more are available."
+    return {
+        "sql": sql,
+        "data": data,
+        "chartType": chart_type,
+        "message": message,
+        "nextPage": page_result["next_page"] if page_result else None,
+        "truncated": truncated,
+    }
+
+
+@app.post("/query", response_model=QueryResponse, response_class=encoding.FastJSONResponse)
+async def query(http_request: Request, request: QueryRequest | None = None, page: str | None = None):
+    """
+    Answer a question with generated SQL, or continue a previous answer when
+    called with `?page=<nextPage token>` (no body needed).
+    """
     import traceback
     try:
-        print(f"Received query: {request.question}")
+        if not page and request is None:
+            raise HTTPException(status_code=400, detail="A question or a page token is required")
+        try:
+            response_format = encoding.negotiate(http_request.headers.get("accept"))
+        except encoding.NotAcceptable as e:
+            raise HTTPException(status_code=406, detail=str(e))
+        metrics.log_event("query.received", question=request.question if request else None, page=bool(page))
         
-        # Get Vanna instance
+        # Get Vanna instance (first call introspects the schema, so keep it off the event loop)
         try:
-            vanna = get_vanna_instance()
-            print("Vanna instance obtained successfully")
+            vanna = await asyncio.to_thread(get_vanna_instance)
         except Exception as init_error:
             error_msg = f"Failed to initialize Vanna: {str(init_error)}"
             print(error_msg)
             print(traceback.format_exc())
             raise HTTPException(status_code=500, detail=error_msg)
         
-        # Generate SQL from natural language
-        try:
-            # Try different Vanna API methods
-            if hasattr(vanna, 'generate_sql'):
-                sql = vanna.generate_sql(question=request.question)
-            elif hasattr(vanna, 'ask'):
-                sql = vanna.ask(request.question)
-            else:
-                # Fallback: try calling it directly
-                sql = vanna(request.question)
-            print(f"Generated SQL: {sql}")
-        except Exception as sql_error:
-            error_msg = f"Failed to generate SQL: {str(sql_error)}"
-            print(error_msg)
-            print(traceback.format_exc())
-            raise HTTPException(status_code=500, detail=error_msg)
+        # Generate SQL from natural language (follow-up pages reuse the SQL in the token)
+        sql = None
+        if not page:
+            try:
+                with metrics.span("generate_sql"):
+                    sql = await run_stage(http_request, "generate_sql", _generate_sql(vanna, request.question),
+                                          GENERATE_SQL_TIMEOUT)
+                metrics.log_event("query.sql_generated", sql=sql)
+            except ClientDisconnected:
+                print("Client disconnected during SQL generation, cancelled")
+                raise HTTPException(status_code=499, detail="Client closed request")
+            except StageTimeout as timeout_error:
+                print(f"Timeout: {timeout_error}")
+                raise HTTPException(status_code=504, detail="Generating SQL took too long. Please try again in a moment.")
+            except Exception as sql_error:
+                error_msg = f"Failed to generate SQL: {str(sql_error)}"
+                print(error_msg)
+                print(traceback.format_exc())
+                raise HTTPException(status_code=500, detail=error_msg)
         
         # Execute SQL and get results
         try:
-            if hasattr(vanna, 'run_sql'):
-                results = vanna.run_sql(sql=sql)
-            elif hasattr(vanna, 'run'):
-                results = vanna.run(sql)
-            else:
-                # Fallback: execute directly using database connection
-                from sqlalchemy import create_engine, text
-                database_url = os.getenv("DATABASE_URL")
-                if database_url.startswith("mysql://"):
-                    database_url = database_url.replace("mysql://", "mysql+pymysql://", 1)
-                engine = create_engine(database_url)
-                with engine.connect() as conn:
-                    result = conn.execute(text(sql))
-                    results = [dict(row._mapping) for row in result]
-            print(f"Query executed, got {len(results) if results else 0} results")
+            page_result = None
+            sql, results = await execute_sql(http_request, vanna, request.question if request else None, sql, page)
+            if isinstance(results, dict):
+                page_result = results
+                sql = sql or page_result["sql"]
+                results = page_result["rows"]
+            metrics.log_event("query.executed", rows=len(results) if results else 0)
+        except HTTPException:
+            raise
+        except InvalidPageToken as token_error:
+            raise HTTPException(status_code=400, detail=str(token_error))
+        except ClientDisconnected:
+            print("Client disconnected during SQL execution, cancelled")
+            raise HTTPException(status_code=499, detail="Client closed request")
+        except StageTimeout as timeout_error:
+            print(f"Timeout: {timeout_error}")
+            raise HTTPException(status_code=504, detail=format_sql_error(str(timeout_error), sql))
         except Exception as exec_error:
             error_msg = str(exec_error)
             print(f"SQL execution error: {error_msg}")
@@ -269,57 +808,12 @@ async def query(request: QueryRequest):
             friendly_msg = format_sql_error(error_msg, sql)
             raise HTTPException(status_code=500, detail=friendly_msg)
         
-        # Convert results to list of dicts
-        if results and len(results) > 0:
-            if isinstance(results[0], dict):
-                data = results
-            elif isinstance(results[0], tuple) or isinstance(results[0], list):
-                # If results are tuples/lists, try to get column names
-                try:
-                    # Try to get column names from result object
-                    if hasattr(results, 'keys'):
-                        columns = list(results.keys())
-                        data = [dict(zip(columns, row)) for row in results]
-                    else:
-                        # Fallback: use generic column names
-                        num_cols = len(results[0]) if results else 0
-                        columns = [f"column_{i+1}" for i in range(num_cols)]
-                        data = [dict(zip(columns, row)) for row in results]
-                except:
-                    data = [{"result": str(row)} for row in results]
-            else:
-                data = [{"result": str(row)} for row in results]
-        else:
-            data = []
-        
-        # Simple chart type detection
-        chart_type = None
-        if len(data) > 0 and len(data) <= 20:
-            if any(key in str(data[0]).lower() for key in ['date', 'time', 'month']):
-                chart_type = "line"
-            elif len(data) <= 10:
-                chart_type = "bar"
-        
-        # Build a short human-friendly message summarizing the results
-        if not data:
-            message = "I ran the generated SQL but didn't find any matching rows. You can try rephrasing your question or broadening the filters."
-        else:
-            # columns present in the first row
-            cols = list(data[0].keys()) if isinstance(data[0], dict) else []
-            # create a concise sample row for display
-            sample = None
-            try:
-                sample = {k: (str(v) if v is not None else "") for k, v in list(data[0].items())[:5]}
-            except Exception:
-                sample = str(data[0])
-
-            message = (
-                f"I ran the SQL and found {len(data)} row{'s' if len(data) != 1 else ''}. "
-                f"Columns returned: {', '.join(cols[:8]) + (', ...' if len(cols) > 8 else '')}. "
-                f"Here's a sample row: {sample}"
-            )
+        payload = _query_payload(sql, _rows_as_dicts(results), page_result)
 
-        return QueryResponse(sql=sql, data=data, chartType=chart_type, message=message)
+        # Encode here rather than in FastAPI so serialization time is measured;
+        # the default row-dict JSON has the QueryResponse shape
+        with metrics.span("encode", rows=len(payload["data"]), format=response_format):
+            return encoding.encode_query_result(response_format, payload)
     
     except HTTPException:
         raise
@@ -330,7 +824,226 @@ async def query(request: QueryRequest):
         raise HTTPException(status_code=500, detail=error_detail)
 
 
-if __name__ == "__main__":
+async def _answer_batch(vanna, questions: list) -> list:
+    """
+    Answer each question like /query, with one item per question in order.
+
+    Identical questions are generated once and identical SQL is executed
+    once; execution of a question starts as soon as its SQL is ready.
+    """
+    llm_slots = asyncio.Semaphore(max(1, BATCH_LLM_CONCURRENCY))
+    sql_slots = asyncio.Semaphore(max(1, BATCH_SQL_CONCURRENCY))
+    answers: dict[str, asyncio.Task] = {}
+    executions: dict[str, asyncio.Task] = {}
+
+    async def execute(question: str, sql: str):
+        async with sql_slots:
+            return await execute_sql(None, vanna, question, sql)
+
+    async def answer(question: str) -> dict:
+        item = {"question": question, "sql": None, "error": None, "status": 200, "deduplicated": False}
+        start = time.perf_counter()
+        try:
+            async with llm_slots:
+                with metrics.span("generate_sql"):
+                    sql = await run_stage(None, "generate_sql", _generate_sql(vanna, question), GENERATE_SQL_TIMEOUT)
+            metrics.log_event("query.sql_generated", sql=sql, batch=True)
+        except StageTimeout:
+            item.update(status=504, error="Generating SQL took too long. Please try again in a moment.")
+        except Exception as sql_error:
+            item.update(status=500, error=f"Failed to generate SQL: {str(sql_error)}")
+        generated = time.perf_counter()
+        item["timings"] = {"generate_sql_ms": round((generated - start) * 1000, 1)}
+        if item["error"]:
+            item["timings"]["total_ms"] = item["timings"]["generate_sql_ms"]
+            return item
+
+        item["sql"] = sql
+        task = executions.get(sql)
+        if task is None:
+            task = executions[sql] = asyncio.ensure_future(execute(question, sql))
+        else:
+            item["deduplicated"] = True
+        try:
+            # Shielded: the execution is shared by every question that produced this SQL
+            final_sql, results = await asyncio.shield(task)
+            page_result = None
+            if isinstance(results, dict):
+                page_result = results
+                results = page_result["rows"]
+            item.update(_query_payload(final_sql, _rows_as_dicts(results), page_result))
+        except StageTimeout as timeout_error:
+            item.update(status=504, error=format_sql_error(str(timeout_error), sql))
+        except Exception as exec_error:
+            item.update(status=500, error=format_sql_error(str(exec_error), sql))
+        now = time.perf_counter()
+        item["timings"]["run_sql_ms"] = round((now - generated) * 1000, 1)
+        item["timings"]["total_ms"] = round((now - start) * 1000, 1)
+        return item
+
+    try:
+        items = []
+        for question in questions:
+            task = answers.get(question)
+            if task is None:
+                task = answers[question] = asyncio.ensure_future(answer(question))
+            items.append(task)
+        results = await asyncio.gather(*items)
+        # Repeated questions share one answer object; give each position its own copy
+        seen = set()
+        for index, item in enumerate(results):
+            if id(item) in seen:
+                results[index] = dict(item, deduplicated=True)
+            seen.add(id(item))
+        return results
+    finally:
+        for task in (*answers.values(), *executions.values()):
+            if not task.done():
+                task.cancel()
+
+
+@app.post("/query/batch", response_class=encoding.FastJSONResponse)
+async def query_batch(request: BatchQueryRequest, http_request: Request):
+    """
+    Answer several questions in one request, e.g. a nightly report.
+
+    SQL is generated for up to BATCH_LLM_CONCURRENCY questions at a time and
+    up to BATCH_SQL_CONCURRENCY queries run in parallel on the pool. Every
+    item carries its own result or friendly error (as /query would return)
+    and timings, so one bad question does not fail the batch.
+    """
+    import traceback
+    questions = [q.strip() for q in request.questions]
+    if not questions or not all(questions):
+        raise HTTPException(status_code=400, detail="questions must be a non-empty list of non-empty questions")
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_QUESTIONS} questions per batch")
+    metrics.log_event("query.batch_received", questions=len(questions))
+
+    try:
+        vanna = await asyncio.to_thread(get_vanna_instance)
+    except Exception as init_error:
+        error_msg = f"Failed to initialize Vanna: {str(init_error)}"
+        print(error_msg)
+        print(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=error_msg)
+
+    start = time.perf_counter()
+    try:
+        items = await run_stage(http_request, "batch", _answer_batch(vanna, questions), BATCH_TIMEOUT)
+    except ClientDisconnected:
+        print("Client disconnected during batch, cancelled")
+        raise HTTPException(status_code=499, detail="Client closed request")
+    except StageTimeout as timeout_error:
+        print(f"Timeout: {timeout_error}")
+        raise HTTPException(status_code=504, detail="The batch took too long. Try fewer questions per request.")
+    failed = sum(1 for item in items if item["error"])
+    metrics.log_event("query.batch_answered", questions=len(items), failed=failed)
+    return encoding.FastJSONResponse({
+        "results": items,
+        "succeeded": len(items) - failed,
+        "failed": failed,
+        "distinctSql": len({item["sql"] for item in items if item["sql"]}),
+        "totalMs": round((time.perf_counter() - start) * 1000, 1),
+    })
+
+
+def _stream_event(event: dict, sse: bool) -> str:
+    payload = encoding.dumps(event).decode("utf-8")
+    if sse:
+        return f"event: {event['type']}\ndata: {payload}\n\n"
+    return payload + "\n"
+
+
+@app.post("/query/stream")
+async def query_stream(request: QueryRequest, http_request: Request):
+    """
+    Streaming variant of /query.
+
+    Emits newline-delimited JSON events (or Server-Sent Events when the client
+    sends `Accept: text/event-stream`): `sql` once generation finishes, `rows`
+    batches read from a server-side cursor, then `done` with the row count,
+    chartType and summary message. Failures arrive as an `error` event.
+    """
+    sse = "text/event-stream" in http_request.headers.get("accept", "")
+    try:
+        vanna = await asyncio.to_thread(get_vanna_instance)
+    except Exception as init_error:
+        raise HTTPException(status_code=500, detail=f"Failed to initialize Vanna: {str(init_error)}")
+
+    async def events():
+        sql = None
+        try:
+            sql = await asyncio.wait_for(vanna.agenerate_sql(question=request.question), GENERATE_SQL_TIMEOUT)
+            print(f"Generated SQL: {sql}")
+            yield _stream_event({"type": "sql", "sql": sql}, sse)
+        except asyncio.TimeoutError:
+            yield _stream_event({"type": "error", "detail": "Generating SQL took too long. Please try again in a moment."}, sse)
+            return
+        except Exception as sql_error:
+            yield _stream_event({"type": "error", "detail": f"Failed to generate SQL: {str(sql_error)}"}, sse)
+            return
+
+        row_count = 0
+        first_row = None
+        batches = vanna.astream_sql(sql, batch_size=STREAM_BATCH_SIZE)
+        try:
+            while True:
+                try:
+                    columns, rows = await asyncio.wait_for(anext(batches), RUN_SQL_TIMEOUT)
+                except StopAsyncIteration:
+                    break
+                if not rows:
+                    continue
+                if first_row is None:
+                    first_row = rows[0]
+                row_count += len(rows)
+                yield _stream_event({"type": "rows", "columns": columns, "rows": rows}, sse)
+        except asyncio.TimeoutError:
+            yield _stream_event({"type": "error", "detail": format_sql_error(f"run_sql timeout after {RUN_SQL_TIMEOUT:g}s", sql)}, sse)
+            return
+        except Exception as exec_error:
+            print(f"SQL execution error: {exec_error}")
+            yield _stream_event({"type": "error", "detail": format_sql_error(str(exec_error), sql)}, sse)
+            return
+        finally:
+            await batches.aclose()
+
+        print(f"Streamed {row_count} rows")
+        yield _stream_event({
+            "type": "done",
+            "rowCount": row_count,
+            "chartType": detect_chart_type(row_count, first_row),
+            "message": summarize_results(row_count, first_row),
+        }, sse)
+
+    media_type = "text/event-stream" if sse else "application/x-ndjson"
+    return StreamingResponse(events(), media_type=media_type, headers={"Cache-Control": "no-cache"})
+
+
+def serve():
+    """
+    Run the service with WEB_CONCURRENCY worker processes.
+
+    Workers share warm state through app/shared_store.py. Each one is
+    replaced after WORKER_MAX_REQUESTS requests (0: never), and SIGHUP to
+    the parent process restarts the workers one at a time.
+    """
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", 8000)))
+    from app.shared_store import worker_count
+    workers = worker_count()
+    max_requests = int(os.getenv("WORKER_MAX_REQUESTS", "0"))
+    uvicorn.run(
+        # Several workers need an import string so each process can load the app itself
+        "app.main:app" if workers > 1 else app,
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", 8000)),
+        workers=workers,
+        limit_max_requests=max_requests or None,
+        timeout_graceful_shutdown=int(os.getenv("WORKER_GRACEFUL_TIMEOUT", "30")),
+    )
+
+
+if __name__ == "__main__":
+    serve()
 
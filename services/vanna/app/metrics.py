@@ -0,0 +1,270 @@
+# Request ids, per-stage timing spans and Prometheus text exposition
+#
+# Kept dependency-free (no prometheus_client): the service only needs a few
+# labelled counters/histograms plus gauges read from existing stats() dicts.
+# With several workers each one publishes a `snapshot()` to the shared store
+# and /metrics renders the merge of all of them.
+
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Request id of the request being handled; copied into tasks and worker threads
+request_id_var: contextvars.ContextVar[str | None] = contextvars.ContextVar("request_id", default=None)
+
+# Seconds; covers in-memory stages (sub-ms) up to slow LLM calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def new_request_id(incoming: str | None = None) -> str:
+    """Reuse a sane incoming X-Request-ID, otherwise mint one"""
+    if incoming and len(incoming) <= 128 and incoming.isprintable():
+        return incoming
+    return uuid.uuid4().hex
+
+
+def log_event(event: str, **fields):
+    """Print one structured (JSON) log line tagged with the current request id"""
+    record = {"event": event, "request_id": request_id_var.get()}
+    record.update(fields)
+    print(json.dumps(record, default=str))
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{name}="{escaped}"')
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(labels), value] for labels, value in self._values.items()]
+
+    def merge(self, snapshots) -> dict:
+        values: dict[tuple, float] = {}
+        for snapshot in snapshots:
+            for labels, value in snapshot:
+                values[tuple(labels)] = values.get(tuple(labels), 0.0) + value
+        return values
+
+    def render(self, values: dict | None = None) -> list[str]:
+        """Exposition lines for this process, or for `values` merged from worker snapshots"""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        if values is None:
+            with self._lock:
+                values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [bucket counts..., sum, count]
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, *labels, value: float):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(labels), list(series)] for labels, series in self._series.items()]
+
+    def merge(self, snapshots) -> dict:
+        merged: dict[tuple, list] = {}
+        for snapshot in snapshots:
+            for labels, series in snapshot:
+                if len(series) != len(self.buckets) + 2:
+                    # Published by a worker running other buckets (mid-deploy): cannot be added up
+                    continue
+                total = merged.setdefault(tuple(labels), [0] * len(self.buckets) + [0.0, 0])
+                for i, value in enumerate(series):
+                    total[i] += value
+        return merged
+
+    def render(self, merged: dict | None = None) -> list[str]:
+        """Exposition lines for this process, or for `merged` series from worker snapshots"""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        if merged is None:
+            with self._lock:
+                merged = {labels: list(series) for labels, series in self._series.items()}
+        for labels, series in sorted(merged.items()):
+            for bound, count in zip(self.buckets, series):
+                le = _format_labels(self.labelnames, labels, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {count}")
+            le = _format_labels(self.labelnames, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {series[-1]}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{label_text} {series[-1]}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "vanna_stage_duration_seconds",
+    "Time spent in each /query pipeline stage",
+    ("stage",),
+)
+REQUEST_SECONDS = Histogram(
+    "vanna_http_request_duration_seconds",
+    "HTTP request latency by route and status",
+    ("method", "path", "status"),
+)
+SQL_ERRORS = Counter(
+    "vanna_sql_errors_total",
+    "SQL errors by format_sql_error category",
+    ("category",),
+)
+STAGE_ERRORS = Counter(
+    "vanna_stage_errors_total",
+    "Pipeline stage failures (including timeouts and client disconnects)",
+    ("stage", "reason"),
+)
+
+_METRICS = (STAGE_SECONDS, REQUEST_SECONDS, SQL_ERRORS, STAGE_ERRORS)
+
+
+# Callables receiving (stage, seconds) for every span, e.g. the load benchmark's percentiles
+_stage_listeners: list = []
+
+
+def add_stage_listener(listener):
+    """Call `listener(stage, seconds)` whenever a stage span finishes"""
+    _stage_listeners.append(listener)
+
+
+def remove_stage_listener(listener):
+    if listener in _stage_listeners:
+        _stage_listeners.remove(listener)
+
+
+@contextmanager
+def span(stage: str, **fields):
+    """Time a pipeline stage into STAGE_SECONDS and log it with the request id"""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        STAGE_ERRORS.inc(stage, type(e).__name__)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(stage, value=elapsed)
+        for listener in _stage_listeners:
+            listener(stage, elapsed)
+        log_event("stage", stage=stage, ms=round(elapsed * 1000, 3), **fields)
+
+
+def _gauge_lines(name: str, help_text: str, labelname: str, stats_by_worker: dict) -> list[str]:
+    """
+    Flatten {label: {field: number}} stats dicts into `<name>_<field>{label=...}` gauges.
+
+    `stats_by_worker` maps a worker id to its stats; with more than one
+    worker every sample also gets a `worker` label.
+    """
+    labelled = len(stats_by_worker) > 1
+    by_field: dict[str, list] = {}
+    for worker, stats in sorted(stats_by_worker.items()):
+        for label, values in (stats or {}).items():
+            for field, value in (values or {}).items():
+                if isinstance(value, bool):
+                    value = int(value)
+                if isinstance(value, (int, float)):
+                    labels = (label, worker) if labelled else (label,)
+                    by_field.setdefault(field, []).append((labels, value))
+    names = (labelname, "worker") if labelled else (labelname,)
+    lines = []
+    for field, samples in sorted(by_field.items()):
+        metric = f"{name}_{field}"
+        lines.append(f"# HELP {metric} {help_text} ({field})")
+        lines.append(f"# TYPE {metric} gauge")
+        for labels, value in samples:
+            lines.append(f"{metric}{_format_labels(names, labels)} {_format_value(value)}")
+    return lines
+
+
+def snapshot(cache_stats: dict | None = None, pool_stats: dict | None = None) -> dict:
+    """This process's counters, histograms and gauges as JSON-able data, for merging across workers"""
+    return {
+        "worker": str(os.getpid()),
+        "series": {metric.name: metric.snapshot() for metric in _METRICS},
+        "cache": cache_stats or {},
+        "pool": pool_stats or {},
+    }
+
+
+def retire(retired: dict | None, final: dict) -> dict:
+    """Fold an exiting worker's final counters into the retired totals, so merged counters never go down"""
+    previous = (retired or {}).get("series", {})
+    series = {}
+    for metric in _METRICS:
+        merged = metric.merge([previous.get(metric.name, []), final["series"].get(metric.name, [])])
+        series[metric.name] = [[list(labels), value] for labels, value in merged.items()]
+    return {"series": series}
+
+
+def render(cache_stats: dict | None = None, pool_stats: dict | None = None, workers: list | None = None,
+           retired: dict | None = None) -> str:
+    """
+    Prometheus text exposition (format 0.0.4) of all metrics.
+
+    With `workers` (snapshots of every live worker) counters and histograms
+    are summed over them plus the `retired` totals of exited workers, and
+    the cache/pool gauges are reported per worker.
+    """
+    lines = []
+    if workers is None:
+        for metric in _METRICS:
+            lines.extend(metric.render())
+        cache_by_worker = {"": cache_stats} if cache_stats else {}
+        pool_by_worker = {"": pool_stats} if pool_stats else {}
+    else:
+        sources = workers + ([retired] if retired else [])
+        for metric in _METRICS:
+            lines.extend(metric.render(metric.merge(s.get("series", {}).get(metric.name, []) for s in sources)))
+        cache_by_worker = {w["worker"]: w.get("cache") for w in workers if w.get("cache")}
+        pool_by_worker = {w["worker"]: w.get("pool") for w in workers if w.get("pool")}
+    if cache_by_worker:
+        lines.extend(_gauge_lines("vanna_cache", "Service cache statistic", "cache", cache_by_worker))
+    if pool_by_worker:
+        lines.extend(_gauge_lines("vanna_pool", "Connection pool statistic", "engine", pool_by_worker))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,428 @@
+# Row caps, signed continuation tokens and keyset pagination for generated SQL
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import re
+import secrets
+import time
+import uuid
+from datetime import date, datetime, time as dt_time
+from decimal import Decimal
+
+_STATEMENT_RE = re.compile(r"^\s*(select|with)\b", re.I)
+_ORDER_BY_RE = re.compile(r"\border\s+by\b", re.I)
+_CLAUSE_END_RE = re.compile(r"\b(limit|offset|fetch|for\s+update|for\s+share)\b", re.I)
+_DIRECTION_RE = re.compile(r"\s+(asc|desc)\s*$", re.I)
+_NULLS_RE = re.compile(r"\s+nulls\s+(first|last)\s*$", re.I)
+_IDENTIFIER_RE = re.compile(r"^(?:[`\"]?\w+[`\"]?\.)*[`\"]?(\w+)[`\"]?$")
+
+# SQLAlchemy dialect names that sqlglot spells differently
+_SQLGLOT_DIALECTS = {"postgresql": "postgres"}
+
+
+class InvalidPageToken(Exception):
+    pass
+
+
+def _top_level_spans(sql: str):
+    """Yield (index, char, paren depth) for characters outside quotes"""
+    depth = 0
+    quote = None
+    for i, ch in enumerate(sql):
+        if quote:
+            if ch == quote:
+                quote = None
+            continue
+        if ch in ("'", '"', "`"):
+            quote = ch
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        yield i, ch, depth
+
+
+def _top_level_mask(sql: str) -> str:
+    """Copy of `sql` with quoted and parenthesized text blanked out"""
+    # Quoted characters are not yielded by _top_level_spans, so they stay blank
+    mask = list(" " * len(sql))
+    for i, ch, depth in _top_level_spans(sql):
+        mask[i] = " " if depth > 0 or ch in ("(", ")") else ch
+    return "".join(mask)
+
+
+def parse_order_by(sql: str) -> list[tuple[str, bool, str | None]] | None:
+    """
+    Items of the statement's top-level ORDER BY as (expression, descending, nulls),
+    or None when there is no top-level ORDER BY.
+    """
+    mask = _top_level_mask(sql)
+    matches = list(_ORDER_BY_RE.finditer(mask))
+    if not matches:
+        return None
+    start = matches[-1].end()
+    end_match = _CLAUSE_END_RE.search(mask, start)
+    end = end_match.start() if end_match else len(sql.rstrip().rstrip(";"))
+    clause, clause_mask = sql[start:end], mask[start:end]
+
+    items, last = [], 0
+    for i, ch in enumerate(clause_mask):
+        if ch == ",":
+            items.append(clause[last:i])
+            last = i + 1
+    items.append(clause[last:])
+
+    parsed = []
+    for item in items:
+        item = item.strip()
+        nulls = None
+        match = _NULLS_RE.search(item)
+        if match:
+            nulls = match.group(1).lower()
+            item = item[:match.start()]
+        descending = False
+        match = _DIRECTION_RE.search(item)
+        if match:
+            descending = match.group(1).lower() == "desc"
+            item = item[:match.start()]
+        parsed.append((item.strip(), descending, nulls))
+    return parsed
+
+
+def _order_column(expression: str, columns: list) -> str | None:
+    """Output column an ORDER BY expression refers to, if it can be resolved"""
+    if expression.isdigit():
+        index = int(expression) - 1
+        return columns[index] if 0 <= index < len(columns) else None
+    match = _IDENTIFIER_RE.match(expression)
+    if not match:
+        return None
+    lookup = {c.lower(): c for c in columns}
+    return lookup.get(match.group(1).lower())
+
+
+def keyset_order(sql: str, columns: list, dialect: str) -> list | None:
+    """
+    [(column, descending, nulls_last)] for keyset pagination over the wrapped
+    query, or None when the ORDER BY is missing or not made of output columns.
+    """
+    items = parse_order_by(sql)
+    if not items:
+        return None
+    order = []
+    for expression, descending, nulls in items:
+        column = _order_column(expression, columns)
+        if column is None:
+            return None
+        if nulls is None:
+            # PostgreSQL sorts NULLs as the largest value, MySQL/SQLite as the smallest
+            nulls_last = descending != dialect.startswith("postgres")
+        else:
+            nulls_last = nulls == "last"
+        order.append((column, descending, nulls_last))
+    return order
+
+
+def encode_value(value):
+    """JSON-safe, type-preserving form of a key value"""
+    if isinstance(value, Decimal):
+        return {"t": "decimal", "v": str(value)}
+    if isinstance(value, datetime):
+        return {"t": "datetime", "v": value.isoformat()}
+    if isinstance(value, date):
+        return {"t": "date", "v": value.isoformat()}
+    if isinstance(value, dt_time):
+        return {"t": "time", "v": value.isoformat()}
+    if isinstance(value, uuid.UUID):
+        return {"t": "uuid", "v": str(value)}
+    return value
+
+
+def decode_value(value):
+    if not isinstance(value, dict):
+        return value
+    kind, raw = value.get("t"), value.get("v")
+    if kind == "decimal":
+        return Decimal(raw)
+    if kind == "datetime":
+        return datetime.fromisoformat(raw)
+    if kind == "date":
+        return date.fromisoformat(raw)
+    if kind == "time":
+        return dt_time.fromisoformat(raw)
+    if kind == "uuid":
+        return uuid.UUID(raw)
+    raise InvalidPageToken(f"Unknown key type {kind!r}")
+
+
+class PageCursor:
+    """
+    Position in a paginated result: the base SQL, rows already returned and,
+    when the query is ordered by output columns, the keyset of the last row.
+    """
+
+    def __init__(self, sql: str, offset: int = 0, order: list | None = None,
+                 last: list | None = None, skip: int = 0):
+        self.sql = sql
+        self.offset = offset
+        self.order = order
+        self.last = last
+        self.skip = skip
+
+    def as_dict(self) -> dict:
+        return {
+            "sql": self.sql,
+            "offset": self.offset,
+            "order": self.order,
+            "last": [encode_value(v) for v in self.last] if self.last is not None else None,
+            "skip": self.skip,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "PageCursor":
+        try:
+            last = data.get("last")
+            return cls(
+                sql=data["sql"],
+                offset=int(data.get("offset", 0)),
+                order=[tuple(item) for item in data["order"]] if data.get("order") else None,
+                last=[decode_value(v) for v in last] if last is not None else None,
+                skip=int(data.get("skip", 0)),
+            )
+        except InvalidPageToken:
+            raise
+        except Exception as e:
+            raise InvalidPageToken(f"Malformed page token: {e}")
+
+    @property
+    def uses_keyset(self) -> bool:
+        return bool(self.order) and self.last is not None
+
+
+def _order_by(order: list, quote, dialect: str) -> str:
+    items = []
+    for column, descending, nulls_last in order:
+        item = f"_q.{quote(column)} {'DESC' if descending else 'ASC'}"
+        if dialect.startswith("postgres"):
+            item += " NULLS LAST" if nulls_last else " NULLS FIRST"
+        items.append(item)
+    return ", ".join(items)
+
+
+def _names_may_repeat(tree, exp) -> bool:
+    """Whether two output columns of a parsed query can share a name"""
+    names = set()
+    for select in tree.selects:
+        if isinstance(select, exp.Star) or (isinstance(select, exp.Column) and isinstance(select.this, exp.Star)):
+            query = tree if isinstance(tree, exp.Select) else None
+            # SELECT * over one table has that table's (distinct) columns; over a join it may not
+            if query is None or query.args.get("joins") or len(tree.selects) > 1:
+                return True
+            continue
+        name = (select.alias_or_name or select.sql()).lower()
+        if name in names:
+            return True
+        names.add(name)
+    return False
+
+
+def _limited_in_place(base: str, count: int, offset: int, dialect: str) -> str | None:
+    """
+    The statement with LIMIT `count` OFFSET `offset` (within its own LIMIT and
+    OFFSET) set on its syntax tree, when its output names may repeat: wrapped
+    as SELECT * FROM (...) it would fail on MySQL ("Duplicate column name").
+    None when wrapping is safe, or sqlglot cannot handle the statement.
+    """
+    from app.sql_translate import sqlglot
+    if sqlglot is None:
+        return None
+    from sqlglot import exp
+    read = _SQLGLOT_DIALECTS.get(dialect, dialect)
+    try:
+        tree = sqlglot.parse_one(base, read=read)
+    except Exception:
+        return None
+    if not isinstance(tree, exp.Query) or not _names_may_repeat(tree, exp):
+        return None
+    own_limit, own_offset = tree.args.get("limit"), tree.args.get("offset")
+    try:
+        own_count = int(own_limit.expression.name) if own_limit is not None else None
+        start = int(own_offset.expression.name) if own_offset is not None else 0
+    except (AttributeError, ValueError):
+        return None
+    if own_count is not None:
+        count = max(0, min(count, own_count - offset))
+    tree.limit(count, copy=False)
+    if start + offset:
+        tree.offset(start + offset, copy=False)
+    else:
+        tree.set("offset", None)
+    return tree.sql(dialect=read)
+
+
+def page_sql(sql: str, limit: int, cursor: PageCursor | None, quote, dialect: str) -> tuple[str, dict]:
+    """
+    Wrap a SELECT so at most `limit + 1` rows are read (the extra row tells
+    whether more remain). Follow-up pages resume after the cursor's keyset
+    (`OFFSET` only skips rows tied with the last key), or fall back to a
+    plain OFFSET when there is no usable keyset.
+
+    A SELECT whose output names may repeat (`SELECT v.name, c.name ...`)
+    is not wrapped: LIMIT and OFFSET are set on the statement itself, and
+    its pages use OFFSET (keyset needs distinct column names).
+
+    Statements other than SELECT/WITH are returned unchanged.
+    """
+    base = sql.strip().rstrip(";").strip()
+    if not _STATEMENT_RE.match(base):
+        return sql, {}
+    if cursor is None or not cursor.order:
+        limited = _limited_in_place(base, limit + 1, cursor.offset if cursor else 0, dialect)
+        if limited is not None:
+            return limited, {}
+    if cursor is None:
+        return f"SELECT * FROM ({base}) AS _q LIMIT {limit + 1}", {}
+    if not cursor.uses_keyset:
+        order_by = f" ORDER BY {_order_by(cursor.order, quote, dialect)}" if cursor.order else ""
+        return f"SELECT * FROM ({base}) AS _q{order_by} LIMIT {limit + 1} OFFSET {cursor.offset}", {}
+
+    params = {}
+    terms = []
+    equal = []
+    for i, ((column, descending, nulls_last), value) in enumerate(zip(cursor.order, cursor.last)):
+        ref = f"_q.{quote(column)}"
+        params[f"k{i}"] = value
+        after = f"{ref} {'<' if descending else '>'} :k{i}"
+        if nulls_last:
+            after = f"({after} OR {ref} IS NULL)"
+        terms.append(" AND ".join(equal + [after]))
+        equal.append(f"{ref} = :k{i}")
+    terms.append(" AND ".join(equal))
+    where = " OR ".join(f"({term})" for term in terms)
+
+    statement = (
+        f"SELECT * FROM ({base}) AS _q WHERE {where} "
+        f"ORDER BY {_order_by(cursor.order, quote, dialect)} LIMIT {limit + 1}"
+    )
+    if cursor.skip:
+        statement += f" OFFSET {cursor.skip}"
+    return statement, params
+
+
+def _sortable(values) -> bool:
+    return not any(isinstance(v, (bytes, bytearray, memoryview, dict, list)) for v in values)
+
+
+def total_order(sql: str, columns: list, rows: list, dialect: str) -> list | None:
+    """
+    The query's ORDER BY (as output columns) followed by every other sortable
+    output column as a tie-breaker, so keyset pages never straddle ties.
+    """
+    keys = keyset_order(sql, columns, dialect)
+    if not keys or len(set(columns)) != len(columns):
+        return None
+    used = {column for column, _, _ in keys}
+    postgres = dialect.startswith("postgres")
+    for index, column in enumerate(columns):
+        if column not in used and _sortable(row[index] for row in rows):
+            keys.append((column, False, postgres))
+    return keys
+
+
+def next_cursor(sql: str, columns: list, rows: list, limit: int, cursor: PageCursor | None,
+                dialect: str) -> tuple[int, PageCursor | None]:
+    """
+    (rows of this page to return, cursor of the next page) for `rows` read
+    with `page_sql` (at most limit + 1 raw rows).
+
+    The first page is read in the query's own order, where rows tied on the
+    ORDER BY come back in arbitrary order. It is cut before a tie group that
+    straddles the page boundary; if the whole page is one tie group the
+    returned count is 0 and the cursor re-reads it in the total order.
+    """
+    if len(rows) <= limit or not _STATEMENT_RE.match(sql.strip()):
+        return min(len(rows), limit), None
+    offset = cursor.offset if cursor else 0
+
+    if cursor is None or not cursor.order:
+        order = total_order(sql, columns, rows, dialect) if cursor is None else None
+        if not order:
+            # Unordered (or not orderable by output columns): plain OFFSET paging
+            return limit, PageCursor(sql, offset=offset + limit)
+        inner = len(keyset_order(sql, columns, dialect))
+        positions = [columns.index(column) for column, _, _ in order[:inner]]
+        key = lambda row: [row[p] for p in positions]
+        end = limit
+        while end > 0 and key(rows[end - 1]) == key(rows[limit]):
+            end -= 1
+        if end == 0:
+            return 0, PageCursor(sql, offset=offset, order=order)
+        last = key(rows[end - 1])
+        if any(value is None for value in last):
+            return end, PageCursor(sql, offset=offset + end, order=order)
+        tied = sum(1 for row in rows[:end] if key(row) == last)
+        return end, PageCursor(sql, offset=offset + end, order=order, last=last, skip=tied)
+
+    # Later pages are read in the total order, so the full last row is the keyset
+    order = cursor.order
+    positions = [columns.index(column) for column, _, _ in order]
+    key = lambda row: [row[p] for p in positions]
+    page = rows[:limit]
+    last = key(page[-1])
+    if any(value is None for value in last):
+        # NULL keys cannot be compared; the total order still makes OFFSET exact
+        return limit, PageCursor(sql, offset=offset + limit, order=order)
+    # Rows identical to the last one (exact duplicates) are skipped with OFFSET
+    tied = 0
+    for row in reversed(page):
+        if key(row) != last:
+            break
+        tied += 1
+    if tied == len(page) and cursor.uses_keyset and cursor.last == last:
+        tied += cursor.skip
+    return limit, PageCursor(sql, offset=offset + limit, order=order, last=last, skip=tied)
+
+
+class PageTokenSigner:
+    """HMAC-signed, expiring continuation tokens (base64url JSON + signature)"""
+
+    def __init__(self, secret: bytes, ttl_seconds: float = 3600):
+        self.secret = secret
+        self.ttl = ttl_seconds
+
+    @classmethod
+    def from_env(cls) -> "PageTokenSigner":
+        secret = os.getenv("PAGE_TOKEN_SECRET")
+        if secret:
+            key = secret.encode("utf-8")
+        elif os.getenv("GROQ_API_KEY"):
+            # Derived so every worker of a deployment accepts the others' tokens
+            key = hmac.new(os.environ["GROQ_API_KEY"].encode("utf-8"), b"vanna-page-token", hashlib.sha256).digest()
+        else:
+            key = secrets.token_bytes(32)
+        return cls(key, float(os.getenv("PAGE_TOKEN_TTL_SECONDS", "3600")))
+
+    def _sign(self, payload: bytes) -> str:
+        digest = hmac.new(self.secret, payload, hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).rstrip(b"=").decode("ascii")
+
+    def dumps(self, cursor: PageCursor) -> str:
+        data = cursor.as_dict()
+        data["exp"] = int(time.time() + self.ttl)
+        payload = base64.urlsafe_b64encode(json.dumps(data, separators=(",", ":")).encode("utf-8")).rstrip(b"=")
+        return payload.decode("ascii") + "." + self._sign(payload)
+
+    def loads(self, token: str) -> PageCursor:
+        payload, _, signature = token.partition(".")
+        if not payload or not hmac.compare_digest(signature, self._sign(payload.encode("ascii", "replace"))):
+            raise InvalidPageToken("Invalid page token")
+        try:
+            data = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        except Exception:
+            raise InvalidPageToken("Invalid page token")
+        if data.get("exp", 0) < time.time():
+            raise InvalidPageToken("Page token expired, please ask the question again")
+        return PageCursor.from_dict(data)
@@ -0,0 +1,97 @@
+# Display post-processing of query results: column selection and value shortening
+#
+# Instead of building a full row dict, a filtered copy and checking every
+# cell, the column selection is decided once per result schema, each
+# returned column is scanned once for values that need rewriting (binary
+# data, long strings), and only those cells are patched in the single dict
+# built per row. numpy, when installed, is used to find long strings.
+
+from functools import lru_cache
+from operator import itemgetter
+import re
+
+try:
+    import numpy
+except ImportError:  # optional dependency
+    numpy = None
+
+# Columns that look like binary/attachments or very large payloads
+EXCLUDE_PATTERN = re.compile(r"blob|binary|file|attachment|pdf|document|image|base64|content", re.I)
+MAX_TEXT_LENGTH = 200
+BINARY_PLACEHOLDER = "<binary data>"
+
+_BINARY = (bytes, bytearray, memoryview)
+_NONE_TYPE = type(None)
+
+
+@lru_cache(maxsize=1024)
+def column_plan(columns: tuple, keep_columns: tuple | None = None) -> tuple[tuple, tuple]:
+    """(names, positions) of the columns to return, decided once per result schema"""
+    # Like dict(zip(columns, row)): a repeated name refers to its last column
+    positions = {name: i for i, name in enumerate(columns)}
+    if keep_columns:
+        # Honor an explicit request, keeping only columns that exist
+        names = tuple(c for c in keep_columns if c in positions)
+    else:
+        names = tuple(c for c in columns if not EXCLUDE_PATTERN.search(c))
+    return names, tuple(positions[name] for name in names)
+
+
+def select_columns(columns, keep_columns=None) -> list:
+    """Names of the columns worth returning for tabular display"""
+    return list(column_plan(tuple(columns), tuple(keep_columns) if keep_columns else None)[0])
+
+
+def _display_value(value):
+    if isinstance(value, _BINARY):
+        return BINARY_PLACEHOLDER
+    if isinstance(value, str) and len(value) > MAX_TEXT_LENGTH:
+        return value[:MAX_TEXT_LENGTH] + "..."
+    return value
+
+
+def _long_text(values: list) -> list:
+    """Positions of over-long values in a column holding only str and None"""
+    lengths = map(len, [v if v is not None else "" for v in values])
+    if numpy is not None:
+        lengths = numpy.fromiter(lengths, dtype=numpy.int64, count=len(values))
+        return numpy.flatnonzero(lengths > MAX_TEXT_LENGTH).tolist()
+    return [i for i, n in enumerate(lengths) if n > MAX_TEXT_LENGTH]
+
+
+def column_fixes(values: list) -> list[tuple]:
+    """(position, display value) for the cells of one column that need rewriting"""
+    kinds = set(map(type, values))
+    kinds.discard(_NONE_TYPE)
+    if not kinds:
+        return []
+    if kinds == {str}:
+        return [(i, values[i][:MAX_TEXT_LENGTH] + "...") for i in _long_text(values)]
+    if not any(issubclass(kind, (str, *_BINARY)) for kind in kinds):
+        # Numbers, dates, booleans...: nothing to rewrite
+        return []
+    fixes = []
+    for i, value in enumerate(values):
+        shown = _display_value(value)
+        if shown is not value:
+            fixes.append((i, shown))
+    return fixes
+
+
+def display_rows(columns, rows, keep_columns=None) -> list[dict]:
+    """Display dicts for a batch of result rows: selected columns, binary masked, long text shortened"""
+    names, positions = column_plan(tuple(columns), tuple(keep_columns) if keep_columns else None)
+    if not names:
+        return [{} for _ in rows]
+    if positions == tuple(range(len(columns))):
+        results = [dict(zip(names, row)) for row in rows]
+    elif len(positions) == 1:
+        pick = itemgetter(positions[0])
+        results = [{names[0]: pick(row)} for row in rows]
+    else:
+        pick = itemgetter(*positions)
+        results = [dict(zip(names, pick(row))) for row in rows]
+    for name, position in zip(names, positions):
+        for i, value in column_fixes(list(map(itemgetter(position), rows))):
+            results[i][name] = value
+    return results
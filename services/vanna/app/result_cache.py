@@ -0,0 +1,295 @@
+# Result-set cache for run_sql
+
+import copy
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from app.sql_translate import sqlglot
+
+if sqlglot is not None:
+    from sqlglot import exp
+
+_STATEMENT_RE = re.compile(r"^\s*(select|with)\b", re.I)
+# Results of these depend on the clock or are random, so they are never cached
+_VOLATILE_RE = re.compile(
+    r"\b(random|rand|gen_random_uuid|uuid|now|current_date|curdate|current_time|current_timestamp|localtime"
+    r"|localtimestamp|clock_timestamp|statement_timestamp|transaction_timestamp|timeofday)\b",
+    re.I,
+)
+
+# SQLAlchemy dialect names that sqlglot spells differently
+_SQLGLOT_DIALECTS = {"postgresql": "postgres"}
+
+# Table names per (dialect, SQL text): parsing costs about a millisecond, a cache hit far less
+_TABLE_NAMES: OrderedDict[tuple, frozenset | None] = OrderedDict()
+_TABLE_NAMES_MAX = 2048
+_table_names_lock = threading.Lock()
+
+# Timestamp columns used as change watermarks, in order of preference
+WATERMARK_COLUMNS = ("updatedAt", "createdAt")
+
+
+def result_cache_key(sql: str, keep_columns: list | None = None) -> str:
+    payload = sql.strip() + "\x00" + ",".join(keep_columns or [])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def referenced_tables(sql: str, known_tables, dialect: str | None = None) -> tuple | None:
+    """
+    Return the known tables a read-only query touches, or None if the
+    result should not be cached (writes, volatile functions, no known
+    table, or SQL sqlglot cannot parse: a missed table would never be
+    invalidated).
+    """
+    if sqlglot is None or not _STATEMENT_RE.match(sql) or _VOLATILE_RE.search(sql):
+        return None
+    names = _table_names(sql, _SQLGLOT_DIALECTS.get(dialect, dialect))
+    if names is None:
+        return None
+    lookup = {t.lower(): t for t in known_tables}
+    tables = {lookup[name] for name in names if name in lookup}
+    return tuple(sorted(tables)) if tables else None
+
+
+def _table_names(sql: str, dialect: str | None) -> frozenset | None:
+    """Lowercased names of every table node (comma joins, subqueries, CTE bodies), None if unparseable"""
+    key = (dialect, sql)
+    with _table_names_lock:
+        if key in _TABLE_NAMES:
+            _TABLE_NAMES.move_to_end(key)
+            return _TABLE_NAMES[key]
+    try:
+        trees = sqlglot.parse(sql, read=dialect)
+        names = frozenset(table.name.lower() for tree in trees if tree is not None
+                          for table in tree.find_all(exp.Table))
+    except Exception:
+        names = None
+    with _table_names_lock:
+        _TABLE_NAMES[key] = names
+        while len(_TABLE_NAMES) > _TABLE_NAMES_MAX:
+            _TABLE_NAMES.popitem(last=False)
+    return names
+
+
+def watermark_sql(tables, schema_info: dict, quote) -> str:
+    """Build one UNION ALL probe returning (table, row count, max timestamp) per table"""
+    parts = []
+    for table in tables:
+        columns = schema_info.get(table, [])
+        stamp = next((c for c in WATERMARK_COLUMNS if c in columns), None)
+        stamp_expr = f"MAX({quote(stamp)})" if stamp else "NULL"
+        parts.append(f"SELECT '{table}' AS t, COUNT(*) AS n, {stamp_expr} AS w FROM {quote(table)}")
+    return " UNION ALL ".join(parts)
+
+
+def _rows_size(rows: list) -> int:
+    return len(json.dumps(rows, default=str))
+
+
+class _Entry:
+    __slots__ = ("rows", "tables", "watermark", "created_at", "size")
+
+    def __init__(self, rows, tables, watermark, created_at, size):
+        self.rows = rows
+        self.tables = tables
+        self.watermark = watermark
+        self.created_at = created_at
+        self.size = size
+
+
+class ResultCache:
+    """
+    Size-bounded LRU cache of `run_sql` results keyed on the final SQL text.
+
+    Every entry remembers the watermark (row count, max updatedAt/createdAt)
+    of each table it read. Watermarks are re-probed at most once per
+    `watermark_interval` seconds; an entry is served only while all of its
+    tables still report the same watermark. `invalidate()` drops entries
+    explicitly, e.g. after seeding new invoices.
+
+    With a `shared` store (app/shared_store.py) entries are also published
+    for the other workers; a local miss is served from there when the
+    stored watermarks match this worker's. `invalidate()` then clears all
+    shared results, as entries cannot be looked up by table there.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 32 * 1024 * 1024,
+        max_entry_bytes: int = 4 * 1024 * 1024,
+        ttl_seconds: float = 600,
+        watermark_interval: float = 5,
+        shared=None,
+    ):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl_seconds = ttl_seconds
+        self.watermark_interval = watermark_interval
+        self.shared = shared
+
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._watermarks: dict[str, tuple] = {}
+        self._checked_at: dict[str, float] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.hits_shared = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.watermark_probes = 0
+        self.skipped_too_large = 0
+
+    @classmethod
+    def from_env(cls, shared=None) -> "ResultCache":
+        """Build a cache from RESULT_CACHE_* environment variables"""
+        return cls(
+            max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+            max_entry_bytes=int(os.getenv("RESULT_CACHE_MAX_ENTRY_BYTES", str(4 * 1024 * 1024))),
+            ttl_seconds=float(os.getenv("RESULT_CACHE_TTL_SECONDS", "600")),
+            watermark_interval=float(os.getenv("RESULT_CACHE_WATERMARK_INTERVAL", "5")),
+            shared=shared,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def stale_tables(self, tables) -> list:
+        """Tables whose watermark has not been probed within `watermark_interval`"""
+        now = time.time()
+        with self._lock:
+            return [t for t in tables if now - self._checked_at.get(t, 0) > self.watermark_interval]
+
+    def set_watermarks(self, watermarks: dict):
+        """Record freshly probed watermarks, dropping entries for tables that changed"""
+        now = time.time()
+        with self._lock:
+            self.watermark_probes += 1
+            changed = set()
+            for table, mark in watermarks.items():
+                if table in self._watermarks and self._watermarks[table] != mark:
+                    changed.add(table)
+                self._watermarks[table] = mark
+                self._checked_at[table] = now
+            if changed:
+                self._invalidate_locked(changed)
+
+    def snapshot(self, tables) -> tuple:
+        with self._lock:
+            return tuple(self._watermarks.get(t) for t in tables)
+
+    def get(self, key: str, tables):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                current = tuple(self._watermarks.get(t) for t in tables)
+                fresh = self.ttl_seconds <= 0 or now - entry.created_at <= self.ttl_seconds
+                if fresh and entry.watermark == current:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return copy.copy(entry.rows)
+                self._drop(key)
+            if self.shared is None:
+                self.misses += 1
+                return None
+        return self._get_shared(key, tables, now)
+
+    def _get_shared(self, key: str, tables, now: float):
+        value = self.shared.get("results", key)
+        with self._lock:
+            if value is not None:
+                # JSON turns the (count, max timestamp) tuples into lists
+                watermark = tuple(tuple(mark) if mark is not None else None for mark in value["watermark"])
+                current = tuple(self._watermarks.get(t) for t in tables)
+                fresh = self.ttl_seconds <= 0 or now - value["created_at"] <= self.ttl_seconds
+                if fresh and watermark == current:
+                    self._store(key, _Entry(value["rows"], tuple(tables), watermark, value["created_at"],
+                                            value["size"]))
+                    self.hits += 1
+                    self.hits_shared += 1
+                    return copy.copy(value["rows"])
+            self.misses += 1
+            return None
+
+    def put(self, key: str, tables, watermark: tuple, rows):
+        """Cache rows (or a page of rows) read while `tables` had the given watermark snapshot"""
+        if not self.enabled or any(mark is None for mark in watermark):
+            return
+        size = _rows_size(rows)
+        now = time.time()
+        with self._lock:
+            if size > self.max_entry_bytes:
+                self.skipped_too_large += 1
+                return
+            self._store(key, _Entry(rows, tuple(tables), watermark, now, size))
+        if self.shared is not None:
+            self.shared.set("results", key, {"rows": rows, "watermark": watermark, "created_at": now, "size": size},
+                            self.ttl_seconds)
+
+    def _store(self, key: str, entry: _Entry):
+        self._drop(key)
+        self._entries[key] = entry
+        self._bytes += entry.size
+        while self._entries and self._bytes > self.max_bytes:
+            old_key = next(iter(self._entries))
+            self._drop(old_key)
+            self.evictions += 1
+
+    def _drop(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def _invalidate_locked(self, tables: set | None) -> int:
+        if tables is None:
+            removed = len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+            self._watermarks.clear()
+            self._checked_at.clear()
+        else:
+            keys = [k for k, e in self._entries.items() if tables.intersection(e.tables)]
+            for key in keys:
+                self._drop(key)
+            removed = len(keys)
+        self.invalidations += removed
+        return removed
+
+    def invalidate(self, tables: list | None = None) -> int:
+        """Drop cached results for the given tables (all when None); returns entries removed"""
+        if self.shared is not None:
+            self.shared.clear("results")
+        with self._lock:
+            if tables is None:
+                return self._invalidate_locked(None)
+            for table in tables:
+                self._watermarks.pop(table, None)
+                self._checked_at.pop(table, None)
+            return self._invalidate_locked(set(tables))
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "hits_shared": self.hits_shared,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "watermark_probes": self.watermark_probes,
+                "skipped_too_large": self.skipped_too_large,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "shared": self.shared.backend if self.shared is not None else None,
+            }
@@ -0,0 +1,900 @@
+# In-memory rollup cubes for dashboard-style aggregate questions
+#
+# Spend by vendor, monthly invoice trends, line item categories and payment
+# outflow are the most common questions, and each used to be an aggregate
+# scan of the fact tables. The service keeps three cubes instead:
+#
+#   invoices    by (date, vendorId, status)                 count, amount, tax, total
+#   line_items  by (category, invoice date, vendor, status) count, quantity, amount
+#   payments    by (paymentDate, method)                    count, amount
+#
+# plus the vendors dimension (name, category). Cubes keep each fact row's
+# contribution, so they are refreshed incrementally from updatedAt/createdAt
+# watermarks, with a full reload when rows disappear, when the measure sums
+# no longer match the table (in-place updates of line items and payments,
+# which have no updatedAt) and every ROLLUP_FULL_RELOAD_SECONDS. Generated SQL is
+# parsed with sqlglot and answered from a cube only when the cube can answer
+# it exactly (same rows, values and column names as PostgreSQL); anything
+# else runs on the database as before.
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, time as dt_time
+from decimal import ROUND_HALF_UP, Decimal
+
+from sqlalchemy import text
+
+from app.sql_translate import sqlglot
+
+if sqlglot is not None:
+    from sqlglot import exp
+
+
+class Cube:
+    """
+    Sums of one fact table's measures per dimension key.
+
+    `rows` remembers every fact row's key and measure values so an update
+    can move its contribution; each cell is [count, sum1, non-null count1, ...].
+    """
+
+    def __init__(self, table: str, watermark: str, measures: tuple):
+        self.table = table
+        self.watermark = watermark
+        self.measures = measures
+        self.rows: dict = {}
+        self.cells: dict = {}
+        self.latest = None
+        self.loaded = False
+        # Bumped on every change so answers can be memoized per cube state
+        self.version = 0
+
+    def clear(self):
+        self.rows.clear()
+        self.cells.clear()
+        self.latest = None
+        self.loaded = False
+        self.version += 1
+
+    def _apply(self, key, values, sign: int):
+        self.version += 1
+        cell = self.cells.get(key)
+        if cell is None:
+            cell = self.cells[key] = [0] + [Decimal(0), 0] * len(self.measures)
+        cell[0] += sign
+        for i, value in enumerate(values):
+            if value is not None:
+                cell[1 + 2 * i] += value if sign > 0 else -value
+                cell[2 + 2 * i] += sign
+        if cell[0] == 0:
+            del self.cells[key]
+
+    def upsert(self, row_id, key, values) -> tuple | None:
+        """Add or replace a fact row; returns its previous key when it moved"""
+        previous = self.rows.get(row_id)
+        if previous is not None:
+            if previous == (key, values):
+                return None
+            self._apply(previous[0], previous[1], -1)
+        self.rows[row_id] = (key, values)
+        self._apply(key, values, 1)
+        return previous[0] if previous is not None and previous[0] != key else None
+
+    def totals(self) -> tuple:
+        """Sum of each measure over all rows, to compare with the table's"""
+        return tuple(sum((cell[1 + 2 * i] for cell in self.cells.values()), Decimal(0))
+                     for i in range(len(self.measures)))
+
+
+def _quote(name: str) -> str:
+    return f'"{name}"'
+
+
+class RollupStore:
+    """
+    The cubes, their refresh and the SQL router.
+
+    `answer(sql)` returns (columns, rows) when the (PostgreSQL) SQL can be
+    answered exactly from a cube, otherwise None. Cubes are refreshed at
+    most every `refresh_interval` seconds, so answers can lag writes by up
+    to that long, as with the result cache watermarks.
+    """
+
+    def __init__(self, engine, enabled: bool = True, refresh_interval: float = 5.0,
+                 max_rows: int = 2_000_000, max_plans: int = 1024, full_reload_interval: float = 600.0):
+        self.engine = engine
+        self.enabled = enabled and sqlglot is not None and engine.dialect.name == "postgresql"
+        self.refresh_interval = refresh_interval
+        self.full_reload_interval = full_reload_interval
+        self.max_rows = max_rows
+        self.max_plans = max_plans
+        self.invoices = Cube("invoices", "updatedAt", ("amount", "tax", "total"))
+        self.line_items = Cube("line_items", "createdAt", ("quantity", "amount"))
+        self.payments = Cube("payments", "createdAt", ("amount",))
+        self.vendors: dict = {}
+        self._vendor_mark = None
+        self._line_ids_by_invoice: dict = {}
+        self._plans: OrderedDict = OrderedDict()
+        self._lock = threading.RLock()
+        self._refreshed_at = 0.0
+        self._reloaded_at = 0.0
+        # Write counters of the tables at the last refresh; None forces a probe
+        self._signal = None
+        self._numeric_extract = True
+        self.routed = 0
+        self.passed = 0
+        self.refreshes = 0
+        self.unchanged = 0
+        self.full_loads = 0
+        self.last_refresh_ms = None
+
+    @classmethod
+    def from_env(cls, engine) -> "RollupStore":
+        return cls(
+            engine,
+            enabled=os.getenv("ROLLUPS_ENABLED", "true").lower() in ("1", "true", "yes"),
+            refresh_interval=float(os.getenv("ROLLUP_REFRESH_INTERVAL", "5")),
+            max_rows=int(os.getenv("ROLLUP_MAX_ROWS", "2000000")),
+            full_reload_interval=float(os.getenv("ROLLUP_FULL_RELOAD_SECONDS", "600")),
+        )
+
+    # -- refresh ---------------------------------------------------------
+
+    def refresh(self, force: bool = False) -> bool:
+        """Bring the cubes up to date; returns False when they cannot be used"""
+        if not self.enabled:
+            return False
+        with self._lock:
+            if not force and time.monotonic() - self._refreshed_at < self.refresh_interval:
+                return self.invoices.loaded
+            start = time.perf_counter()
+            if self.full_reload_interval > 0 and time.monotonic() - self._reloaded_at >= self.full_reload_interval:
+                # Catches edits the watermarks and sums cannot see (e.g. a line item's category)
+                self._drop_cubes()
+                self._reloaded_at = time.monotonic()
+            try:
+                with self.engine.connect() as conn:
+                    conn = conn.execution_options(isolation_level="REPEATABLE READ")
+                    version = conn.dialect.server_version_info or (0,)
+                    # EXTRACT returns numeric from PostgreSQL 14, double precision before
+                    self._numeric_extract = version >= (14,)
+                    signal = self._change_signal(conn)
+                    if not force and signal is not None and signal == self._signal:
+                        conn.rollback()
+                        self._refreshed_at = time.monotonic()
+                        self.unchanged += 1
+                        return True
+                    self._refresh_vendors(conn)
+                    reload_lines = self._refresh_invoices(conn)
+                    self._refresh_line_items(conn, reload_lines)
+                    self._refresh_payments(conn)
+                    conn.rollback()
+                    # A cube left unloaded (e.g. line items racing an invoice insert) retries next time
+                    loaded = all(c.loaded for c in (self.invoices, self.line_items, self.payments))
+                    self._signal = signal if loaded else None
+            except Exception as e:
+                print(f"Warning: Could not refresh rollups: {e}")
+                self._drop_cubes()
+                self._refreshed_at = time.monotonic()
+                return False
+            self._refreshed_at = time.monotonic()
+            self.refreshes += 1
+            self.last_refresh_ms = round((time.perf_counter() - start) * 1000, 3)
+            return True
+
+    def _change_signal(self, conn):
+        """
+        Insert/update/delete counters of the rolled-up tables from pg_stat_user_tables.
+
+        One catalog read instead of scanning the tables: the probes below only
+        run when a counter moved. The counters trail commits by PostgreSQL's
+        statistics flush delay, and are all zero (None is returned, so every
+        refresh probes) with track_counts off.
+        """
+        rows = conn.execute(text(
+            "SELECT relname, n_tup_ins, n_tup_upd, n_tup_del, n_live_tup, current_setting('track_counts') "
+            "FROM pg_stat_user_tables WHERE schemaname = current_schema() AND relname = ANY(:tables)"),
+            {"tables": ["vendors", "invoices", "line_items", "payments"]}).all()
+        if not rows or rows[0][-1] != "on":
+            return None
+        return tuple(sorted(tuple(row[:-1]) for row in rows))
+
+    def _probe(self, conn, cube: Cube):
+        """Row count, watermark and measure sums; the sums ride along on the COUNT(*) scan"""
+        sums = ", ".join(f"COALESCE(SUM({_quote(m)}), 0)" for m in cube.measures)
+        count, latest, *totals = conn.execute(text(
+            f"SELECT COUNT(*), MAX({_quote(cube.watermark)}), {sums} FROM {cube.table}")).one()
+        if count > self.max_rows:
+            raise ValueError(f"{cube.table} has {count} rows, over ROLLUP_MAX_ROWS")
+        return count, latest, tuple(totals)
+
+    def _refresh_vendors(self, conn):
+        mark = conn.execute(text('SELECT COUNT(*), MAX("updatedAt") FROM vendors')).one()
+        if tuple(mark) != self._vendor_mark:
+            self.vendors = {vid: (name, category) for vid, name, category in
+                            conn.execute(text("SELECT id, name, category FROM vendors"))}
+            self._vendor_mark = tuple(mark)
+
+    def _delta(self, conn, cube: Cube, columns: str, count: int, latest):
+        """Rows changed since the cube's watermark, or all rows when a full load is needed"""
+        # Fewer rows means deletes; an older watermark means a rewritten one: both need a full load
+        full = not cube.loaded or count < len(cube.rows) or (
+            latest is not None and cube.latest is not None and latest < cube.latest)
+        if not full and latest == cube.latest:
+            return False, []
+        sql = f"SELECT {columns} FROM {cube.table}"
+        params = {}
+        if not full:
+            # >= so rows sharing the previous watermark timestamp are not missed (upserts are idempotent)
+            sql += f" WHERE {_quote(cube.watermark)} >= :since"
+            params["since"] = cube.latest
+        return full, conn.execute(text(sql), params).all()
+
+    def _refresh_invoices(self, conn) -> bool:
+        cube = self.invoices
+        count, latest, totals = self._probe(conn, cube)
+        full, rows = self._delta(conn, cube, 'id, date, "vendorId", status, amount, tax, total, "updatedAt"', count, latest)
+        if full:
+            cube.clear()
+            self.full_loads += 1
+        moved = []
+        for row_id, day, vendor_id, status, amount, tax, total, _ in rows:
+            previous = cube.upsert(row_id, (day, vendor_id, status), (amount, tax, total))
+            if previous is not None:
+                moved.append(row_id)
+        if len(cube.rows) != count or cube.totals() != totals:
+            # Rows were deleted (or rewritten without a newer updatedAt): reload everything
+            return self._reload_invoices(conn, count, latest)
+        cube.latest, cube.loaded = latest, True
+        for invoice_id in moved:
+            self._move_line_items(invoice_id)
+        return full
+
+    def _reload_invoices(self, conn, count, latest) -> bool:
+        cube = self.invoices
+        cube.clear()
+        full, rows = self._delta(conn, cube, 'id, date, "vendorId", status, amount, tax, total', count, latest)
+        for row_id, day, vendor_id, status, amount, tax, total in rows:
+            cube.upsert(row_id, (day, vendor_id, status), (amount, tax, total))
+        cube.latest, cube.loaded = latest, True
+        self.full_loads += 1
+        return True
+
+    def _line_key(self, category, invoice_id):
+        invoice = self.invoices.rows.get(invoice_id)
+        if invoice is None:
+            return None
+        return (category,) + invoice[0]
+
+    def _move_line_items(self, invoice_id):
+        cube = self.line_items
+        for line_id in self._line_ids_by_invoice.get(invoice_id, ()):
+            key, values = cube.rows[line_id]
+            cube.upsert(line_id, self._line_key(key[0], invoice_id), values)
+
+    def _refresh_line_items(self, conn, reload: bool):
+        cube = self.line_items
+        if reload:
+            cube.clear()
+            self._line_ids_by_invoice.clear()
+        count, latest, totals = self._probe(conn, cube)
+        full, rows = self._delta(conn, cube, 'id, "invoiceId", category, quantity, amount', count, latest)
+        if full and cube.loaded:
+            cube.clear()
+            self._line_ids_by_invoice.clear()
+        for row_id, invoice_id, category, quantity, amount in rows:
+            key = self._line_key(category, invoice_id)
+            if key is None:
+                # Invoice committed after the invoices were read: retry on the next refresh
+                cube.clear()
+                self._line_ids_by_invoice.clear()
+                return
+            cube.upsert(row_id, key, (quantity, amount))
+            self._line_ids_by_invoice.setdefault(invoice_id, set()).add(row_id)
+        if not reload and (len(cube.rows) != count or cube.totals() != totals):
+            # Deleted rows, or amounts updated in place (line items have no updatedAt)
+            return self._refresh_line_items(conn, reload=True)
+        cube.latest, cube.loaded = latest, True
+
+    def _refresh_payments(self, conn):
+        cube = self.payments
+        count, latest, totals = self._probe(conn, cube)
+        full, rows = self._delta(conn, cube, 'id, "paymentDate", method, amount', count, latest)
+        if full:
+            cube.clear()
+            self.full_loads += 1
+        for row_id, paid_at, method, amount in rows:
+            cube.upsert(row_id, (paid_at, method), (amount,))
+        if len(cube.rows) != count or cube.totals() != totals:
+            # Deleted rows, or amounts updated in place (payments have no updatedAt)
+            cube.clear()
+            self.full_loads += 1
+            _, rows = self._delta(conn, cube, 'id, "paymentDate", method, amount', count, latest)
+            for row_id, paid_at, method, amount in rows:
+                cube.upsert(row_id, (paid_at, method), (amount,))
+        cube.latest, cube.loaded = latest, True
+
+    def _drop_cubes(self):
+        for cube in (self.invoices, self.line_items, self.payments):
+            cube.clear()
+        self._signal = None
+        self.vendors, self._vendor_mark = {}, None
+        self._line_ids_by_invoice.clear()
+
+    def expire(self):
+        """Drop the cubes so their next use reloads them in full, e.g. after /cache/invalidate"""
+        with self._lock:
+            self._drop_cubes()
+            self._refreshed_at = 0.0
+
+    def clear(self):
+        """Drop cubes and compiled plans, e.g. after a schema change"""
+        with self._lock:
+            self._drop_cubes()
+            self._plans.clear()
+            self._refreshed_at = 0.0
+
+    # -- routing ---------------------------------------------------------
+
+    def _plan(self, sql: str):
+        with self._lock:
+            if sql in self._plans:
+                self._plans.move_to_end(sql)
+                return self._plans[sql]
+        try:
+            trees = sqlglot.parse(sql, read="postgres")
+            plan = _Planner(self).compile(trees[0]) if len(trees) == 1 and trees[0] is not None else None
+        except Exception:
+            plan = None
+        with self._lock:
+            self._plans[sql] = plan
+            while len(self._plans) > self.max_plans:
+                self._plans.popitem(last=False)
+        return plan
+
+    def answer(self, sql: str):
+        """(columns, rows) for SQL a cube answers exactly, else None"""
+        if not self.enabled:
+            return None
+        plan = self._plan(sql)
+        if plan is None or not self.refresh():
+            with self._lock:
+                self.passed += 1
+            return None
+        with self._lock:
+            cube = getattr(self, plan.cube)
+            if not cube.loaded:
+                self.passed += 1
+                return None
+            version = (cube.version, self._vendor_mark)
+            if plan.memo is None or plan.memo[0] != version:
+                plan.memo = (version, plan.run(list(cube.cells.items()), self))
+            self.routed += 1
+            columns, rows = plan.memo[1]
+        return list(columns), list(rows)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "routed": self.routed,
+                "passed_through": self.passed,
+                "refreshes": self.refreshes,
+                "unchanged": self.unchanged,
+                "full_loads": self.full_loads,
+                "last_refresh_ms": self.last_refresh_ms,
+                "invoice_cells": len(self.invoices.cells),
+                "line_item_cells": len(self.line_items.cells),
+                "payment_cells": len(self.payments.cells),
+                "plans": len(self._plans),
+            }
+
+
+# -- SQL -> cube plan -------------------------------------------------------
+
+# Parent edges: (child table, child column) -> (parent table, parent key)
+_PARENTS = {
+    ("invoices", "vendorId"): ("vendors", "id"),
+    ("line_items", "invoiceId"): ("invoices", "id"),
+}
+
+# Per cube: dimension columns -> accessor(key, store), and measure columns -> index
+_DIMENSIONS = {
+    "invoices": {
+        ("invoices", "date"): lambda k, s: k[0],
+        ("invoices", "vendorId"): lambda k, s: k[1],
+        ("invoices", "status"): lambda k, s: k[2],
+        ("vendors", "id"): lambda k, s: k[1],
+        ("vendors", "name"): lambda k, s: s.vendors.get(k[1], (None, None))[0],
+        ("vendors", "category"): lambda k, s: s.vendors.get(k[1], (None, None))[1],
+    },
+    "line_items": {
+        ("line_items", "category"): lambda k, s: k[0],
+        ("invoices", "date"): lambda k, s: k[1],
+        ("invoices", "vendorId"): lambda k, s: k[2],
+        ("invoices", "status"): lambda k, s: k[3],
+        ("vendors", "id"): lambda k, s: k[2],
+        ("vendors", "name"): lambda k, s: s.vendors.get(k[2], (None, None))[0],
+        ("vendors", "category"): lambda k, s: s.vendors.get(k[2], (None, None))[1],
+    },
+    "payments": {
+        ("payments", "paymentDate"): lambda k, s: k[0],
+        ("payments", "method"): lambda k, s: k[1],
+    },
+}
+_MEASURES = {
+    "invoices": {"amount": 0, "tax": 1, "total": 2},
+    "line_items": {"quantity": 0, "amount": 1},
+    "payments": {"amount": 0},
+}
+_TABLE_COLUMNS = {
+    "invoices": {"id", "invoiceNumber", "date", "dueDate", "amount", "tax", "total", "status", "vendorId",
+                 "customerId", "notes", "createdAt", "updatedAt"},
+    "vendors": {"id", "name", "category", "email", "phone", "address", "createdAt", "updatedAt"},
+    "line_items": {"id", "invoiceId", "description", "quantity", "unitPrice", "amount", "category", "createdAt"},
+    "payments": {"id", "invoiceId", "amount", "paymentDate", "method", "reference", "notes", "createdAt"},
+}
+# PostgreSQL TO_CHAR patterns sqlglot maps to strftime that mean the same thing
+_TO_CHAR_CODES = {"%Y", "%m", "%d"}
+_TRUNC_UNITS = {"DAY", "MONTH", "QUARTER", "YEAR"}
+_EXTRACT_UNITS = {"YEAR", "QUARTER", "MONTH", "DAY"}
+
+
+class _Unsupported(Exception):
+    pass
+
+
+def _truncate(value, unit: str):
+    if value is None:
+        return None
+    if unit == "DAY":
+        return datetime(value.year, value.month, value.day)
+    if unit == "MONTH":
+        return datetime(value.year, value.month, 1)
+    if unit == "QUARTER":
+        return datetime(value.year, 3 * ((value.month - 1) // 3) + 1, 1)
+    return datetime(value.year, 1, 1)
+
+
+def _extract(value, unit: str):
+    if value is None:
+        return None
+    if unit == "QUARTER":
+        return (value.month - 1) // 3 + 1
+    return getattr(value, unit.lower())
+
+
+def _round(value, places: int):
+    if value is None:
+        return None
+    return value.quantize(Decimal(1).scaleb(-places), rounding=ROUND_HALF_UP)
+
+
+def _coerce_literal(literal: "exp.Expression", kind: str):
+    """Python value of a literal compared with a value of `kind` (time/number/text)"""
+    if isinstance(literal, exp.Cast):
+        if kind != "time" or literal.to.this not in (exp.DataType.Type.DATE, exp.DataType.Type.TIMESTAMP):
+            raise _Unsupported("cast literal")
+        literal = literal.this
+    if not isinstance(literal, exp.Literal):
+        raise _Unsupported("non-literal comparison")
+    if kind == "time":
+        if not literal.is_string:
+            raise _Unsupported("non-string time literal")
+        value = literal.this.strip()
+        try:
+            return datetime.fromisoformat(value) if len(value) > 10 else datetime.combine(date.fromisoformat(value), datetime.min.time())
+        except ValueError:
+            raise _Unsupported("time literal format")
+    if kind == "number":
+        if literal.is_string:
+            raise _Unsupported("string compared to a number")
+        return Decimal(literal.this)
+    if not literal.is_string:
+        raise _Unsupported("number compared to text")
+    return literal.this
+
+
+def _compare(op, left, right):
+    if left is None or right is None:
+        return None
+    return op(left, right)
+
+
+def _and(values):
+    if any(v is False for v in values):
+        return False
+    return None if any(v is None for v in values) else True
+
+
+def _or(values):
+    if any(v is True for v in values):
+        return True
+    return None if any(v is None for v in values) else False
+
+
+_COMPARISONS = {
+    exp.EQ: lambda a, b: a == b,
+    exp.NEQ: lambda a, b: a != b,
+    exp.GT: lambda a, b: a > b,
+    exp.GTE: lambda a, b: a >= b,
+    exp.LT: lambda a, b: a < b,
+    exp.LTE: lambda a, b: a <= b,
+} if sqlglot is not None else {}
+
+
+class _Plan:
+    def __init__(self, cube, where, group, items, order, limit, offset, columns):
+        self.cube = cube
+        self.where = where
+        self.group = group
+        self.items = items
+        self.order = order
+        self.limit = limit
+        self.offset = offset
+        self.columns = columns
+        self.memo = None
+
+    def run(self, cells, store):
+        groups: dict = {}
+        for key, cell in cells:
+            if self.where is not None and self.where(key, store) is not True:
+                continue
+            group_key = tuple(fn(key, store) for fn in self.group)
+            total = groups.get(group_key)
+            if total is None:
+                groups[group_key] = list(cell)
+            else:
+                for i, value in enumerate(cell):
+                    total[i] += value
+        if not self.group and not groups:
+            # An aggregate without GROUP BY returns one row even when nothing matched
+            groups[()] = None
+        rows = [tuple(item(group_key, total) for item in self.items) + tuple(o[0](group_key, total) for o in self.order)
+                for group_key, total in groups.items()]
+        width = len(self.items)
+        for position, (_, desc, nulls_first) in reversed(list(enumerate(self.order))):
+            index = width + position
+            present = [row for row in rows if row[index] is not None]
+            missing = [row for row in rows if row[index] is None]
+            present.sort(key=lambda row: row[index], reverse=desc)
+            rows = missing + present if nulls_first else present + missing
+        rows = [row[:width] for row in rows]
+        if self.offset:
+            rows = rows[self.offset:]
+        if self.limit is not None:
+            rows = rows[:self.limit]
+        return list(self.columns), rows
+
+
+class _Planner:
+    """Compile one parsed SELECT into a _Plan over a cube, or return None"""
+
+    def __init__(self, store: RollupStore):
+        self.store = store
+        self.tables: dict = {}
+        self.cube = None
+
+    def compile(self, tree) -> _Plan | None:
+        try:
+            return self._compile(tree)
+        except _Unsupported:
+            return None
+
+    # FROM / JOIN ---------------------------------------------------------
+
+    def _resolve_tables(self, tree):
+        source = tree.args.get("from_") or tree.args.get("from")
+        if source is None or not isinstance(source.this, exp.Table):
+            raise _Unsupported("FROM")
+        tables = [(source.this, None)] + [(join.this, join) for join in tree.args.get("joins") or []]
+        edges = []
+        for table, join in tables:
+            if not isinstance(table, exp.Table) or table.name not in _TABLE_COLUMNS or table.args.get("db"):
+                raise _Unsupported("table")
+            alias = table.alias_or_name
+            if alias in self.tables or table.name in self.tables.values():
+                raise _Unsupported("table used twice")
+            self.tables[alias] = table.name
+            if join is not None:
+                if join.kind not in ("", "INNER") or join.side not in ("", "LEFT") or join.args.get("using"):
+                    raise _Unsupported("join type")
+                edges.append((join, table.name))
+        present = set(self.tables.values())
+        if "line_items" in present:
+            self.cube = "line_items"
+        elif "invoices" in present:
+            self.cube = "invoices"
+        elif present == {"payments"}:
+            self.cube = "payments"
+        else:
+            raise _Unsupported("no fact table")
+        if "payments" in present and self.cube != "payments":
+            raise _Unsupported("payments joined")
+
+        # Every join must follow a foreign key towards a parent (a to-one join keeps the fact rows)
+        for join, joined in edges:
+            on = join.args.get("on")
+            if not isinstance(on, exp.EQ) or not all(isinstance(side, exp.Column) for side in (on.this, on.expression)):
+                raise _Unsupported("join condition")
+            ends = {self._column(on.this), self._column(on.expression)}
+            edge = next(((child, parent) for child, parent in _PARENTS.items() if {child, parent} == ends), None)
+            if edge is None:
+                raise _Unsupported("join is not a foreign key")
+            parent = edge[1][0]
+            if join.side == "LEFT" and joined != parent:
+                raise _Unsupported("outer join to a child table")
+        if "vendors" in present and "invoices" not in present:
+            raise _Unsupported("tables")
+
+    def _column(self, column: "exp.Column") -> tuple:
+        """(table, column) of a column reference"""
+        name = column.name
+        if column.table:
+            table = self.tables.get(column.table)
+            if table is None:
+                raise _Unsupported("unknown alias")
+        else:
+            owners = [t for t in self.tables.values() if name in _TABLE_COLUMNS[t]]
+            if len(owners) != 1:
+                raise _Unsupported("unresolved column")
+            table = owners[0]
+        if name not in _TABLE_COLUMNS[table]:
+            raise _Unsupported("unknown column")
+        return table, name
+
+    # Scalar (per-cell) expressions ------------------------------------------
+
+    def _scalar(self, node):
+        """(accessor(key, store), kind) of a dimension expression"""
+        if isinstance(node, exp.Paren):
+            return self._scalar(node.this)
+        if isinstance(node, exp.Column):
+            ref = self._column(node)
+            accessor = _DIMENSIONS[self.cube].get(ref)
+            if accessor is None:
+                raise _Unsupported("not a cube dimension")
+            return accessor, "time" if ref[1] in ("date", "paymentDate") else "text"
+        if isinstance(node, (exp.TimestampTrunc, exp.DateTrunc)):
+            unit = node.text("unit").upper()
+            inner, kind = self._scalar(node.this)
+            if kind != "time" or unit not in _TRUNC_UNITS:
+                raise _Unsupported("date_trunc")
+            return (lambda k, s: _truncate(inner(k, s), unit)), "time"
+        if isinstance(node, exp.Extract):
+            unit = node.this.name.upper()
+            # The translator casts MySQL's YEAR(date)/MONTH(date) argument to DATE; these units read the same
+            inner, kind = self._scalar(node.expression)
+            if kind not in ("time", "date") or unit not in _EXTRACT_UNITS:
+                raise _Unsupported("extract")
+            convert = Decimal if self.store._numeric_extract else float
+            return (lambda k, s: None if inner(k, s) is None else convert(_extract(inner(k, s), unit))), "number"
+        if isinstance(node, exp.TimeToStr):
+            fmt = node.args["format"].this
+            inner, kind = self._scalar(node.this)
+            codes = {fmt[i:i + 2] for i in range(len(fmt)) if fmt[i] == "%"}
+            if kind not in ("time", "date") or not codes <= _TO_CHAR_CODES or any(c not in "%Ymd-/ " for c in fmt):
+                raise _Unsupported("to_char format")
+            return (lambda k, s: None if inner(k, s) is None else inner(k, s).strftime(fmt)), "text"
+        if isinstance(node, exp.Cast) and node.to.this == exp.DataType.Type.DATE:
+            inner, kind = self._scalar(node.this)
+            if kind != "time":
+                raise _Unsupported("cast")
+            return (lambda k, s: None if inner(k, s) is None else inner(k, s).date()), "date"
+        if isinstance(node, exp.Cast) and node.to.this == exp.DataType.Type.TIMESTAMP:
+            # DATE_FORMAT(date, ...) arrives as TO_CHAR(CAST(date AS TIMESTAMP), ...): a no-op on these columns
+            inner, kind = self._scalar(node.this)
+            if kind == "time":
+                return inner, "time"
+            if kind == "date":
+                return (lambda k, s: None if inner(k, s) is None else datetime.combine(inner(k, s), dt_time())), "time"
+            raise _Unsupported("cast")
+        raise _Unsupported(f"expression {type(node).__name__}")
+
+    def _predicate(self, node):
+        """Three-valued predicate(key, store) of a WHERE clause"""
+        if isinstance(node, exp.Paren):
+            return self._predicate(node.this)
+        if isinstance(node, exp.And):
+            parts = [self._predicate(p) for p in node.flatten()]
+            return lambda k, s: _and([p(k, s) for p in parts])
+        if isinstance(node, exp.Or):
+            parts = [self._predicate(p) for p in node.flatten()]
+            return lambda k, s: _or([p(k, s) for p in parts])
+        if isinstance(node, exp.Not):
+            inner = self._predicate(node.this)
+            return lambda k, s: None if inner(k, s) is None else not inner(k, s)
+        if isinstance(node, exp.Is) and isinstance(node.expression, exp.Null):
+            value, _ = self._scalar(node.this)
+            return lambda k, s: value(k, s) is None
+        if type(node) in _COMPARISONS:
+            op = _COMPARISONS[type(node)]
+            left, right = node.this, node.expression
+            if isinstance(left, (exp.Literal, exp.Cast)) and not isinstance(right, (exp.Literal,)):
+                left, right = right, left
+                op = {exp.GT: _COMPARISONS[exp.LT], exp.GTE: _COMPARISONS[exp.LTE],
+                      exp.LT: _COMPARISONS[exp.GT], exp.LTE: _COMPARISONS[exp.GTE]}.get(type(node), op)
+            value, kind = self._scalar(left)
+            if kind == "text" and type(node) not in (exp.EQ, exp.NEQ):
+                # Text ordering depends on the database collation
+                raise _Unsupported("text ordering")
+            constant = self._constant(right, kind)
+            return lambda k, s: _compare(op, value(k, s), constant)
+        if isinstance(node, exp.In) and not node.args.get("query"):
+            value, kind = self._scalar(node.this)
+            constants = [self._constant(e, kind) for e in node.expressions]
+            return lambda k, s: None if value(k, s) is None else value(k, s) in constants
+        if isinstance(node, exp.Between):
+            value, kind = self._scalar(node.this)
+            if kind == "text":
+                raise _Unsupported("text ordering")
+            low, high = self._constant(node.args["low"], kind), self._constant(node.args["high"], kind)
+            return lambda k, s: _and([_compare(lambda a, b: a >= b, value(k, s), low),
+                                      _compare(lambda a, b: a <= b, value(k, s), high)])
+        raise _Unsupported(f"predicate {type(node).__name__}")
+
+    def _constant(self, node, kind: str):
+        if kind == "date":
+            value = _coerce_literal(node, "time")
+            return value.date() if isinstance(value, datetime) else value
+        return _coerce_literal(node, kind)
+
+    # Aggregates (per-group) ----------------------------------------------
+
+    def _aggregate(self, node):
+        """value(total cell) of an aggregate expression, or None when `node` is not one"""
+        if isinstance(node, exp.Round) and isinstance(node.this, (exp.Sum, exp.Count, exp.Round)):
+            if isinstance(node.this, exp.Count):
+                # ROUND(bigint) is double precision in PostgreSQL, not the numeric the cube would return
+                raise _Unsupported("round of a count")
+            inner = self._aggregate(node.this)
+            decimals = node.args.get("decimals")
+            if decimals is not None and not (isinstance(decimals, exp.Literal) and not decimals.is_string):
+                raise _Unsupported("round places")
+            places = int(decimals.this) if decimals is not None else 0
+            return lambda total: _round(inner(total), places)
+        if isinstance(node, exp.Count):
+            arg = node.this
+            if isinstance(arg, exp.Distinct):
+                raise _Unsupported("count distinct")
+            if isinstance(arg, exp.Star) or (isinstance(arg, exp.Literal) and not arg.is_string):
+                return lambda total: total[0] if total else 0
+            if isinstance(arg, exp.Column):
+                table, name = self._column(arg)
+                measure = _MEASURES[self.cube].get(name) if table == self.cube else None
+                if measure is not None:
+                    return lambda total: total[2 + 2 * measure] if total else 0
+                if (table, name) in ((self.cube, "id"),) or (table, name) in _DIMENSIONS[self.cube]:
+                    nullable = name in ("category", "method")
+                    if not nullable:
+                        return lambda total: total[0] if total else 0
+            raise _Unsupported("count argument")
+        if isinstance(node, exp.Sum):
+            arg = node.this
+            if not isinstance(arg, exp.Column):
+                raise _Unsupported("sum argument")
+            table, name = self._column(arg)
+            measure = _MEASURES[self.cube].get(name) if table == self.cube else None
+            if measure is None:
+                raise _Unsupported("sum of a non-measure")
+            return lambda total: total[1 + 2 * measure] if total and total[2 + 2 * measure] else None
+        if isinstance(node, exp.AggFunc) or node.find(exp.AggFunc):
+            raise _Unsupported(f"aggregate {type(node).__name__}")
+        return None
+
+    # Output names ----------------------------------------------------------
+
+    @staticmethod
+    def _output_name(item) -> str:
+        """Column name PostgreSQL gives a select item"""
+        if isinstance(item, exp.Alias):
+            ident = item.args["alias"]
+            return ident.name if ident.quoted else ident.name.lower()
+        node = item
+        while isinstance(node, (exp.Cast, exp.Paren)):
+            node = node.this
+        if isinstance(node, exp.Column):
+            return node.name
+        names = {exp.Sum: "sum", exp.Count: "count", exp.Round: "round", exp.TimestampTrunc: "date_trunc",
+                 exp.DateTrunc: "date_trunc", exp.Extract: "extract", exp.TimeToStr: "to_char"}
+        if isinstance(item, exp.Cast):
+            raise _Unsupported("cast output name")
+        name = names.get(type(item))
+        if name is None:
+            raise _Unsupported("output name")
+        return name
+
+    # SELECT ----------------------------------------------------------------
+
+    def _compile(self, tree) -> _Plan:
+        if not isinstance(tree, exp.Select):
+            raise _Unsupported("not a SELECT")
+        for arg in ("with", "having", "distinct", "qualify", "windows", "laterals", "into", "locks"):
+            if tree.args.get(arg):
+                raise _Unsupported(arg)
+        if any(isinstance(node, (exp.Subquery, exp.Window)) for node in tree.find_all(exp.Subquery, exp.Window)):
+            raise _Unsupported("subquery or window")
+        self._resolve_tables(tree)
+
+        items = tree.expressions
+        if any(isinstance(item, exp.Star) or (isinstance(item, exp.Column) and isinstance(item.this, exp.Star))
+               for item in items):
+            raise _Unsupported("SELECT *")
+        bodies = [item.this if isinstance(item, exp.Alias) else item for item in items]
+        aliases = {(item.alias if isinstance(item, exp.Alias) else None): body for item, body in zip(items, bodies)}
+        columns = [self._output_name(item) for item in items]
+
+        # GROUP BY: ordinals, output aliases or expressions
+        group_nodes = []
+        group = tree.args.get("group")
+        for node in (group.expressions if group else []):
+            if isinstance(node, exp.Literal) and not node.is_string:
+                node = bodies[int(node.this) - 1]
+            elif isinstance(node, exp.Column) and not node.table and node.name in aliases and \
+                    node.name not in _TABLE_COLUMNS_ALL:
+                # GROUP BY resolves a bare name to an input column before an output alias
+                node = aliases[node.name]
+            group_nodes.append(node)
+        group_sql = [node.sql(dialect="postgres") for node in group_nodes]
+        scalars = [self._scalar(node) for node in group_nodes]
+        group_fns = [fn for fn, _ in scalars]
+        group_kinds = [kind for _, kind in scalars]
+
+        def group_value(node):
+            position = group_sql.index(node.sql(dialect="postgres")) if node.sql(dialect="postgres") in group_sql else None
+            if position is None:
+                raise _Unsupported("selected expression not grouped")
+            return lambda group_key, total: group_key[position]
+
+        def output(node):
+            aggregate = self._aggregate(node)
+            if aggregate is not None:
+                return lambda group_key, total: aggregate(total)
+            if not group_nodes:
+                raise _Unsupported("non-aggregate without GROUP BY")
+            return group_value(node)
+
+        item_fns = [output(body) for body in bodies]
+
+        order = []
+        for ordered in (tree.args.get("order").expressions if tree.args.get("order") else []):
+            node = ordered.this
+            if isinstance(node, exp.Literal) and not node.is_string:
+                index = int(node.this) - 1
+                body, fn = bodies[index], item_fns[index]
+            elif isinstance(node, exp.Column) and not node.table and node.name in aliases:
+                # PostgreSQL resolves a bare ORDER BY name to an output column first
+                body = aliases[node.name]
+                fn = output(body)
+            else:
+                body, fn = node, output(node)
+            position = group_sql.index(body.sql(dialect="postgres")) if body.sql(dialect="postgres") in group_sql else None
+            if position is not None and group_kinds[position] == "text" and \
+                    not isinstance(body.unnest(), exp.TimeToStr):
+                # Text ordering depends on the database collation (to_char digit formats sort the same everywhere)
+                raise _Unsupported("text ordering")
+            desc = bool(ordered.args.get("desc"))
+            nulls_first = ordered.args.get("nulls_first")
+            if nulls_first is None:
+                nulls_first = desc
+            order.append((fn, desc, bool(nulls_first)))
+
+        limit = self._int_clause(tree.args.get("limit"))
+        offset = self._int_clause(tree.args.get("offset"))
+        where = tree.args.get("where")
+        return _Plan(self.cube, self._predicate(where.this) if where else None, group_fns, item_fns,
+                     order, limit, offset, columns)
+
+    @staticmethod
+    def _int_clause(clause):
+        if clause is None:
+            return None
+        value = clause.expression
+        if not isinstance(value, exp.Literal) or value.is_string:
+            raise _Unsupported("LIMIT/OFFSET")
+        return int(value.this)
+
+
+_TABLE_COLUMNS_ALL = set().union(*_TABLE_COLUMNS.values())
@@ -0,0 +1,388 @@
+# Schema catalog: bulk introspection and a precomputed prompt fragment
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from app.table_ranker import TableRanker, estimate_tokens
+
+# Prisma's bookkeeping table is never useful context for the model
+DEFAULT_EXCLUDED_TABLES = "_prisma_migrations"
+
+# Send only the tables relevant to each question instead of the whole schema
+SCHEMA_PRUNING = os.getenv("SCHEMA_PRUNING", "true").lower() in ("1", "true", "yes")
+
+_TYPE_ALIASES = {
+    "character varying": "varchar",
+    "timestamp without time zone": "timestamp",
+    "timestamp with time zone": "timestamptz",
+    "double precision": "double",
+    "USER-DEFINED": "enum",
+}
+
+_PG_COLUMNS_SQL = """
+SELECT table_name, column_name, data_type, is_nullable
+FROM information_schema.columns
+WHERE table_schema = current_schema()
+ORDER BY table_name, ordinal_position
+"""
+
+_PG_KEYS_SQL = """
+SELECT con.contype, rel.relname, frel.relname,
+       ARRAY(SELECT att.attname FROM unnest(con.conkey) WITH ORDINALITY AS k(num, ord)
+             JOIN pg_attribute att ON att.attrelid = con.conrelid AND att.attnum = k.num
+             ORDER BY k.ord),
+       ARRAY(SELECT att.attname FROM unnest(con.confkey) WITH ORDINALITY AS k(num, ord)
+             JOIN pg_attribute att ON att.attrelid = con.confrelid AND att.attnum = k.num
+             ORDER BY k.ord)
+FROM pg_constraint con
+JOIN pg_class rel ON rel.oid = con.conrelid
+JOIN pg_namespace ns ON ns.oid = rel.relnamespace
+LEFT JOIN pg_class frel ON frel.oid = con.confrelid
+WHERE ns.nspname = current_schema() AND con.contype IN ('p', 'f')
+"""
+
+_PG_INDEXES_SQL = """
+SELECT tablename, indexname, indexdef
+FROM pg_indexes
+WHERE schemaname = current_schema()
+"""
+
+_MYSQL_COLUMNS_SQL = """
+SELECT table_name, column_name, data_type, is_nullable
+FROM information_schema.columns
+WHERE table_schema = DATABASE()
+ORDER BY table_name, ordinal_position
+"""
+
+_MYSQL_KEYS_SQL = """
+SELECT kcu.table_name, kcu.constraint_name, kcu.column_name,
+       kcu.referenced_table_name, kcu.referenced_column_name
+FROM information_schema.key_column_usage kcu
+WHERE kcu.table_schema = DATABASE()
+ORDER BY kcu.table_name, kcu.constraint_name, kcu.ordinal_position
+"""
+
+_MYSQL_INDEXES_SQL = """
+SELECT table_name, index_name, column_name, non_unique
+FROM information_schema.statistics
+WHERE table_schema = DATABASE()
+ORDER BY table_name, index_name, seq_in_index
+"""
+
+_INDEX_COLUMNS_RE = re.compile(r"\((.*)\)\s*$")
+
+
+class TableInfo:
+    def __init__(self, name: str):
+        self.name = name
+        # (column name, short type, nullable)
+        self.columns: list[tuple[str, str, bool]] = []
+        self.primary_key: list[str] = []
+        # (columns, referenced table, referenced columns)
+        self.foreign_keys: list[tuple[list, str, list]] = []
+        # (index name, columns, unique)
+        self.indexes: list[tuple[str, list, bool]] = []
+
+    @property
+    def column_names(self) -> list[str]:
+        return [c[0] for c in self.columns]
+
+    def as_dict(self) -> dict:
+        return {
+            "columns": [{"name": n, "type": t, "nullable": nullable} for n, t, nullable in self.columns],
+            "primary_key": self.primary_key,
+            "foreign_keys": [{"columns": c, "references": t, "referenced_columns": rc} for c, t, rc in self.foreign_keys],
+            "indexes": [{"name": n, "columns": c, "unique": u} for n, c, u in self.indexes],
+        }
+
+    @classmethod
+    def from_dict(cls, name: str, data: dict) -> "TableInfo":
+        """Inverse of `as_dict`"""
+        info = cls(name)
+        info.columns = [(c["name"], c["type"], c["nullable"]) for c in data["columns"]]
+        info.primary_key = list(data["primary_key"])
+        info.foreign_keys = [(fk["columns"], fk["references"], fk["referenced_columns"]) for fk in data["foreign_keys"]]
+        info.indexes = [(ix["name"], ix["columns"], ix["unique"]) for ix in data["indexes"]]
+        return info
+
+
+def _short_type(data_type) -> str:
+    data_type = str(data_type)
+    return _TYPE_ALIASES.get(data_type, data_type.lower())
+
+
+def _ensure(tables: dict, name: str) -> TableInfo:
+    if name not in tables:
+        tables[name] = TableInfo(name)
+    return tables[name]
+
+
+def _load_postgres(conn, text) -> dict:
+    tables: dict[str, TableInfo] = {}
+    for table, column, data_type, nullable in conn.execute(text(_PG_COLUMNS_SQL)):
+        _ensure(tables, table).columns.append((column, _short_type(data_type), nullable == "YES"))
+    for kind, table, ref_table, columns, ref_columns in conn.execute(text(_PG_KEYS_SQL)):
+        if table not in tables:
+            continue
+        if kind == "p":
+            tables[table].primary_key = list(columns)
+        else:
+            tables[table].foreign_keys.append((list(columns), ref_table, list(ref_columns)))
+    for table, index_name, definition in conn.execute(text(_PG_INDEXES_SQL)):
+        if table not in tables:
+            continue
+        match = _INDEX_COLUMNS_RE.search(definition)
+        columns = [c.strip().strip('"') for c in match.group(1).split(",")] if match else []
+        tables[table].indexes.append((index_name, columns, " UNIQUE INDEX " in definition.upper()))
+    return tables
+
+
+def _load_mysql(conn, text) -> dict:
+    tables: dict[str, TableInfo] = {}
+    for table, column, data_type, nullable in conn.execute(text(_MYSQL_COLUMNS_SQL)):
+        _ensure(tables, table).columns.append((column, _short_type(data_type), nullable == "YES"))
+    foreign: dict[tuple, tuple] = {}
+    for table, constraint, column, ref_table, ref_column in conn.execute(text(_MYSQL_KEYS_SQL)):
+        if table not in tables:
+            continue
+        if constraint == "PRIMARY":
+            tables[table].primary_key.append(column)
+        elif ref_table:
+            cols, _, ref_cols = foreign.setdefault((table, constraint), ([], ref_table, []))
+            cols.append(column)
+            ref_cols.append(ref_column)
+    for (table, _), fk in foreign.items():
+        tables[table].foreign_keys.append(fk)
+    indexes: dict[tuple, tuple] = {}
+    for table, index_name, column, non_unique in conn.execute(text(_MYSQL_INDEXES_SQL)):
+        if table in tables:
+            indexes.setdefault((table, index_name), ([], not non_unique))[0].append(column)
+    for (table, index_name), (columns, unique) in indexes.items():
+        tables[table].indexes.append((index_name, columns, unique))
+    return tables
+
+
+def _load_generic(engine) -> dict:
+    """Fallback for other dialects (e.g. SQLite): per-table SQLAlchemy inspection"""
+    from sqlalchemy import inspect
+    inspector = inspect(engine)
+    tables: dict[str, TableInfo] = {}
+    for table in inspector.get_table_names():
+        info = _ensure(tables, table)
+        for col in inspector.get_columns(table):
+            info.columns.append((col["name"], _short_type(col["type"]), bool(col.get("nullable", True))))
+        info.primary_key = list(inspector.get_pk_constraint(table).get("constrained_columns") or [])
+        for fk in inspector.get_foreign_keys(table):
+            info.foreign_keys.append((fk["constrained_columns"], fk["referred_table"], fk["referred_columns"]))
+        for idx in inspector.get_indexes(table):
+            info.indexes.append((idx["name"], [c for c in idx["column_names"] if c], bool(idx.get("unique"))))
+    return tables
+
+
+class SchemaSnapshot:
+    """Immutable view of the schema plus its precomputed prompt fragment"""
+
+    def __init__(self, tables: dict):
+        self.tables = tables
+        self.schema_info = {name: info.column_names for name, info in tables.items()}
+        payload = json.dumps({n: t.as_dict() for n, t in sorted(tables.items())}, sort_keys=True)
+        self.fingerprint = hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+        self.prompt_fragment = self.build_prompt(tables)
+        self.prompt_tokens = estimate_tokens(self.prompt_fragment)
+        self.ranker = TableRanker.from_env(tables)
+        self._pruned_prompts: dict[tuple, str] = {}
+        self.loaded_at = time.time()
+
+    def prompt_for(self, names) -> str:
+        """Prompt fragment restricted to `names`, memoized per table set"""
+        key = tuple(names)
+        fragment = self._pruned_prompts.get(key)
+        if fragment is None:
+            fragment = self.build_prompt(self.tables, key)
+            if len(self._pruned_prompts) < 512:
+                self._pruned_prompts[key] = fragment
+        return fragment
+
+    @staticmethod
+    def build_prompt(tables: dict, names=None) -> str:
+        """Render the schema (optionally only `names`) as prompt context with join hints"""
+        selected = [tables[n] for n in (names if names is not None else tables) if n in tables]
+        lines = ["Database Schema:"]
+        for info in selected:
+            fk_columns = {c: (ref, rc) for cols, ref, rcols in info.foreign_keys for c, rc in zip(cols, rcols)}
+            parts = []
+            for name, col_type, _ in info.columns:
+                part = f"{name} {col_type}"
+                if name in info.primary_key:
+                    part += " PK"
+                if name in fk_columns:
+                    ref, ref_col = fk_columns[name]
+                    part += f" FK->{ref}.{ref_col}"
+                parts.append(part)
+            lines.append(f"- {info.name}({', '.join(parts)})")
+
+        joins = []
+        names_selected = {info.name for info in selected}
+        for info in selected:
+            for cols, ref, rcols in info.foreign_keys:
+                if ref not in names_selected:
+                    continue
+                on = " AND ".join(f"{info.name}.{c} = {ref}.{rc}" for c, rc in zip(cols, rcols))
+                joins.append(f"- {info.name} JOIN {ref} ON {on}")
+        if joins:
+            lines.append("")
+            lines.append("Join hints:")
+            lines.extend(joins)
+
+        indexed = []
+        for info in selected:
+            cols = sorted({c for _, index_cols, _ in info.indexes for c in index_cols[:1]} - set(info.primary_key))
+            if cols:
+                indexed.append(f"- {info.name}: {', '.join(cols)}")
+        if indexed:
+            lines.append("")
+            lines.append("Indexed columns (prefer these in filters and joins):")
+            lines.extend(indexed)
+        return "\n".join(lines)
+
+
+class SchemaCatalog:
+    """
+    Cached schema introspection for the SQL generator.
+
+    PostgreSQL and MySQL are read with a few bulk catalog queries (columns,
+    keys, indexes) instead of one inspector round-trip per table; other
+    dialects fall back to SQLAlchemy inspection. The prompt fragment is
+    rebuilt only when the schema fingerprint changes.
+
+    With a shared store (app/shared_store.py) the tables are published
+    after each introspection, and other workers adopt a published copy
+    younger than `shared_max_age` seconds instead of querying the catalog.
+    """
+
+    def __init__(self, engine, excluded_tables: set | None = None, shared=None, shared_max_age: float | None = None):
+        self.engine = engine
+        if excluded_tables is None:
+            raw = os.getenv("SCHEMA_EXCLUDE_TABLES", DEFAULT_EXCLUDED_TABLES)
+            excluded_tables = {t.strip() for t in raw.split(",") if t.strip()}
+        self.excluded_tables = excluded_tables
+        self.shared = shared
+        if shared_max_age is None:
+            shared_max_age = float(os.getenv("SHARED_SCHEMA_MAX_AGE_SECONDS", "300"))
+        self.shared_max_age = shared_max_age
+        self.snapshot = SchemaSnapshot({})
+        self.source = None
+        self.refreshes = 0
+        self.adopted = 0
+        self.last_error: str | None = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict:
+        from sqlalchemy import text
+        from app import db
+        dialect = self.engine.dialect.name
+        if dialect == "postgresql":
+            with db.connect(self.engine) as conn:
+                tables = _load_postgres(conn, text)
+        elif dialect in ("mysql", "mariadb"):
+            with db.connect(self.engine) as conn:
+                tables = _load_mysql(conn, text)
+        else:
+            tables = _load_generic(self.engine)
+        return {name: info for name, info in sorted(tables.items()) if name not in self.excluded_tables}
+
+    def _adopt_shared(self) -> dict | None:
+        """Tables published by another worker within `shared_max_age`, else None"""
+        if self.shared is None or self.shared_max_age <= 0:
+            return None
+        published = self.shared.get("schema", "tables")
+        if not published or time.time() - published.get("loaded_at", 0) > self.shared_max_age:
+            return None
+        try:
+            return {name: TableInfo.from_dict(name, data) for name, data in published["tables"].items()}
+        except Exception as e:
+            print(f"Warning: Ignoring unreadable shared schema: {e}")
+            return None
+
+    def _publish(self, snapshot: SchemaSnapshot):
+        if self.shared is not None:
+            self.shared.set("schema", "tables", {
+                "loaded_at": snapshot.loaded_at,
+                "fingerprint": snapshot.fingerprint,
+                "tables": {name: info.as_dict() for name, info in snapshot.tables.items()},
+            })
+
+    def refresh(self, force: bool = False) -> bool:
+        """
+        Reload the schema; returns True when the fingerprint changed.
+
+        A recent copy from the shared store is used unless `force` is set.
+        """
+        with self._lock:
+            tables = None if force else self._adopt_shared()
+            source = "shared" if tables is not None else "database"
+            try:
+                snapshot = SchemaSnapshot(tables if tables is not None else self._load())
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Warning: Could not get schema info: {e}")
+                return False
+            if tables is None:
+                self.refreshes += 1
+                self._publish(snapshot)
+            else:
+                self.adopted += 1
+            self.source = source
+            self.last_error = None
+            if snapshot.fingerprint == self.snapshot.fingerprint:
+                self.snapshot.loaded_at = snapshot.loaded_at
+                return False
+            self.snapshot = snapshot
+            return True
+
+    @property
+    def schema_info(self) -> dict:
+        return self.snapshot.schema_info
+
+    @property
+    def fingerprint(self) -> str:
+        return self.snapshot.fingerprint
+
+    @property
+    def prompt_fragment(self) -> str:
+        return self.snapshot.prompt_fragment
+
+    def prompt_for(self, tables) -> str:
+        """Prompt fragment restricted to the given tables"""
+        return self.snapshot.prompt_for(tables)
+
+    def prompt_for_question(self, question: str) -> tuple[str, list | None]:
+        """
+        Schema context for a question: only the relevant tables when the
+        ranker is confident, else the full precomputed fragment. Returns the
+        fragment and the selected tables (None for the full schema).
+        """
+        snapshot = self.snapshot
+        tables = snapshot.ranker.select(question) if SCHEMA_PRUNING else None
+        fragment = snapshot.prompt_for(tables) if tables else snapshot.prompt_fragment
+        print(
+            f"Prompt schema tokens: {snapshot.prompt_tokens} -> {estimate_tokens(fragment)} "
+            f"({', '.join(tables) if tables else 'full schema'})"
+        )
+        return fragment, tables
+
+    def describe(self) -> dict:
+        snapshot = self.snapshot
+        return {
+            "fingerprint": snapshot.fingerprint,
+            "loaded_at": snapshot.loaded_at,
+            "source": self.source,
+            "refreshes": self.refreshes,
+            "adopted": self.adopted,
+            "last_error": self.last_error,
+            "tables": {name: info.as_dict() for name, info in snapshot.tables.items()},
+        }
@@ -0,0 +1,385 @@
+# Cross-process store for the warm state of multi-worker deployments
+#
+# Every uvicorn worker builds its own Vanna instance. The schema catalog, the
+# question -> SQL cache and the result cache read through to this store on a
+# local miss and write through to it, so workers share one warm state and a
+# restarted worker starts warm. Redis is used when REDIS_URL is set, otherwise
+# a SQLite file in WAL mode with memory-mapped reads.
+
+import base64
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import stat
+import tempfile
+import threading
+import time
+import uuid
+from datetime import date, datetime, time as dt_time, timedelta
+from decimal import Decimal
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+def _default_dir() -> str:
+    # A directory only this user can enter: the cache holds query results
+    if os.getenv("XDG_RUNTIME_DIR"):
+        return os.path.join(os.environ["XDG_RUNTIME_DIR"], "vanna")
+    uid = os.getuid() if hasattr(os, "getuid") else os.getpid()
+    return os.path.join(tempfile.gettempdir(), f"vanna-{uid}")
+
+
+DEFAULT_SQLITE_PATH = os.path.join(_default_dir(), "shared-cache.db")
+
+
+def _check_owner(path: str, st: os.stat_result):
+    if hasattr(os, "getuid") and st.st_uid != os.getuid():
+        raise PermissionError(f"{path} is owned by uid {st.st_uid}, not by this user")
+
+
+def _private_file(path: str):
+    """
+    Create the store file readable by this user only, refusing one someone else owns.
+
+    The default directory is created 0700. SQLite gives the -wal and -shm
+    files the permissions of the database file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    if path == DEFAULT_SQLITE_PATH:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        st = os.lstat(directory)
+        _check_owner(directory, st)
+        if not stat.S_ISDIR(st.st_mode) or st.st_mode & 0o077:
+            raise PermissionError(f"{directory} must be a directory accessible by this user only")
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, "O_NOFOLLOW", 0), 0o600)
+    try:
+        st = os.fstat(fd)
+        _check_owner(path, st)
+        if st.st_mode & 0o077:
+            # An existing file of ours created before the store was private
+            os.fchmod(fd, 0o600)
+    finally:
+        os.close(fd)
+    for suffix in ("-wal", "-shm"):
+        if os.path.lexists(path + suffix):
+            _check_owner(path + suffix, os.lstat(path + suffix))
+
+# Tag key for values JSON cannot represent; chosen so it cannot clash with column names
+_TAG = "__vanna_type__"
+
+
+def _encode(value):
+    if isinstance(value, Decimal):
+        return {_TAG: "decimal", "v": str(value)}
+    if isinstance(value, datetime):
+        return {_TAG: "datetime", "v": value.isoformat()}
+    if isinstance(value, date):
+        return {_TAG: "date", "v": value.isoformat()}
+    if isinstance(value, dt_time):
+        return {_TAG: "time", "v": value.isoformat()}
+    if isinstance(value, timedelta):
+        return {_TAG: "timedelta", "v": value.total_seconds()}
+    if isinstance(value, uuid.UUID):
+        return {_TAG: "uuid", "v": str(value)}
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {_TAG: "bytes", "v": base64.b64encode(bytes(value)).decode("ascii")}
+    raise TypeError(f"{type(value).__name__} is not storable")
+
+
+_DECODERS = {
+    "decimal": Decimal,
+    "datetime": datetime.fromisoformat,
+    "date": date.fromisoformat,
+    "time": dt_time.fromisoformat,
+    "timedelta": lambda v: timedelta(seconds=v),
+    "uuid": uuid.UUID,
+    "bytes": base64.b64decode,
+}
+
+
+def _decode(obj: dict):
+    kind = obj.get(_TAG)
+    if kind is not None and len(obj) == 2 and kind in _DECODERS:
+        return _DECODERS[kind](obj["v"])
+    return obj
+
+
+def dumps(value) -> str:
+    """JSON text for a value; Decimal, dates, UUIDs and bytes round-trip through `loads`"""
+    return json.dumps(value, default=_encode, separators=(",", ":"))
+
+
+def loads(raw: str | bytes):
+    return json.loads(raw, object_hook=_decode)
+
+
+class SharedStore:
+    """
+    Namespaced key/value store shared by all worker processes.
+
+    Values are anything `dumps` accepts (tuples come back as lists). Keys are
+    scoped to one database, so services with different DATABASE_URLs can
+    share a Redis. Backend errors are counted and logged, never raised:
+    the callers fall back to their process-local state.
+    """
+
+    backend = "none"
+
+    def __init__(self, scope: str = ""):
+        self.scope = scope
+        self.reads = 0
+        self.hits = 0
+        self.writes = 0
+        self.errors = 0
+        self.last_error: str | None = None
+        self._stats_lock = threading.Lock()
+
+    def _failed(self, operation: str, error: Exception):
+        with self._stats_lock:
+            self.errors += 1
+            self.last_error = str(error)
+            errors = self.errors
+        # The first failure and then every 100th, so an unreachable backend does not flood the log
+        if errors == 1 or errors % 100 == 0:
+            print(f"Warning: Shared {self.backend} store {operation} failed ({errors} errors): {error}")
+
+    def get(self, namespace: str, key: str):
+        """Stored value, or None when missing, expired or unreadable"""
+        try:
+            raw = self._get(namespace, key)
+            value = loads(raw) if raw is not None else None
+        except Exception as e:
+            self._failed("read", e)
+            return None
+        with self._stats_lock:
+            self.reads += 1
+            if value is not None:
+                self.hits += 1
+        return value
+
+    def set(self, namespace: str, key: str, value, ttl_seconds: float | None = None):
+        """Store a value, expiring after `ttl_seconds` (None or <= 0 keeps it)"""
+        try:
+            self._set(namespace, key, dumps(value), ttl_seconds if ttl_seconds and ttl_seconds > 0 else None)
+        except Exception as e:
+            self._failed("write", e)
+            return
+        with self._stats_lock:
+            self.writes += 1
+
+    def delete(self, namespace: str, key: str):
+        try:
+            self._delete(namespace, key)
+        except Exception as e:
+            self._failed("delete", e)
+
+    def clear(self, namespace: str):
+        """Drop every key of a namespace"""
+        try:
+            self._clear(namespace)
+        except Exception as e:
+            self._failed("clear", e)
+
+    def items(self, namespace: str, limit: int = 1000) -> list:
+        """Up to `limit` unexpired (key, value) pairs of a namespace"""
+        try:
+            return [(key, loads(raw)) for key, raw in self._items(namespace, limit)]
+        except Exception as e:
+            self._failed("scan", e)
+            return []
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "backend": self.backend,
+                "reads": self.reads,
+                "hits": self.hits,
+                "writes": self.writes,
+                "errors": self.errors,
+                "last_error": self.last_error,
+                "hit_rate": round(self.hits / self.reads, 4) if self.reads else 0.0,
+            }
+
+    def _get(self, namespace: str, key: str):
+        raise NotImplementedError
+
+    def _set(self, namespace: str, key: str, raw: str, ttl_seconds: float | None):
+        raise NotImplementedError
+
+    def _delete(self, namespace: str, key: str):
+        raise NotImplementedError
+
+    def _clear(self, namespace: str):
+        raise NotImplementedError
+
+    def _items(self, namespace: str, limit: int) -> list:
+        raise NotImplementedError
+
+
+class SQLiteStore(SharedStore):
+    """
+    Store in a local SQLite file, for workers on one host.
+
+    WAL mode lets every worker read while one writes, and reads go through a
+    memory-mapped view of the file. Each thread gets its own connection.
+    Expired rows are purged every `purge_every` writes.
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, path: str = DEFAULT_SQLITE_PATH, scope: str = "", mmap_bytes: int = 64 * 1024 * 1024,
+                 purge_every: int = 256):
+        super().__init__(scope)
+        self.path = path
+        self.mmap_bytes = mmap_bytes
+        self.purge_every = purge_every
+        self._local = threading.local()
+        self._writes_since_purge = 0
+        _private_file(path)
+        # Create the table up front so a bad path is reported at startup
+        self._connection()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit: every statement is its own short transaction
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={int(self.mmap_bytes)}")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL, "
+                "PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+            )
+            self._local.conn = conn
+        return conn
+
+    def _namespace(self, namespace: str) -> str:
+        return f"{self.scope}:{namespace}"
+
+    def _get(self, namespace: str, key: str):
+        row = self._connection().execute(
+            "SELECT value FROM entries WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (self._namespace(namespace), key, time.time()),
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set(self, namespace: str, key: str, raw: str, ttl_seconds: float | None):
+        now = time.time()
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (self._namespace(namespace), key, raw, now + ttl_seconds if ttl_seconds else None),
+        )
+        self._writes_since_purge += 1
+        if self._writes_since_purge >= self.purge_every:
+            self._writes_since_purge = 0
+            conn.execute("DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+
+    def _delete(self, namespace: str, key: str):
+        self._connection().execute(
+            "DELETE FROM entries WHERE namespace = ? AND key = ?", (self._namespace(namespace), key))
+
+    def _clear(self, namespace: str):
+        self._connection().execute("DELETE FROM entries WHERE namespace = ?", (self._namespace(namespace),))
+
+    def _items(self, namespace: str, limit: int) -> list:
+        return self._connection().execute(
+            "SELECT key, value FROM entries WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?) LIMIT ?",
+            (self._namespace(namespace), time.time(), limit),
+        ).fetchall()
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["path"] = self.path
+        return stats
+
+
+class RedisStore(SharedStore):
+    """Store in Redis, for workers spread over several hosts; expiry uses Redis TTLs"""
+
+    backend = "redis"
+
+    def __init__(self, url: str, scope: str = "", prefix: str = "vanna", timeout: float = 0.5):
+        super().__init__(scope)
+        if redis is None:
+            raise Exception("Failed to create Redis store: the redis package is not installed")
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+
+    def _key(self, namespace: str, key: str = "") -> str:
+        return f"{self.prefix}:{self.scope}:{namespace}:{key}"
+
+    def _get(self, namespace: str, key: str):
+        return self.client.get(self._key(namespace, key))
+
+    def _set(self, namespace: str, key: str, raw: str, ttl_seconds: float | None):
+        self.client.set(self._key(namespace, key), raw, px=int(math.ceil(ttl_seconds * 1000)) if ttl_seconds else None)
+
+    def _delete(self, namespace: str, key: str):
+        self.client.delete(self._key(namespace, key))
+
+    def _keys(self, namespace: str, limit: int | None = None) -> list:
+        keys = []
+        for key in self.client.scan_iter(match=self._key(namespace) + "*", count=500):
+            keys.append(key)
+            if limit is not None and len(keys) >= limit:
+                break
+        return keys
+
+    def _clear(self, namespace: str):
+        keys = self._keys(namespace)
+        for start in range(0, len(keys), 500):
+            self.client.unlink(*keys[start:start + 500])
+
+    def _items(self, namespace: str, limit: int) -> list:
+        keys = self._keys(namespace, limit)
+        if not keys:
+            return []
+        skip = len(self._key(namespace))
+        return [(key.decode("utf-8")[skip:], raw) for key, raw in zip(keys, self.client.mget(keys)) if raw is not None]
+
+
+def worker_count() -> int:
+    """Configured uvicorn worker processes (WEB_CONCURRENCY, as read by uvicorn itself)"""
+    try:
+        return max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+    except ValueError:
+        return 1
+
+
+def store_from_env(database_url: str = "") -> SharedStore | None:
+    """
+    Shared store selected by SHARED_CACHE (auto | redis | sqlite | off).
+
+    `auto` uses Redis when REDIS_URL is set, a SQLite file when
+    SHARED_CACHE_PATH is set or more than one worker is configured, and
+    nothing (process-local caches only) otherwise.
+    """
+    mode = os.getenv("SHARED_CACHE", "auto").lower()
+    if mode in ("off", "false", "0", "none"):
+        return None
+    # Keys are scoped to the database so one Redis can serve several deployments
+    scope = hashlib.sha256(database_url.encode("utf-8")).hexdigest()[:12]
+    redis_url = os.getenv("REDIS_URL")
+    if mode == "redis" or (mode == "auto" and redis_url):
+        if not redis_url:
+            print("Warning: SHARED_CACHE=redis but REDIS_URL is not set; using the SQLite shared store")
+        elif redis is None:
+            print("Warning: REDIS_URL is set but the redis package is not installed; using the SQLite shared store")
+        else:
+            return RedisStore(redis_url, scope=scope, prefix=os.getenv("SHARED_CACHE_PREFIX", "vanna"))
+        mode = "sqlite"
+    path = os.getenv("SHARED_CACHE_PATH")
+    if mode == "sqlite" or path or worker_count() > 1:
+        try:
+            return SQLiteStore(path or DEFAULT_SQLITE_PATH, scope=scope)
+        except Exception as e:
+            print(f"Warning: Could not open shared cache file {path or DEFAULT_SQLITE_PATH}: {e}")
+    return None
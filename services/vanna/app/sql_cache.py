@@ -0,0 +1,301 @@
+# Question -> SQL cache
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+_WORD_RE = re.compile(r"\w+")
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+
+# Filler words that do not change the meaning of a dashboard question
+_FILLER_WORDS = {
+    "a", "an", "the", "please", "show", "me", "give", "tell", "can", "could",
+    "you", "what", "which", "is", "are", "list",
+}
+
+# Words that flip or narrow a question ("not paid", "without tax"); near-duplicates must agree on them.
+# Contractions are split by _WORD_RE, so "isn't" counts through "isn".
+_POLARITY_WORDS = frozenset({
+    "not", "no", "non", "none", "nor", "without", "except", "excluding", "exclude", "never", "neither",
+    "other", "outside", "beside", "unpaid", "isn", "aren", "wasn", "weren", "don", "doesn", "didn",
+    "hasn", "haven", "hadn", "cannot",
+})
+
+# Rough per-entry overhead (dict slots, trigram set, bookkeeping) used for the memory budget
+_ENTRY_OVERHEAD_BYTES = 256
+
+
+def _singular(word: str) -> str:
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase a question, drop punctuation/filler words, singularize and collapse whitespace"""
+    words = _WORD_RE.findall(question.lower())
+    kept = [w for w in words if w not in _FILLER_WORDS] or words
+    return " ".join(_singular(w) for w in kept)
+
+
+def _trigrams(text: str) -> frozenset:
+    padded = f" {text} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def _similarity(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class _Entry:
+    __slots__ = ("sql", "created_at", "trigrams", "numbers", "polarity", "size")
+
+    def __init__(self, question: str, sql: str, created_at: float):
+        self.sql = sql
+        self.created_at = created_at
+        self.trigrams = _trigrams(question)
+        # Numbers carry meaning ("top 5" vs "top 10"), so near-duplicates must agree on them
+        self.numbers = tuple(_NUMBER_RE.findall(question))
+        # Likewise negations: "invoices not paid" is one character edit from "invoices paid"
+        self.polarity = frozenset(w for w in _WORD_RE.findall(question.lower()) if w in _POLARITY_WORDS)
+        self.size = len(question) + len(sql) + 3 * len(self.trigrams) + _ENTRY_OVERHEAD_BYTES
+
+
+class SQLCache:
+    """
+    LRU/TTL cache mapping normalized questions to generated SQL.
+
+    Entries are keyed on (schema fingerprint, normalized question). Lookups
+    try an exact match first and then fall back to the most similar cached
+    question (character trigram Jaccard) above `similarity`. Memory use is
+    bounded by both `max_entries` and `max_bytes`. When `path` is set the
+    cache is mirrored into a SQLite file so it survives restarts.
+
+    With a `shared` store (app/shared_store.py) new entries are published
+    to the other workers, a local exact-match miss is looked up there
+    before the similarity scan, and a new process starts from its contents.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        max_bytes: int = 4 * 1024 * 1024,
+        ttl_seconds: float = 24 * 3600,
+        similarity: float = 0.85,
+        path: str | None = None,
+        shared=None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.similarity = similarity
+        self.path = path
+        self.shared = shared
+
+        self._entries: OrderedDict[tuple[str, str], _Entry] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._db = None
+
+        self.hits_exact = 0
+        self.hits_similar = 0
+        self.misses = 0
+        self.evictions = 0
+        self.hits_shared = 0
+
+        if path:
+            self._open_db(path)
+        if shared is not None and self.enabled:
+            self._load_shared()
+
+    @classmethod
+    def from_env(cls, shared=None) -> "SQLCache":
+        """Build a cache from SQL_CACHE_* environment variables"""
+        return cls(
+            max_entries=int(os.getenv("SQL_CACHE_MAX_ENTRIES", "1000")),
+            max_bytes=int(os.getenv("SQL_CACHE_MAX_BYTES", str(4 * 1024 * 1024))),
+            ttl_seconds=float(os.getenv("SQL_CACHE_TTL_SECONDS", str(24 * 3600))),
+            similarity=float(os.getenv("SQL_CACHE_SIMILARITY", "0.85")),
+            path=os.getenv("SQL_CACHE_PATH") or None,
+            shared=shared,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def _open_db(self, path: str):
+        try:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sql_cache ("
+                "fingerprint TEXT NOT NULL, question TEXT NOT NULL, sql TEXT NOT NULL, "
+                "created_at REAL NOT NULL, PRIMARY KEY (fingerprint, question))"
+            )
+            self._db.commit()
+            cutoff = time.time() - self.ttl_seconds
+            rows = self._db.execute(
+                "SELECT fingerprint, question, sql, created_at FROM sql_cache "
+                "WHERE created_at >= ? ORDER BY created_at",
+                (cutoff,),
+            ).fetchall()
+            for fingerprint, question, sql, created_at in rows:
+                self._store((fingerprint, question), _Entry(question, sql, created_at))
+            print(f"SQL cache: loaded {len(self._entries)} entries from {path}")
+        except Exception as e:
+            print(f"Warning: Could not open SQL cache file {path}: {e}")
+            self._db = None
+
+    def _load_shared(self):
+        now = time.time()
+        loaded = 0
+        for shared_key, value in self.shared.items("sql", limit=self.max_entries):
+            fingerprint, _, question = shared_key.partition(":")
+            entry = _Entry(question, value["sql"], value["created_at"])
+            if not self._expired(entry, now):
+                self._store((fingerprint, question), entry)
+                loaded += 1
+        if loaded:
+            print(f"SQL cache: loaded {loaded} entries from the shared {self.shared.backend} store")
+
+    def _get_shared(self, key: tuple[str, str], now: float) -> str | None:
+        value = self.shared.get("sql", f"{key[0]}:{key[1]}")
+        if value is None:
+            return None
+        entry = _Entry(key[1], value["sql"], value["created_at"])
+        if self._expired(entry, now):
+            return None
+        with self._lock:
+            self._store(key, entry)
+            self.hits_exact += 1
+            self.hits_shared += 1
+        return entry.sql
+
+    def _persist(self, statement: str, params: tuple):
+        if self._db is None:
+            return
+        try:
+            self._db.execute(statement, params)
+            self._db.commit()
+        except Exception as e:
+            print(f"Warning: SQL cache persistence failed: {e}")
+
+    def _expired(self, entry: _Entry, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - entry.created_at > self.ttl_seconds
+
+    def _drop(self, key: tuple[str, str]):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def _store(self, key: tuple[str, str], entry: _Entry):
+        self._drop(key)
+        self._entries[key] = entry
+        self._bytes += entry.size
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            old_key, _ = next(iter(self._entries.items()))
+            self._drop(old_key)
+            self.evictions += 1
+
+    def get(self, question: str, fingerprint: str) -> str | None:
+        """Return cached SQL for an identical or near-identical question, else None"""
+        if not self.enabled:
+            return None
+        normalized = normalize_question(question)
+        now = time.time()
+        with self._lock:
+            key = (fingerprint, normalized)
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry, now):
+                self._entries.move_to_end(key)
+                self.hits_exact += 1
+                return entry.sql
+
+        if self.shared is not None:
+            # Outside the lock: a Redis round trip must not block other lookups
+            sql = self._get_shared(key, now)
+            if sql is not None:
+                return sql
+
+        with self._lock:
+            probe = _Entry(normalized, "", now)
+            best_key, best_score = None, self.similarity
+            for other_key, other in list(self._entries.items()):
+                if other_key[0] != fingerprint or other.numbers != probe.numbers or other.polarity != probe.polarity:
+                    continue
+                if self._expired(other, now):
+                    self._drop(other_key)
+                    continue
+                score = _similarity(probe.trigrams, other.trigrams)
+                if score >= best_score:
+                    best_key, best_score = other_key, score
+
+            if best_key is not None:
+                self._entries.move_to_end(best_key)
+                self.hits_similar += 1
+                return self._entries[best_key].sql
+
+            self.misses += 1
+            return None
+
+    def put(self, question: str, fingerprint: str, sql: str):
+        """Cache generated SQL for a question under the given schema fingerprint"""
+        if not self.enabled or not sql:
+            return
+        normalized = normalize_question(question)
+        now = time.time()
+        with self._lock:
+            self._store((fingerprint, normalized), _Entry(normalized, sql, now))
+            self._persist(
+                "INSERT OR REPLACE INTO sql_cache (fingerprint, question, sql, created_at) VALUES (?, ?, ?, ?)",
+                (fingerprint, normalized, sql, now),
+            )
+        if self.shared is not None:
+            self.shared.set("sql", f"{fingerprint}:{normalized}", {"sql": sql, "created_at": now}, self.ttl_seconds)
+
+    def retain_fingerprint(self, fingerprint: str) -> int:
+        """
+        Drop every entry generated against a different schema; returns the number removed.
+
+        Shared entries are keyed on the fingerprint and simply expire, since
+        workers may briefly disagree on the schema during a migration.
+        """
+        with self._lock:
+            stale = [key for key in self._entries if key[0] != fingerprint]
+            for key in stale:
+                self._drop(key)
+            self._persist("DELETE FROM sql_cache WHERE fingerprint != ?", (fingerprint,))
+            return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._persist("DELETE FROM sql_cache", ())
+        if self.shared is not None:
+            self.shared.clear("sql")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits_exact + self.hits_similar + self.misses
+            hits = self.hits_exact + self.hits_similar
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits_exact": self.hits_exact,
+                "hits_similar": self.hits_similar,
+                "hits_shared": self.hits_shared,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "persistent": self._db is not None,
+                "shared": self.shared.backend if self.shared is not None else None,
+            }
@@ -0,0 +1,51 @@
+# Classification of raw database errors
+#
+# Shared by format_sql_error (friendly messages), the /metrics error counter
+# and the SQL repair stage, so all three agree on what went wrong.
+
+import re
+
+
+def classify_sql_error(error_msg: str) -> str:
+    """Category of a raw database error, as used by `format_sql_error` and /metrics"""
+    error_lower = error_msg.lower()
+    if "rejected by cost guard" in error_lower:
+        return "too_expensive"
+    if "column" in error_lower and ("does not exist" in error_lower or "not found" in error_lower or "undefinedcolumn" in error_lower):
+        return "column_not_found"
+    if "no such column" in error_lower or "unknown column" in error_lower:
+        return "column_not_found"
+    if ("table" in error_lower or "relation" in error_lower) and ("does not exist" in error_lower or "not found" in error_lower):
+        return "table_not_found"
+    if "no such table" in error_lower:
+        return "table_not_found"
+    if "syntax error" in error_lower or "syntaxerror" in error_lower:
+        return "syntax"
+    if "ambiguous" in error_lower:
+        return "ambiguous_column"
+    if "permission denied" in error_lower or "access denied" in error_lower:
+        return "permission"
+    if "division by zero" in error_lower or "divide by zero" in error_lower:
+        return "division_by_zero"
+    if "type" in error_lower and ("mismatch" in error_lower or "cannot" in error_lower or "invalid" in error_lower):
+        return "type_mismatch"
+    if any(func in error_lower for func in ["sum", "avg", "count", "min", "max"]) and ("group by" in error_lower or "aggregate" in error_lower):
+        return "aggregate"
+    if any(word in error_lower for word in ["timeout", "connection", "network", "connect"]):
+        return "connection_or_timeout"
+    if "foreign key" in error_lower or "constraint" in error_lower:
+        return "constraint"
+    return "other"
+
+
+def error_detail(error_msg: str) -> str:
+    """First meaningful line of a (possibly wrapped) database error, without driver prefixes"""
+    for line in error_msg.splitlines():
+        line = line.strip()
+        if line:
+            break
+    else:
+        return error_msg.strip()
+    line = re.sub(r"^Failed to execute SQL:\s*", "", line)
+    # SQLAlchemy prefixes the DBAPI exception class, e.g. "(psycopg.errors.UndefinedColumn) ..."
+    return re.sub(r"^\([\w.]+\)\s*", "", line)
@@ -0,0 +1,258 @@
+# Automatic repair of generated SQL that failed to execute
+#
+# Errors are classified with the same categories as format_sql_error. Cheap
+# local fixes are tried first (misspelled/mis-cased columns and tables are
+# fuzzy-matched against the cached schema, ambiguous columns are qualified);
+# only then is the model asked to fix the query, within a retry budget and
+# a latency cap. Fixes are applied to the MySQL the model wrote, so repaired
+# SQL goes through the normal translation/cost-guard/cache pipeline.
+
+import asyncio
+import difflib
+import os
+import re
+import threading
+import time
+
+from app.sql_errors import classify_sql_error, error_detail
+from app.sql_translate import sqlglot
+
+if sqlglot is not None:
+    from sqlglot import exp
+    from app.sql_translate import GeneratedMySQL
+
+# Categories worth a repair attempt; connection, permission and cost guard errors are not
+REPAIRABLE = ("column_not_found", "table_not_found", "ambiguous_column", "syntax",
+              "type_mismatch", "aggregate", "division_by_zero")
+LOCAL_FIXES = ("column_not_found", "table_not_found", "ambiguous_column")
+
+_MISSING_COLUMN = re.compile(
+    r"column \"?([\w.]+)\"? does not exist|no such column: ([\w.]+)|unknown column '([\w.]+)'", re.I)
+_SUGGESTED_COLUMN = re.compile(r"perhaps you meant to reference the column \"(?:\w+\.)?\"?(\w+)\"?\"?", re.I)
+_AMBIGUOUS_COLUMN = re.compile(
+    r"column reference \"(\w+)\" is ambiguous|ambiguous column name: (?:\w+\.)?(\w+)|column '(\w+)' in \w+ \w+ is ambiguous", re.I)
+_MISSING_TABLE = re.compile(
+    r"relation \"(?:\w+\.)?(\w+)\" does not exist|no such table: (?:\w+\.)?(\w+)|table '(?:\w+\.)?(\w+)' doesn't exist", re.I)
+
+
+def _first_group(match) -> str | None:
+    return next((group for group in match.groups() if group), None) if match else None
+
+
+def _closest(name: str, candidates, cutoff: float = 0.75) -> str | None:
+    """Schema name matching `name` case-insensitively, or the closest spelling"""
+    by_lower = {}
+    for candidate in candidates:
+        by_lower.setdefault(candidate.lower(), candidate)
+    if name.lower() in by_lower:
+        return by_lower[name.lower()]
+    match = difflib.get_close_matches(name.lower(), list(by_lower), n=1, cutoff=cutoff)
+    return by_lower[match[0]] if match else None
+
+
+def _tables(tree) -> dict:
+    """alias (or name) -> table name, in FROM/JOIN order"""
+    return {table.alias_or_name: table.name for table in tree.find_all(exp.Table)}
+
+
+def _fix_column(tree, error: str, schema_info: dict) -> str | None:
+    missing = _first_group(_MISSING_COLUMN.search(error))
+    if not missing:
+        return None
+    reported = missing.rpartition(".")[2].lower()
+    suggested = _first_group(_SUGGESTED_COLUMN.search(error))
+    tables = _tables(tree)
+    all_columns = [column for table in tables.values() for column in schema_info.get(table, ())]
+    aliases = {alias.alias.lower() for alias in tree.find_all(exp.Alias)}
+    # The database reports one unknown column at a time; fix every one that resolves unambiguously
+    fixed = []
+    for column in tree.find_all(exp.Column):
+        name = column.name
+        if column.table:
+            candidates = schema_info.get(tables.get(column.table), ())
+        elif name.lower() in aliases:
+            continue
+        else:
+            candidates = all_columns
+        if not candidates or name in candidates:
+            continue
+        target = suggested if name.lower() == reported and suggested in candidates else _closest(name, candidates)
+        if target and target != name:
+            column.set("this", exp.to_identifier(target))
+            fixed.append(f"column {name} -> {target}")
+    return ", ".join(dict.fromkeys(fixed)) or None
+
+
+def _fix_table(tree, error: str, schema_info: dict) -> str | None:
+    missing = _first_group(_MISSING_TABLE.search(error))
+    if not missing:
+        return None
+    # The database reports one unknown table at a time; fix every one in a single pass
+    known = {name.lower() for name in schema_info}
+    ctes = {cte.alias.lower() for cte in tree.find_all(exp.CTE)}
+    fixed = []
+    for table in tree.find_all(exp.Table):
+        name = table.name
+        if name.lower() in known or name.lower() in ctes:
+            continue
+        target = _closest(name, schema_info)
+        if target and target != name:
+            table.set("this", exp.to_identifier(target))
+            fixed.append(f"table {name} -> {target}")
+    return ", ".join(dict.fromkeys(fixed)) or None
+
+
+def _fix_ambiguous(tree, error: str, schema_info: dict) -> str | None:
+    name = _first_group(_AMBIGUOUS_COLUMN.search(error))
+    if not name:
+        return None
+    # Qualify with the first table (in FROM/JOIN order) that has the column, usually the FROM table
+    owner = next((alias for alias, table in _tables(tree).items()
+                  if any(c.lower() == name.lower() for c in schema_info.get(table, ()))), None)
+    if owner is None:
+        return None
+    changed = False
+    for column in tree.find_all(exp.Column):
+        if not column.table and column.name.lower() == name.lower():
+            column.set("table", exp.to_identifier(owner))
+            changed = True
+    return f"{name} -> {owner}.{name}" if changed else None
+
+
+_FIXERS = {"column_not_found": _fix_column, "table_not_found": _fix_table, "ambiguous_column": _fix_ambiguous}
+
+
+def local_fix(sql: str, error: str, schema_info: dict) -> tuple[str, str] | None:
+    """(fixed SQL, description) for errors fixable without the model, else None"""
+    fixer = _FIXERS.get(classify_sql_error(error))
+    if fixer is None or sqlglot is None or not schema_info:
+        return None
+    try:
+        trees = sqlglot.parse(sql, read=GeneratedMySQL)
+    except Exception:
+        return None
+    fixes = [fixer(tree, error, schema_info) for tree in trees if tree is not None]
+    if not any(fixes):
+        return None
+    fixed = ";\n".join(tree.sql(dialect=GeneratedMySQL) for tree in trees if tree is not None)
+    return fixed, "; ".join(fix for fix in fixes if fix)
+
+
+class SQLRepairer:
+    """
+    Repair policy and success counters shared by all requests.
+
+    Each failing request gets a `RepairSession`: at most `max_attempts`
+    re-executions, of which at most `llm_attempts` use the model, all within
+    `budget_seconds` of the first failure.
+    """
+
+    def __init__(self, enabled: bool = True, max_attempts: int = 3, llm_attempts: int = 1,
+                 budget_seconds: float = 20.0):
+        self.enabled = enabled
+        self.max_attempts = max_attempts
+        self.llm_attempts = llm_attempts
+        self.budget_seconds = budget_seconds
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(
+            ("sessions", "repaired", "unrepaired", "local_attempts", "local_successes", "llm_attempts", "llm_successes"), 0)
+
+    @classmethod
+    def from_env(cls) -> "SQLRepairer":
+        return cls(
+            enabled=os.getenv("SQL_REPAIR_ENABLED", "true").lower() in ("1", "true", "yes"),
+            max_attempts=int(os.getenv("SQL_REPAIR_MAX_ATTEMPTS", "3")),
+            llm_attempts=int(os.getenv("SQL_REPAIR_LLM_ATTEMPTS", "1")),
+            budget_seconds=float(os.getenv("SQL_REPAIR_BUDGET_SECONDS", "20")),
+        )
+
+    def count(self, name: str):
+        with self._lock:
+            self._counts[name] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+        finished = counts["repaired"] + counts["unrepaired"]
+        return {
+            "enabled": self.enabled,
+            **counts,
+            "success_rate": round(counts["repaired"] / finished, 4) if finished else None,
+        }
+
+
+class RepairSession:
+    """
+    Repair state of one request.
+
+    `llm_repair(sql, error, timeout)` asks the model for a corrected query;
+    `on_repaired(sql)` is called with the SQL that finally executed.
+    """
+
+    def __init__(self, repairer: SQLRepairer, schema_info: dict, llm_repair, on_repaired=None):
+        self.repairer = repairer
+        self.schema_info = schema_info
+        self.llm_repair = llm_repair
+        self.on_repaired = on_repaired
+        self.started = None
+        self.attempts = 0
+        self.llm_attempts = 0
+        self.last_kind = None
+        self.history: list[dict] = []
+
+    def _give_up(self, reason: str) -> None:
+        if self.attempts:
+            self.repairer.count("unrepaired")
+        print(f"SQL repair gave up: {reason}")
+        return None
+
+    async def next(self, sql: str, error: str) -> str | None:
+        """SQL to try after `sql` failed with `error`, or None when repair is not possible"""
+        repairer = self.repairer
+        category = classify_sql_error(error)
+        if not repairer.enabled or category not in REPAIRABLE:
+            return self._give_up(f"{category} errors are not repaired") if self.attempts else None
+        if self.started is None:
+            self.started = time.monotonic()
+            repairer.count("sessions")
+        if self.attempts >= repairer.max_attempts:
+            return self._give_up("retry budget exhausted")
+        remaining = repairer.budget_seconds - (time.monotonic() - self.started)
+        if remaining <= 0:
+            return self._give_up("latency budget exhausted")
+
+        fix = local_fix(sql, error, self.schema_info) if category in LOCAL_FIXES else None
+        kind = "local" if fix is not None else "llm"
+        if kind == "llm" and self.llm_attempts >= repairer.llm_attempts:
+            return self._give_up("no local fix and no model attempts left")
+        self.attempts += 1
+        self.last_kind = kind
+        repairer.count(f"{kind}_attempts")
+        if fix is not None:
+            repaired, description = fix
+        else:
+            self.llm_attempts += 1
+            description = "model repair"
+            try:
+                repaired = await asyncio.wait_for(self.llm_repair(sql, error_detail(error), remaining), remaining)
+            except asyncio.TimeoutError:
+                return self._give_up("model repair timed out")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                return self._give_up(f"model repair failed: {e}")
+
+        if not repaired or repaired.strip() == sql.strip():
+            return self._give_up("repair produced the same SQL")
+        self.history.append({"category": category, "fix": kind, "detail": description})
+        print(f"SQL repair ({kind}, {category}): {description}")
+        return repaired
+
+    def succeeded(self, sql: str):
+        """Record that the last repaired SQL executed"""
+        if not self.attempts:
+            return
+        self.repairer.count("repaired")
+        self.repairer.count(f"{self.last_kind}_successes")
+        if self.on_repaired is not None:
+            self.on_repaired(sql)
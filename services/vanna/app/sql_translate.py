@@ -0,0 +1,142 @@
+# MySQL -> PostgreSQL translation of generated SQL
+#
+# The model is prompted for MySQL, but production runs on PostgreSQL. SQL is
+# parsed once with sqlglot, transpiled, and memoized per SQL text. Without
+# sqlglot (or when it cannot parse a statement) the original regex chain is
+# used.
+
+import re
+import threading
+from collections import OrderedDict
+
+try:
+    import sqlglot
+    from sqlglot import exp
+    from sqlglot.dialects.mysql import MySQL
+except ImportError:  # optional dependency
+    sqlglot = None
+
+
+def translate_regex(sql: str) -> str:
+    """Best-effort regex translation of MONTH(), YEAR(), CURDATE(), NOW(), IFNULL() and backticks"""
+    # Replace MONTH(col) and YEAR(col) with EXTRACT
+    sql = re.sub(r"\bMONTH\(\s*([^\)]+)\s*\)", r"EXTRACT(MONTH FROM \1)", sql, flags=re.I)
+    sql = re.sub(r"\bYEAR\(\s*([^\)]+)\s*\)", r"EXTRACT(YEAR FROM \1)", sql, flags=re.I)
+    # CURDATE() -> CURRENT_DATE, NOW() -> CURRENT_TIMESTAMP
+    sql = re.sub(r"\bCURDATE\s*\(\s*\)", "CURRENT_DATE", sql, flags=re.I)
+    sql = re.sub(r"\bNOW\s*\(\s*\)", "CURRENT_TIMESTAMP", sql, flags=re.I)
+    # IFNULL(a,b) -> COALESCE(a,b)
+    sql = re.sub(r"\bIFNULL\s*\(", "COALESCE(", sql, flags=re.I)
+    # Remove MySQL-style backticks
+    return sql.replace('`', '')
+
+
+if sqlglot is not None:
+    class GeneratedMySQL(MySQL):
+        """MySQL as the model writes it: "double quotes" are identifiers (ANSI_QUOTES)
+        and NULLs sort like PostgreSQL, so ORDER BY is carried over unchanged."""
+
+        NULL_ORDERING = "nulls_are_large"
+
+        class Tokenizer(MySQL.Tokenizer):
+            IDENTIFIERS = ["`", '"']
+            QUOTES = ["'"]
+
+
+def _fix_identifiers(tree, identifiers: dict):
+    """
+    Quote known mixed-case identifiers (PostgreSQL folds unquoted names to
+    lowercase) and turn "double-quoted" values that are not a known column
+    or alias back into string literals, including those sqlglot keeps as a
+    bare identifier in a function argument (GROUP_CONCAT's SEPARATOR).
+    """
+    aliases = {a.alias for a in tree.find_all(exp.Alias)}
+    for column in list(tree.find_all(exp.Column)):
+        ident = column.this
+        if not isinstance(ident, exp.Identifier):
+            continue
+        name = ident.name
+        if ident.quoted and not column.table and name not in aliases and name.lower() not in identifiers:
+            column.replace(exp.Literal.string(name))
+    for ident in list(tree.find_all(exp.Identifier)):
+        if ident.quoted and isinstance(ident.parent, exp.Func):
+            # A name directly under a function is a value slot; column references arrive as Column nodes
+            ident.replace(exp.Literal.string(ident.name))
+    for ident in tree.find_all(exp.Identifier):
+        canonical = identifiers.get(ident.name.lower())
+        if canonical and not ident.quoted and canonical != canonical.lower():
+            ident.set("this", canonical)
+            ident.set("quoted", True)
+
+
+class SQLTranslator:
+    """
+    Memoized MySQL -> PostgreSQL translator.
+
+    `identifiers` (table and column names from the schema) let the
+    translator quote camelCase names such as invoiceDate correctly.
+    """
+
+    def __init__(self, max_entries: int = 2048, use_ast: bool = True):
+        self.max_entries = max_entries
+        self.use_ast = use_ast and sqlglot is not None
+        self._identifiers: dict[str, str] = {}
+        self._memo: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+
+    def set_identifiers(self, names):
+        """Use a new set of schema names; drops memoized translations when they change"""
+        identifiers = {name.lower(): name for name in names}
+        with self._lock:
+            if identifiers != self._identifiers:
+                self._identifiers = identifiers
+                self._memo.clear()
+
+    def _transpile(self, sql: str) -> str:
+        if not self.use_ast:
+            return translate_regex(sql)
+        try:
+            trees = sqlglot.parse(sql, read=GeneratedMySQL)
+            statements = []
+            for tree in trees:
+                if tree is None:
+                    continue
+                _fix_identifiers(tree, self._identifiers)
+                statements.append(tree.sql(dialect="postgres"))
+            if not statements:
+                raise ValueError("empty statement")
+            return ";\n".join(statements)
+        except Exception as e:
+            self.fallbacks += 1
+            print(f"Warning: AST translation failed ({str(e).splitlines()[0] if str(e) else type(e).__name__}); using regex translation")
+            return translate_regex(sql)
+
+    def translate(self, sql: str) -> str:
+        # str hashes are cached by Python, so the SQL text itself is the cheapest memo key
+        key = sql
+        with self._lock:
+            cached = self._memo.get(key)
+            if cached is not None:
+                self._memo.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+        translated = self._transpile(sql)
+        with self._lock:
+            self._memo[key] = translated
+            while len(self._memo) > self.max_entries:
+                self._memo.popitem(last=False)
+        return translated
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "engine": "sqlglot" if self.use_ast else "regex",
+                "entries": len(self._memo),
+                "hits": self.hits,
+                "misses": self.misses,
+                "fallbacks": self.fallbacks,
+            }
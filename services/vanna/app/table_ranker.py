@@ -0,0 +1,154 @@
+# Offline table-relevance ranking used to prune the schema sent to the model
+
+import os
+import re
+from collections import deque
+
+from app.sql_cache import normalize_question
+
+_CAMEL_RE = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+# Question words -> identifier tokens they usually refer to in this schema
+SYNONYMS = {
+    "spend": ("total", "amount"),
+    "spent": ("total", "amount"),
+    "spending": ("total", "amount"),
+    "cost": ("total", "amount"),
+    "expense": ("total", "amount"),
+    "revenue": ("total", "amount"),
+    "value": ("total", "amount"),
+    "supplier": ("vendor",),
+    "seller": ("vendor",),
+    "client": ("customer",),
+    "buyer": ("customer",),
+    "bill": ("invoice",),
+    "paid": ("payment", "status"),
+    "pay": ("payment",),
+    "unpaid": ("status",),
+    "pending": ("status",),
+    "overdue": ("status", "due"),
+    "outstanding": ("status", "due"),
+    "cash": ("payment", "amount"),
+    "outflow": ("payment", "amount", "due"),
+    "product": ("item", "description"),
+    "service": ("item", "description"),
+    "categorie": ("category",),
+    "monthly": ("date",),
+    "month": ("date",),
+    "trend": ("date",),
+    "year": ("date",),
+    "when": ("date",),
+    "recent": ("date",),
+    "tax": ("tax",),
+}
+
+# Score contributed by a match on a table-name token vs a column-name token
+TABLE_NAME_WEIGHT = 3.0
+COLUMN_NAME_WEIGHT = 1.0
+# Tables scoring below this fraction of the best table are treated as incidental matches
+RELATIVE_CUTOFF = 0.5
+
+
+def identifier_tokens(name: str) -> list[str]:
+    """Split snake_case / camelCase identifiers into singular lowercase words"""
+    words = []
+    for part in name.split("_"):
+        words.extend(w.lower() for w in _CAMEL_RE.findall(part))
+    return [normalize_question(w) or w for w in words]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough LLM token count (words and punctuation), good enough to compare prompts"""
+    return len(_TOKEN_RE.findall(text))
+
+
+class TableRanker:
+    """
+    Keyword/synonym index over table and column names.
+
+    `select()` scores every table against a question, keeps up to top-k
+    tables scoring at least half of the best one and adds the tables needed
+    to join them along foreign keys. It returns None
+    when no table scores at least `min_score`, meaning the caller should
+    fall back to the full schema.
+    """
+
+    def __init__(self, tables: dict, top_k: int = 3, min_score: float = 2.0):
+        self.top_k = top_k
+        self.min_score = min_score
+        self.table_names = list(tables)
+        self.index: dict[str, dict[str, float]] = {}
+        self.neighbours: dict[str, set] = {name: set() for name in tables}
+
+        for name, info in tables.items():
+            for token in identifier_tokens(name):
+                self._add(token, name, TABLE_NAME_WEIGHT)
+            for column in info.column_names:
+                for token in identifier_tokens(column):
+                    self._add(token, name, COLUMN_NAME_WEIGHT)
+            for _, ref_table, _ in info.foreign_keys:
+                if ref_table in self.neighbours:
+                    self.neighbours[name].add(ref_table)
+                    self.neighbours[ref_table].add(name)
+
+    @classmethod
+    def from_env(cls, tables: dict) -> "TableRanker":
+        return cls(
+            tables,
+            top_k=int(os.getenv("SCHEMA_PRUNING_TOP_K", "3")),
+            min_score=float(os.getenv("SCHEMA_PRUNING_MIN_SCORE", "2")),
+        )
+
+    def _add(self, token: str, table: str, weight: float):
+        slot = self.index.setdefault(token, {})
+        # A token counts once per table at its strongest weight
+        slot[table] = max(slot.get(table, 0.0), weight)
+
+    def score(self, question: str) -> dict[str, float]:
+        terms = set()
+        for word in normalize_question(question).split():
+            terms.add(word)
+            terms.update(SYNONYMS.get(word, ()))
+        scores = {name: 0.0 for name in self.table_names}
+        for term in terms:
+            for table, weight in self.index.get(term, {}).items():
+                scores[table] += weight
+        return scores
+
+    def _join_path(self, start: str, goal: str) -> list[str]:
+        previous = {start: None}
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            if node == goal:
+                path = []
+                while node is not None:
+                    path.append(node)
+                    node = previous[node]
+                return path
+            for nxt in self.neighbours.get(node, ()):
+                if nxt not in previous:
+                    previous[nxt] = node
+                    queue.append(nxt)
+        return []
+
+    def select(self, question: str) -> list[str] | None:
+        """Relevant tables for a question (best first), or None for low confidence"""
+        scores = self.score(question)
+        ranked = sorted((t for t in scores if scores[t] > 0), key=lambda t: -scores[t])
+        if not ranked or scores[ranked[0]] < self.min_score:
+            return None
+        cutoff = scores[ranked[0]] * RELATIVE_CUTOFF
+        selected = [t for t in ranked[:self.top_k] if scores[t] >= cutoff]
+
+        # FK-neighbour expansion: add the tables needed to join the selected ones
+        anchor = selected[0]
+        for table in list(selected[1:]):
+            for hop in self._join_path(anchor, table):
+                if hop not in selected:
+                    selected.append(hop)
+
+        if len(selected) >= len(self.table_names):
+            return None
+        return selected
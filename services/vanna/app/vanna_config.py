@@ -1,46 +1,129 @@
+import asyncio
+import json
 import os
-import re
+import threading
 import traceback
-from sqlalchemy import create_engine, text, inspect
-from groq import Groq
+from sqlalchemy import text
+from app import db, postprocess
+from app.coalesce import LLMDispatcher, SingleFlight
+from app.cost_guard import CostGuard, QueryTooExpensive
+from app.metrics import span
+from app.pagination import PageCursor, PageTokenSigner, encode_value, next_cursor, page_sql
+from app.schema_catalog import SchemaCatalog
+from app.shared_store import store_from_env
+from app.sql_cache import SQLCache, normalize_question
+from app.sql_repair import RepairSession, SQLRepairer
+from app.sql_translate import SQLTranslator
+from app.result_cache import ResultCache, referenced_tables, result_cache_key, watermark_sql
+from app.rollups import RollupStore
 
 _vanna_instance = None
 _database_engine = None
+_init_lock = threading.Lock()
+
+GROQ_MODEL = "llama-3.3-70b-versatile"
 
 class SelfHostedVanna:
     """
     Self-hosted Vanna AI implementation using Groq for SQL generation
     """
     def __init__(self, groq_api_key: str, database_url: str):
+        # groq is imported here rather than at module level to keep process start fast
+        from groq import AsyncGroq, Groq
         self.groq_client = Groq(api_key=groq_api_key)
+        self.async_groq_client = AsyncGroq(api_key=groq_api_key)
         self.database_url = database_url
-        self.engine = create_engine(database_url)
+        # Shared, configurable pools (see app/db.py)
+        self.engine = db.get_engine(database_url)
+        self.async_engine = db.get_async_engine(database_url)
+        
+        # Schema, SQL and result caches shared by all worker processes (None: process-local only)
+        self.shared_store = store_from_env(database_url)
+        # Question -> SQL cache, keyed on the schema fingerprint
+        self.sql_cache = SQLCache.from_env(self.shared_store)
+        # Result-set cache, invalidated by per-table watermarks
+        self.result_cache = ResultCache.from_env(self.shared_store)
+        # Concurrent identical questions / SQL share one in-flight generation / execution
+        coalesce = os.getenv("COALESCE_REQUESTS", "true").lower() in ("1", "true", "yes")
+        self.inflight_questions = SingleFlight(coalesce)
+        self.inflight_sql = SingleFlight(coalesce)
+        # Bounded-concurrency (optionally micro-batched) dispatch of Groq calls
+        self.llm_dispatcher = LLMDispatcher.from_env()
+        # Rows returned per /query page (0 disables the cap) and continuation token signing
+        self.row_limit = int(os.getenv("QUERY_ROW_LIMIT", "1000"))
+        self.page_tokens = PageTokenSigner.from_env()
+        # EXPLAIN-based rejection of expensive plans and per-query statement timeouts (PostgreSQL)
+        self.cost_guard = CostGuard.from_env()
+        # Local fixes, then bounded model repair, for SQL that fails to execute
+        self.sql_repairer = SQLRepairer.from_env()
         
-        # Get database schema for context
-        self.schema_info = self._get_schema_info()
+        # In-memory invoice/line item/payment cubes that answer common aggregates (PostgreSQL)
+        self.rollups = RollupStore.from_env(self.engine)
+        
+        # Get database schema for context (bulk introspection, cached prompt fragment)
+        self.catalog = SchemaCatalog(self.engine, shared=self.shared_store)
+        self.catalog.refresh()
+        self.sql_cache.retain_fingerprint(self.schema_fingerprint)
+        # AST-based MySQL -> PostgreSQL translation, memoized per SQL text
+        self.translator = SQLTranslator()
+        self._update_translator()
     
-    def _get_schema_info(self):
-        """Get database schema information for context"""
+    def warm_up(self, connections: int | None = None):
+        """Pre-open pooled connections so the first queries skip connection setup"""
+        if connections is None:
+            connections = db.PoolSettings().prewarm
         try:
-            inspector = inspect(self.engine)
-            tables = inspector.get_table_names()
-            schema = {}
-            
-            for table in tables:
-                columns = inspector.get_columns(table)
-                schema[table] = [col['name'] for col in columns]
-            
-            return schema
+            db.warm_pool(self.engine, connections)
         except Exception as e:
-            print(f"Warning: Could not get schema info: {e}")
-            return {}
+            print(f"Warning: Could not warm connection pool: {e}")
+        if self.rollups.enabled:
+            self.rollups.refresh(force=True)
     
-    def generate_sql(self, question: str) -> str:
-        """Generate SQL from natural language question using Groq"""
-        # Build schema context
-        schema_context = "Database Schema:\n"
-        for table, columns in self.schema_info.items():
-            schema_context += f"- {table}({', '.join(columns)})\n"
+    async def awarm_up(self, connections: int | None = None):
+        """Warm both the sync and async pools"""
+        if connections is None:
+            connections = db.PoolSettings().prewarm
+        await asyncio.to_thread(self.warm_up, connections)
+        if self.async_engine is not None:
+            try:
+                await db.awarm_pool(self.async_engine, connections)
+            except Exception as e:
+                print(f"Warning: Could not warm async connection pool: {e}")
+    
+    @property
+    def schema_info(self) -> dict:
+        """Table name -> column names, from the schema catalog"""
+        return self.catalog.schema_info
+    
+    @property
+    def schema_fingerprint(self) -> str:
+        return self.catalog.fingerprint
+    
+    def refresh_schema(self, force: bool = False) -> bool:
+        """Re-read the schema (or adopt a recent shared copy unless `force`); drops cached SQL and
+        results if it changed. Returns True on change."""
+        if not self.catalog.refresh(force):
+            return False
+        dropped = self.sql_cache.retain_fingerprint(self.schema_fingerprint)
+        self.result_cache.invalidate()
+        self.cost_guard.clear()
+        self.rollups.clear()
+        self._update_translator()
+        print(f"Schema changed, dropped {dropped} cached SQL entries")
+        return True
+    
+    def _update_translator(self):
+        """Teach the translator the table/column names it must quote for PostgreSQL"""
+        names = set(self.schema_info)
+        for columns in self.schema_info.values():
+            names.update(columns)
+        self.translator.set_identifiers(names)
+    
+    def _build_messages(self, question: str, hint: str | None = None) -> list[dict]:
+        """Build the Groq chat messages for a question, optionally with feedback on a rejected attempt"""
+        # Schema context is precomputed by the catalog and pruned to the tables relevant to the question
+        schema_context, _ = self.catalog.prompt_for_question(question)
+        feedback = f"\n{hint}\n" if hint else ""
         
         # Create prompt for Groq
         prompt = f"""You are a SQL expert. Given the following database schema and a natural language question, generate a valid MySQL SQL query.
@@ -48,107 +131,455 @@ class SelfHostedVanna:
 {schema_context}
 
 Question: {question}
-
+{feedback}
 Generate only the SQL query, no explanations. Return valid MySQL syntax.
 
 SQL Query:"""
         
+        return [
+            {
+                "role": "system",
+                "content": "You are a SQL expert. Generate valid MySQL queries based on natural language questions."
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
+    
+    @staticmethod
+    def _clean_sql(content: str) -> str:
+        sql = content.strip()
+        
+        # Clean up SQL (remove markdown code blocks if present)
+        if sql.startswith("```"):
+            sql = sql.split("```")[1]
+            if sql.startswith("sql"):
+                sql = sql[3:]
+            sql = sql.strip()
+        return sql
+    
+    def _cached_sql(self, question: str, use_cache: bool) -> str | None:
+        # Only cache when the prompt had a real schema behind it
+        if use_cache and self.schema_info:
+            return self.sql_cache.get(question, self.schema_fingerprint)
+        return None
+    
+    def _remember_sql(self, question: str, sql: str, use_cache: bool):
+        if use_cache and self.schema_info:
+            self.sql_cache.put(question, self.schema_fingerprint, sql)
+    
+    def generate_sql(self, question: str, use_cache: bool = True) -> str:
+        """Generate SQL from natural language question using Groq"""
+        cached = self._cached_sql(question, use_cache)
+        if cached is not None:
+            return cached
+        
         try:
             response = self.groq_client.chat.completions.create(
-                model="llama-3.3-70b-versatile", 
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a SQL expert. Generate valid MySQL queries based on natural language questions."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
+                model=GROQ_MODEL,
+                messages=self._build_messages(question),
                 temperature=0.1,
                 max_tokens=500,
                 timeout=60.0  # 60 second timeout for the 70B model
             )
-            
-            sql = response.choices[0].message.content.strip()
-            
-            # Clean up SQL (remove markdown code blocks if present)
-            if sql.startswith("```"):
-                sql = sql.split("```")[1]
-                if sql.startswith("sql"):
-                    sql = sql[3:]
-                sql = sql.strip()
-            
+            sql = self._clean_sql(response.choices[0].message.content)
+            self._remember_sql(question, sql, use_cache)
+            return sql
+        except Exception as e:
+            raise Exception(f"Failed to generate SQL with Groq: {str(e)}")
+    
+    async def agenerate_sql(self, question: str, use_cache: bool = True) -> str:
+        """Async variant of `generate_sql` that does not block the event loop.
+
+        Concurrent calls for the same normalized question share one Groq call.
+        """
+        cached = self._cached_sql(question, use_cache)
+        if cached is not None:
+            return cached
+        
+        key = (normalize_question(question) or question, self.schema_fingerprint, use_cache)
+        return await self.inflight_questions.do(key, lambda: self._agenerate_sql(question, use_cache))
+    
+    async def aregenerate_sql(self, question: str, rejected_sql: str, hint: str, use_cache: bool = True) -> str:
+        """Generate SQL again after `rejected_sql` was refused, telling the model why.
+
+        The new SQL replaces the rejected one in the SQL cache.
+        """
+        key = (normalize_question(question) or question, self.schema_fingerprint, use_cache, rejected_sql)
+        return await self.inflight_questions.do(key, lambda: self._agenerate_sql(question, use_cache, hint))
+    
+    async def _agenerate_sql(self, question: str, use_cache: bool, hint: str | None = None) -> str:
+        try:
+            response = await self.llm_dispatcher.submit(lambda: self.async_groq_client.chat.completions.create(
+                model=GROQ_MODEL,
+                messages=self._build_messages(question, hint),
+                temperature=0.1,
+                max_tokens=500,
+                timeout=60.0  # 60 second timeout for the 70B model
+            ))
+            sql = self._clean_sql(response.choices[0].message.content)
+            self._remember_sql(question, sql, use_cache)
             return sql
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             raise Exception(f"Failed to generate SQL with Groq: {str(e)}")
     
-    def run_sql(self, sql: str, keep_columns: list | None = None):
+    def _build_repair_messages(self, question: str, sql: str, error: str) -> list[dict]:
+        """Compact repair prompt: pruned schema, the failed SQL and the database error"""
+        schema_context, _ = self.catalog.prompt_for_question(question)
+        prompt = f"""This MySQL query, written to answer the question below, failed.
+
+{schema_context}
+
+Question: {question}
+
+Failed SQL:
+{sql}
+
+Database error: {error}
+
+Return only the corrected MySQL query, no explanations.
+
+SQL Query:"""
+        return [
+            {
+                "role": "system",
+                "content": "You are a SQL expert. Fix MySQL queries that failed to execute."
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
+    
+    async def _arepair_with_llm(self, question: str, sql: str, error: str, timeout: float) -> str:
+        try:
+            response = await self.llm_dispatcher.submit(lambda: self.async_groq_client.chat.completions.create(
+                model=GROQ_MODEL,
+                messages=self._build_repair_messages(question, sql, error),
+                temperature=0.1,
+                max_tokens=500,
+                timeout=timeout
+            ))
+            return self._clean_sql(response.choices[0].message.content)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            raise Exception(f"Failed to repair SQL with Groq: {str(e)}")
+    
+    def repair_session(self, question: str, use_cache: bool = True) -> RepairSession:
+        """Repair state for one question; SQL that executes after a repair replaces the cached SQL"""
+        return RepairSession(
+            self.sql_repairer,
+            self.schema_info,
+            llm_repair=lambda sql, error, timeout: self._arepair_with_llm(question, sql, error, timeout),
+            on_repaired=lambda sql: self._remember_sql(question, sql, use_cache),
+        )
+    
+    def _translate_sql(self, sql: str) -> str:
+        """Translate the MySQL the model generates into PostgreSQL (see app/sql_translate.py)."""
+        if not self.database_url.startswith("postgresql"):
+            return sql
+        translated = self.translator.translate(sql)
+        if translated != sql:
+            print("Translated SQL for Postgres:\n", translated)
+        return translated
+    
+    def _watermark_probe(self, tables) -> str | None:
+        stale = self.result_cache.stale_tables(tables)
+        if not stale:
+            return None
+        return watermark_sql(stale, self.schema_info, self.engine.dialect.identifier_preparer.quote)
+    
+    def _store_watermarks(self, rows):
+        self.result_cache.set_watermarks({t: (n, str(w) if w is not None else None) for t, n, w in rows})
+    
+    def _refresh_watermarks(self, tables):
+        """Probe row count / max timestamp for tables whose watermark is stale"""
+        probe = self._watermark_probe(tables)
+        if probe is None:
+            return
+        with db.connect(self.engine) as conn:
+            rows = conn.execute(text(probe)).fetchall()
+        self._store_watermarks(rows)
+    
+    async def _arefresh_watermarks(self, tables):
+        probe = self._watermark_probe(tables)
+        if probe is None:
+            return
+        async with db.aconnect(self.async_engine) as conn:
+            rows = (await conn.execute(text(probe))).fetchall()
+        self._store_watermarks(rows)
+    
+    def invalidate_results(self, tables: list | None = None) -> int:
+        """Drop cached query results for the given tables (all tables when None)"""
+        self.rollups.expire()
+        return self.result_cache.invalidate(tables)
+    
+    def _result_cache_plan(self, sql: str, keep_columns: list | None, use_cache: bool, params: dict | None = None):
+        """Return (cache_key, tables) for a cacheable query, else (None, None)"""
+        if not (use_cache and self.result_cache.enabled):
+            return None, None
+        tables = referenced_tables(sql, self.schema_info, self.engine.dialect.name)
+        if not tables:
+            return None, None
+        if params:
+            # Keyset pages share the statement text, so the bound values are part of the key
+            sql = sql + "\x00" + json.dumps({k: encode_value(v) for k, v in sorted(params.items())}, default=str)
+        return result_cache_key(sql, keep_columns), tables
+    
+    @staticmethod
+    def _select_columns(columns: list, keep_columns: list | None = None) -> list:
+        """Pick the columns worth returning for tabular display (decided once per result schema)"""
+        return postprocess.select_columns(columns, keep_columns)
+    
+    @staticmethod
+    def _filter_batch(columns: list, cols_to_return: list, rows) -> list[dict]:
+        """Build display dicts for a batch of rows, shortening binary and long values"""
+        if not cols_to_return:
+            return [{} for _ in rows]
+        return postprocess.display_rows(columns, rows, cols_to_return)
+    
+    def _filter_rows(self, columns: list, rows, keep_columns: list | None = None) -> list[dict]:
+        """Drop binary-looking columns and shorten long values for tabular display"""
+        return postprocess.display_rows(columns, rows, keep_columns)
+    
+    def run_sql(self, sql: str, keep_columns: list | None = None, use_cache: bool = True):
         """Execute SQL query and return results.
 
         By default this method will try to avoid returning huge/binary
         columns that are not useful for tabular display (PDFs, blobs,
         attachments, large text). You can provide an explicit
         `keep_columns` list to return only certain columns.
+
+        At most QUERY_ROW_LIMIT rows are returned; use `run_sql_page` to
+        get a continuation token for the rest.
         """
+        return self.run_sql_page(sql, keep_columns=keep_columns, use_cache=use_cache)["rows"]
+    
+    def _page_statement(self, sql: str, cursor: PageCursor | None):
+        """(statement, params) reading one page of `sql`, or the bare SQL when the cap is disabled"""
+        if self.row_limit <= 0:
+            return sql, {}
+        dialect = self.engine.dialect
+        return page_sql(sql, self.row_limit, cursor, dialect.identifier_preparer.quote, dialect.name)
+    
+    def _fetch_page_rows(self, result) -> list:
+        return result.fetchall() if self.row_limit <= 0 else result.fetchmany(self.row_limit + 1)
+    
+    def _next_cursor(self, sql: str, columns: list, rows: list, cursor: PageCursor | None):
+        """(rows to return, next page cursor); see pagination.next_cursor"""
+        if self.row_limit <= 0:
+            return len(rows), None
+        return next_cursor(sql, columns, rows, self.row_limit, cursor, self.engine.dialect.name)
+    
+    def _build_page(self, columns: list, rows: list, keep: int, following: PageCursor | None,
+                    keep_columns: list | None) -> dict:
+        """Filtered rows of one page plus the cursor of the next (as a plain dict for caching)"""
+        return {
+            "rows": self._filter_rows(columns, rows[:keep], keep_columns),
+            "truncated": self.row_limit > 0 and len(rows) > self.row_limit,
+            "next": following.as_dict() if following else None,
+        }
+    
+    def _page_response(self, sql: str, page: dict) -> dict:
+        """Public page shape; the continuation token is signed per response so it never expires in the cache"""
+        following = page["next"]
+        return {
+            "sql": sql,
+            "rows": list(page["rows"]),
+            "truncated": page["truncated"],
+            "next_page": self.page_tokens.dumps(PageCursor.from_dict(following)) if following else None,
+        }
+    
+    def _start_page(self, sql: str, page_token: str | None):
+        """Resolve (sql, cursor) for a fresh query or a continuation token"""
+        if page_token:
+            cursor = self.page_tokens.loads(page_token)
+            # Tokens carry the already translated SQL
+            return cursor.sql, cursor
+        # If using PostgreSQL, translate a few common MySQL-specific functions
+        # returned by the SQL generator into Postgres equivalents so execution succeeds.
+        with span("translate"):
+            return self._translate_sql(sql), None
+    
+    def _rollup_page(self, sql: str, cursor: PageCursor | None, keep_columns: list | None,
+                     use_cache: bool) -> dict | None:
+        """First page answered from the rollup cubes, or None to run the SQL on the database"""
+        if cursor is not None or not use_cache or not self.rollups.enabled:
+            return None
         try:
-            # If using PostgreSQL, translate a few common MySQL-specific functions
-            # returned by the SQL generator into Postgres equivalents so execution succeeds.
-            # This is a best-effort, minimal translator for common constructs like
-            # MONTH(), YEAR(), CURDATE(), IFNULL(), and backticks.
-            if self.database_url.startswith("postgresql"):
-                orig_sql = sql
-                # Replace MONTH(col) and YEAR(col) with EXTRACT
-                sql = re.sub(r"\bMONTH\(\s*([^\)]+)\s*\)", r"EXTRACT(MONTH FROM \1)", sql, flags=re.I)
-                sql = re.sub(r"\bYEAR\(\s*([^\)]+)\s*\)", r"EXTRACT(YEAR FROM \1)", sql, flags=re.I)
-                # CURDATE() -> CURRENT_DATE, NOW() -> CURRENT_TIMESTAMP
-                sql = re.sub(r"\bCURDATE\s*\(\s*\)", "CURRENT_DATE", sql, flags=re.I)
-                sql = re.sub(r"\bNOW\s*\(\s*\)", "CURRENT_TIMESTAMP", sql, flags=re.I)
-                # IFNULL(a,b) -> COALESCE(a,b)
-                sql = re.sub(r"\bIFNULL\s*\(", "COALESCE(", sql, flags=re.I)
-                # Remove MySQL-style backticks
-                sql = sql.replace('`', '')
-                if sql != orig_sql:
-                    print("Translated SQL for Postgres:\n", sql)
-            with self.engine.connect() as conn:
-                result = conn.execute(text(sql))
-                rows = result.fetchall()
-
-                # No rows -> empty result
-                if not rows:
-                    return []
+            with span("rollup"):
+                answer = self.rollups.answer(sql)
+        except Exception as e:
+            print(f"Warning: Could not answer from rollups: {e}")
+            return None
+        if answer is None:
+            return None
+        columns, rows = answer
+        if self.row_limit > 0 and len(rows) > self.row_limit:
+            # Long results keep keyset pagination on the database
+            return None
+        with span("filter", rows=len(rows)):
+            page = self._build_page(columns, rows, len(rows), None, keep_columns)
+        return self._page_response(sql, page)
+    
+    def run_sql_page(self, sql: str | None = None, page_token: str | None = None,
+                     keep_columns: list | None = None, use_cache: bool = True) -> dict:
+        """Execute SQL (or continue a previous result) and return one capped page.
 
+        Returns {"sql": executed SQL, "rows": [...], "truncated": bool, "next_page": token | None}.
+        The SQL is wrapped so at most QUERY_ROW_LIMIT + 1 rows are read;
+        follow-up pages resume with keyset pagination on the query's ORDER BY.
+        Results of read-only queries are cached on the final SQL text and
+        served until one of the referenced tables changes; aggregates the
+        rollup cubes answer exactly skip the database.
+        """
+        sql, cursor = self._start_page(sql, page_token)
+        try:
+            routed = self._rollup_page(sql, cursor, keep_columns, use_cache)
+            if routed is not None:
+                return routed
+            statement, params = self._page_statement(sql, cursor)
+            
+            cache_key, tables = self._result_cache_plan(statement, keep_columns, use_cache, params)
+            if cache_key:
+                try:
+                    self._refresh_watermarks(tables)
+                except Exception as e:
+                    print(f"Warning: Could not probe table watermarks: {e}")
+                    cache_key = None
+            if cache_key:
+                cached = self.result_cache.get(cache_key, tables)
+                if cached is not None:
+                    return self._page_response(sql, cached)
+                watermark = self.result_cache.snapshot(tables)
+            
+            with span("execute"), db.connect(self.engine) as conn:
+                with span("plan"):
+                    self.cost_guard.check(conn, statement, params)
+                result = conn.execute(text(statement), params)
+                rows = self._fetch_page_rows(result)
                 columns = list(result.keys())
+                keep, following = self._next_cursor(sql, columns, rows, cursor)
+                if keep == 0 and following is not None:
+                    # The first page was one tie group: re-read it in the total order
+                    statement, params = self._page_statement(sql, following)
+                    rows = self._fetch_page_rows(conn.execute(text(statement), params))
+                    keep, following = self._next_cursor(sql, columns, rows, following)
+
+            with span("filter", rows=len(rows)):
+                page = self._build_page(columns, rows, keep, following, keep_columns)
+            if cache_key:
+                self.result_cache.put(cache_key, tables, watermark, page)
+            return self._page_response(sql, page)
+        except QueryTooExpensive:
+            raise
+        except Exception as e:
+            raise Exception(f"Failed to execute SQL: {str(e)}")
+    
+    async def arun_sql(self, sql: str, keep_columns: list | None = None, use_cache: bool = True):
+        """Async variant of `run_sql`"""
+        return (await self.arun_sql_page(sql, keep_columns=keep_columns, use_cache=use_cache))["rows"]
+    
+    async def arun_sql_page(self, sql: str | None = None, page_token: str | None = None,
+                            keep_columns: list | None = None, use_cache: bool = True) -> dict:
+        """Async variant of `run_sql_page`; uses the async engine, or a worker thread without one.
 
-                # If caller requests explicit columns, honor that (only keep existing ones)
-                if keep_columns:
-                    cols_to_return = [c for c in keep_columns if c in columns]
-                else:
-                    # Heuristics: drop columns that look like binary/attachments or are very large
-                    exclude_pattern = re.compile(r"blob|binary|file|attachment|pdf|document|image|base64|content", re.I)
-                    cols_to_return = [c for c in columns if not exclude_pattern.search(c)]
-
-                results: list[dict] = []
-                for row in rows:
-                    row_map = dict(zip(columns, row))
-                    filtered: dict = {}
-                    for col in cols_to_return:
-                        val = row_map.get(col)
-                        # Represent bytes/binary succinctly
-                        if isinstance(val, (bytes, bytearray)):
-                            filtered[col] = "<binary data>"
-                            continue
-                        # Truncate excessively long strings for display
-                        if isinstance(val, str) and len(val) > 200:
-                            filtered[col] = val[:200] + "..."
-                            continue
-                        filtered[col] = val
-                    results.append(filtered)
-
-                return results
+        Concurrent calls for the same SQL and page share one execution.
+        """
+        key = ((sql or "").strip(), page_token, tuple(keep_columns) if keep_columns is not None else None, use_cache)
+        return await self.inflight_sql.do(key, lambda: self._arun_sql_page(sql, page_token, keep_columns, use_cache))
+    
+    async def _arun_sql_page(self, sql: str | None, page_token: str | None, keep_columns: list | None, use_cache: bool):
+        if self.async_engine is None:
+            return await asyncio.to_thread(self.run_sql_page, sql, page_token, keep_columns, use_cache)
+        sql, cursor = self._start_page(sql, page_token)
+        try:
+            if cursor is None and use_cache and self.rollups.enabled:
+                # A due cube refresh reads the database, so route off the event loop
+                routed = await asyncio.to_thread(self._rollup_page, sql, cursor, keep_columns, use_cache)
+                if routed is not None:
+                    return routed
+            statement, params = self._page_statement(sql, cursor)
+            
+            cache_key, tables = self._result_cache_plan(statement, keep_columns, use_cache, params)
+            if cache_key:
+                try:
+                    await self._arefresh_watermarks(tables)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"Warning: Could not probe table watermarks: {e}")
+                    cache_key = None
+            if cache_key:
+                cached = self.result_cache.get(cache_key, tables)
+                if cached is not None:
+                    return self._page_response(sql, cached)
+                watermark = self.result_cache.snapshot(tables)
+            
+            with span("execute"):
+                async with db.aconnect(self.async_engine) as conn:
+                    with span("plan"):
+                        await self.cost_guard.acheck(conn, statement, params)
+                    result = await conn.execute(text(statement), params)
+                    rows = self._fetch_page_rows(result)
+                    columns = list(result.keys())
+                    keep, following = self._next_cursor(sql, columns, rows, cursor)
+                    if keep == 0 and following is not None:
+                        # The first page was one tie group: re-read it in the total order
+                        statement, params = self._page_statement(sql, following)
+                        rows = self._fetch_page_rows(await conn.execute(text(statement), params))
+                        keep, following = self._next_cursor(sql, columns, rows, following)
+            
+            with span("filter", rows=len(rows)):
+                page = self._build_page(columns, rows, keep, following, keep_columns)
+            if cache_key:
+                self.result_cache.put(cache_key, tables, watermark, page)
+            return self._page_response(sql, page)
+        except (asyncio.CancelledError, QueryTooExpensive):
+            raise
         except Exception as e:
             raise Exception(f"Failed to execute SQL: {str(e)}")
+    
+    def stream_sql(self, sql: str, batch_size: int = 500, keep_columns: list | None = None):
+        """Execute SQL on a server-side cursor, yielding (columns, rows) batches.
+
+        Applies the same column filtering as `run_sql` but never holds more
+        than `batch_size` rows in memory. Streamed results bypass the cache.
+        """
+        sql = self._translate_sql(sql)
+        with db.connect(self.engine) as conn:
+            self.cost_guard.check(conn, sql)
+            result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(text(sql))
+            columns = list(result.keys())
+            cols_to_return = self._select_columns(columns, keep_columns)
+            for partition in result.partitions(batch_size):
+                yield cols_to_return, self._filter_batch(columns, cols_to_return, partition)
+    
+    async def astream_sql(self, sql: str, batch_size: int = 500, keep_columns: list | None = None):
+        """Async variant of `stream_sql`"""
+        if self.async_engine is None:
+            batches = self.stream_sql(sql, batch_size, keep_columns)
+            try:
+                while True:
+                    batch = await asyncio.to_thread(next, batches, None)
+                    if batch is None:
+                        return
+                    yield batch
+            finally:
+                await asyncio.to_thread(batches.close)
+        
+        sql = self._translate_sql(sql)
+        async with db.aconnect(self.async_engine) as conn:
+            await self.cost_guard.acheck(conn, sql)
+            result = await conn.stream(text(sql))
+            columns = list(result.keys())
+            cols_to_return = self._select_columns(columns, keep_columns)
+            async for partition in result.partitions(batch_size):
+                yield cols_to_return, self._filter_batch(columns, cols_to_return, partition)
 
 
 def get_vanna_instance():
@@ -160,35 +591,33 @@ def get_vanna_instance():
     if _vanna_instance is not None:
         return _vanna_instance
     
+    with _init_lock:
+        if _vanna_instance is None:
+            _vanna_instance = _create_vanna_instance()
+    return _vanna_instance
+
+
+def _create_vanna_instance():
+    """Build a SelfHostedVanna from GROQ_API_KEY / DATABASE_URL"""
     # Get API key from environment
     groq_api_key = os.getenv("GROQ_API_KEY")
     if not groq_api_key:
         raise ValueError("GROQ_API_KEY environment variable is required. Please set it in your .env file.")
     
-    # Get database connection string
-    database_url = os.getenv("DATABASE_URL")
-    if not database_url:
-        raise ValueError("DATABASE_URL environment variable is required. Please set it in your .env file.")
-    
-    # Convert mysql:// to mysql+pymysql:// or postgresql:// to postgresql+psycopg:// for SQLAlchemy if needed
-    if database_url.startswith("mysql://"):
-        database_url = database_url.replace("mysql://", "mysql+pymysql://", 1)
-    elif database_url.startswith("postgresql://") and "+psycopg" not in database_url:
-        # PostgreSQL driver is usually handled automatically by SQLAlchemy, but we can be explicit
-        # If you have psycopg2 installed, SQLAlchemy will use it by default
-        pass  # Keep as-is; SQLAlchemy will pick the correct driver
+    # Get database connection string (mysql:// is converted to mysql+pymysql:// for SQLAlchemy)
+    database_url = db.database_url_from_env()
     
     print(f"Initializing self-hosted Vanna AI with Groq...")
     print(f"Database URL: {database_url[:30]}...")  # Don't print full URL for security
     
     try:
         # Use our custom self-hosted implementation
-        _vanna_instance = SelfHostedVanna(
+        instance = SelfHostedVanna(
             groq_api_key=groq_api_key,
             database_url=database_url
         )
         print("Self-hosted Vanna AI initialized successfully!")
-        return _vanna_instance
+        return instance
     except Exception as e:
         error_msg = f"Failed to initialize self-hosted Vanna AI: {str(e)}"
         print(error_msg)
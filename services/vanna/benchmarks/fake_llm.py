@@ -0,0 +1,131 @@
+"""
+Deterministic stand-in for the Groq clients, for benchmarks without an API key.
+
+Answers the questions in CORPUS with canned SQL after a simulated latency
+(seeded, so runs are repeatable). Repair prompts get the canned query back,
+as a model that fixed the SQL would.
+"""
+
+import asyncio
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+
+class CannedQuestion:
+    __slots__ = ("question", "sql", "sqlite")
+
+    def __init__(self, question: str, sql: str, sqlite: str | None = None):
+        self.question = question
+        # MySQL, as the model writes it (the service translates it for PostgreSQL)
+        self.sql = sql
+        # Override for SQLite fixtures where the MySQL spelling does not run
+        self.sqlite = sqlite
+
+
+CORPUS = [
+    CannedQuestion(
+        "What is the total spend by invoice status?",
+        "SELECT status, COUNT(*) AS invoice_count, SUM(total) AS total_spend FROM invoices "
+        "GROUP BY status ORDER BY total_spend DESC"),
+    CannedQuestion(
+        "Who are the top 10 vendors by spend?",
+        "SELECT v.name, SUM(i.total) AS total_spend FROM invoices i JOIN vendors v ON v.id = i.vendorId "
+        "GROUP BY v.name ORDER BY total_spend DESC LIMIT 10"),
+    CannedQuestion(
+        "How many invoices does each vendor have?",
+        "SELECT v.name, COUNT(i.id) AS invoice_count FROM vendors v LEFT JOIN invoices i ON i.vendorId = v.id "
+        "GROUP BY v.name ORDER BY invoice_count DESC"),
+    CannedQuestion(
+        "What is the spend per line item category?",
+        "SELECT l.category, SUM(l.amount) AS spend, COUNT(*) AS items FROM line_items l "
+        "JOIN invoices i ON i.id = l.invoiceId GROUP BY l.category ORDER BY spend DESC"),
+    CannedQuestion(
+        "Show the monthly invoice totals",
+        "SELECT DATE_FORMAT(date, '%Y-%m') AS month, SUM(total) AS total FROM invoices GROUP BY month ORDER BY month",
+        sqlite="SELECT strftime('%Y-%m', date) AS month, SUM(total) AS total FROM invoices GROUP BY month ORDER BY month"),
+    CannedQuestion(
+        "List the 20 most recent invoices",
+        "SELECT invoiceNumber, date, total, status FROM invoices ORDER BY date DESC LIMIT 20"),
+    CannedQuestion(
+        "What is the average invoice total?",
+        "SELECT AVG(total) AS average_total, MIN(total) AS smallest, MAX(total) AS largest FROM invoices"),
+    CannedQuestion(
+        "Which customers have the most invoices?",
+        "SELECT c.name, COUNT(*) AS invoice_count, SUM(i.total) AS total FROM invoices i "
+        "JOIN customers c ON c.id = i.customerId GROUP BY c.name ORDER BY invoice_count DESC"),
+    CannedQuestion(
+        "What are the 25 largest line items?",
+        "SELECT l.description, l.amount, i.invoiceNumber FROM line_items l JOIN invoices i ON i.id = l.invoiceId "
+        "ORDER BY l.amount DESC LIMIT 25"),
+    CannedQuestion(
+        "Show all invoices",
+        "SELECT id, invoiceNumber, date, amount, tax, total, status, vendorId, notes FROM invoices ORDER BY date"),
+    CannedQuestion(
+        "Which vendors have no invoices?",
+        "SELECT name FROM vendors WHERE id NOT IN (SELECT vendorId FROM invoices) ORDER BY name"),
+    CannedQuestion(
+        "How much tax did we pay in total?",
+        "SELECT SUM(tax) AS total_tax, COUNT(tax) AS taxed_invoices FROM invoices"),
+]
+
+_QUESTION = re.compile(r"^Question: (.*)$", re.M)
+
+
+class _Completions:
+    def __init__(self, client):
+        self._client = client
+
+    def create(self, messages: list, **kwargs):
+        return self._client._respond(messages)
+
+
+class _AsyncCompletions:
+    def __init__(self, client):
+        self._client = client
+
+    async def create(self, messages: list, **kwargs):
+        await asyncio.sleep(self._client._delay())
+        return self._client._answer(messages)
+
+
+class FakeGroq:
+    """
+    Groq client double: `chat.completions.create(messages=...)` returns the
+    canned SQL for the prompt's question after `latency_ms` ± `jitter_ms`.
+
+    Use `FakeGroq(...)` for `groq_client` and `FakeGroq(..., asynchronous=True)`
+    for `async_groq_client`.
+    """
+
+    def __init__(self, corpus: list = CORPUS, dialect: str = "postgresql", latency_ms: float = 300,
+                 jitter_ms: float = 100, seed: int = 0, asynchronous: bool = False):
+        self.answers = {item.question: (item.sqlite if dialect == "sqlite" and item.sqlite else item.sql)
+                        for item in corpus}
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=_AsyncCompletions(self) if asynchronous else _Completions(self))
+
+    def _delay(self) -> float:
+        with self._lock:
+            self.calls += 1
+            jitter = self._random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+        return max(0.0, self.latency_ms + jitter) / 1000
+
+    def _respond(self, messages: list):
+        time.sleep(self._delay())
+        return self._answer(messages)
+
+    def _answer(self, messages: list):
+        prompt = messages[-1]["content"]
+        match = _QUESTION.search(prompt)
+        question = match.group(1).strip() if match else None
+        if question not in self.answers:
+            raise Exception(f"Fake LLM has no canned SQL for question: {question!r}")
+        message = SimpleNamespace(content=f"```sql\n{self.answers[question]}\n```")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
@@ -0,0 +1,133 @@
+"""
+SQLite copy of the analytics database, built from data/Analytics_Test_Data.json
+with the seed mapping of app/ingest.py, so the service can be benchmarked
+without PostgreSQL.
+
+    python -m benchmarks.fixture [--scale 10] [--output /tmp/flowbit.db]
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.ingest import DEFAULT_DATA, load_documents, map_document  # noqa: E402
+
+# Tables and (quoted camelCase) columns as created by the Prisma migrations
+SCHEMA = """
+CREATE TABLE vendors (
+    id TEXT PRIMARY KEY, name TEXT NOT NULL, category TEXT, email TEXT, phone TEXT, address TEXT,
+    "createdAt" TIMESTAMP NOT NULL, "updatedAt" TIMESTAMP NOT NULL
+);
+CREATE TABLE customers (
+    id TEXT PRIMARY KEY, name TEXT NOT NULL, email TEXT, phone TEXT, address TEXT,
+    "createdAt" TIMESTAMP NOT NULL, "updatedAt" TIMESTAMP NOT NULL
+);
+CREATE TABLE invoices (
+    id TEXT PRIMARY KEY, "invoiceNumber" TEXT NOT NULL UNIQUE, date TIMESTAMP NOT NULL, "dueDate" TIMESTAMP,
+    amount NUMERIC NOT NULL, tax NUMERIC, total NUMERIC NOT NULL, status TEXT NOT NULL,
+    "vendorId" TEXT NOT NULL REFERENCES vendors(id), "customerId" TEXT REFERENCES customers(id), notes TEXT,
+    "createdAt" TIMESTAMP NOT NULL, "updatedAt" TIMESTAMP NOT NULL
+);
+CREATE TABLE line_items (
+    id TEXT PRIMARY KEY, "invoiceId" TEXT NOT NULL REFERENCES invoices(id) ON DELETE CASCADE,
+    description TEXT NOT NULL, quantity NUMERIC NOT NULL, "unitPrice" NUMERIC NOT NULL, amount NUMERIC NOT NULL,
+    category TEXT, "createdAt" TIMESTAMP NOT NULL
+);
+CREATE TABLE payments (
+    id TEXT PRIMARY KEY, "invoiceId" TEXT NOT NULL REFERENCES invoices(id) ON DELETE CASCADE,
+    amount NUMERIC NOT NULL, "paymentDate" TIMESTAMP NOT NULL, method TEXT, reference TEXT, notes TEXT,
+    "createdAt" TIMESTAMP NOT NULL
+);
+CREATE INDEX invoices_date_idx ON invoices(date);
+CREATE INDEX invoices_status_idx ON invoices(status);
+CREATE INDEX invoices_vendor_idx ON invoices("vendorId");
+CREATE INDEX line_items_invoice_idx ON line_items("invoiceId");
+CREATE INDEX line_items_category_idx ON line_items(category);
+CREATE INDEX payments_invoice_idx ON payments("invoiceId");
+"""
+
+_IDS = uuid.UUID("5b0e2a7e-64c1-4f1e-9a47-0c6d3f1b2a10")
+
+
+def _id(kind: str, key: str) -> str:
+    """Stable id, so rebuilt fixtures (and benchmark results) are comparable"""
+    return str(uuid.uuid5(_IDS, f"{kind}:{key}"))
+
+
+def build_sqlite(db_path: str, data_path: str = DEFAULT_DATA, scale: int = 1) -> dict:
+    """
+    (Re)create `db_path` from the dataset and return row counts.
+
+    `scale` > 1 adds copies of every invoice (numbered `<invoiceNumber>-<n>`,
+    dated n days later) for load tests that need more rows.
+    """
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    mapped = [m for m in (map_document(d) for d in load_documents(data_path)) if m is not None]
+    now = datetime(2025, 11, 1)
+    vendors, customers, invoices, line_items = {}, {}, {}, []
+    for copy in range(scale):
+        for record in mapped:
+            number = record["invoice"]["invoiceNumber"] + (f"-{copy}" if copy else "")
+            if number in invoices:
+                # Same as the seed's upsert with an empty update: the first document wins
+                continue
+            vendor_id = vendors.setdefault(record["vendor"]["name"], (_id("vendor", record["vendor"]["name"]), record["vendor"]))[0]
+            customer_id = None
+            if record["customer"]:
+                customer_id = customers.setdefault(
+                    record["customer"]["name"], (_id("customer", record["customer"]["name"]), record["customer"]))[0]
+            invoice = dict(record["invoice"], invoiceNumber=number, id=_id("invoice", number),
+                           vendorId=vendor_id, customerId=customer_id)
+            invoice["date"] += timedelta(days=copy)
+            invoices[number] = invoice
+            for position, item in enumerate(record["line_items"]):
+                line_items.append(dict(item, id=_id("line_item", f"{number}:{position}"), invoiceId=invoice["id"]))
+
+    stamp = now.isoformat(sep=" ")
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executescript(SCHEMA)
+        conn.executemany(
+            'INSERT INTO vendors (id, name, address, "createdAt", "updatedAt") VALUES (?, ?, ?, ?, ?)',
+            [(vid, v["name"], v["address"], stamp, stamp) for vid, v in vendors.values()])
+        conn.executemany(
+            'INSERT INTO customers (id, name, address, "createdAt", "updatedAt") VALUES (?, ?, ?, ?, ?)',
+            [(cid, c["name"], c["address"], stamp, stamp) for cid, c in customers.values()])
+        conn.executemany(
+            'INSERT INTO invoices (id, "invoiceNumber", date, "dueDate", amount, tax, total, status, "vendorId", '
+            '"customerId", notes, "createdAt", "updatedAt") VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(i["id"], i["invoiceNumber"], i["date"].isoformat(sep=" "),
+              i["dueDate"].isoformat(sep=" ") if i["dueDate"] else None, i["amount"], i["tax"], i["total"],
+              i["status"], i["vendorId"], i["customerId"], i["notes"], stamp, stamp) for i in invoices.values()])
+        conn.executemany(
+            'INSERT INTO line_items (id, "invoiceId", description, quantity, "unitPrice", amount, category, "createdAt") '
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(li["id"], li["invoiceId"], li["description"], li["quantity"], li["unitPrice"], li["amount"],
+              li["category"], stamp) for li in line_items])
+        conn.commit()
+    finally:
+        conn.close()
+    return {"vendors": len(vendors), "customers": len(customers), "invoices": len(invoices),
+            "line_items": len(line_items), "payments": 0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--data", default=DEFAULT_DATA)
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--output", default=os.path.join(os.getcwd(), "benchmark_fixture.db"))
+    args = parser.parse_args()
+    if not os.path.exists(args.data):
+        sys.exit(f"{args.data} not found")
+    counts = build_sqlite(args.output, args.data, args.scale)
+    print(f"{args.output}: {counts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""
+Offline load test of the /query pipeline.
+
+Runs the FastAPI app in-process (httpx ASGI transport, no network) against
+a SQLite fixture built from data/Analytics_Test_Data.json, with the fake
+LLM from benchmarks/fake_llm.py in place of Groq. Reports throughput,
+end-to-end and per-stage p50/p95/p99 latencies and the memory high-water
+mark, optionally as JSON, and can fail on regressions against a previous
+result:
+
+    python -m benchmarks.load_bench --requests 2000 --concurrency 32 --output result.json
+    python -m benchmarks.load_bench --baseline result.json --tolerance 0.2
+
+`--cold` disables the SQL and result caches and request coalescing so every
+request generates and executes SQL; `--database-url` runs against an
+existing database instead of the fixture.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from benchmarks import fixture  # noqa: E402
+from benchmarks.fake_llm import CORPUS, FakeGroq  # noqa: E402
+
+RESULT_VERSION = 1
+# Settings that must match for two results to be compared
+COMPARABLE = ("requests", "concurrency", "cold", "llm_latency_ms", "llm_jitter_ms", "database", "scale")
+WORKDIR = tempfile.mkdtemp(prefix="vanna-bench-")
+
+
+def percentile(values: list, p: float) -> float | None:
+    """Nearest-rank percentile of already sorted values"""
+    if not values:
+        return None
+    return values[max(0, min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1))]
+
+
+def summarize(seconds: list) -> dict:
+    values = sorted(v * 1000 for v in seconds)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 3),
+        "p50": round(percentile(values, 50), 3),
+        "p95": round(percentile(values, 95), 3),
+        "p99": round(percentile(values, 99), 3),
+        "max": round(values[-1], 3),
+    }
+
+
+def max_rss_mb() -> float:
+    """Peak resident set size of this process so far"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def configure_environment(args, database_url: str):
+    """Environment for the service; must run before app modules are imported"""
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("GROQ_API_KEY", "offline-benchmark")
+    os.environ["VANNA_EAGER_INIT"] = "false"
+    os.environ.pop("SQL_CACHE_PATH", None)
+    # One in-process app: warm state left in a shared store by other runs would skew results
+    os.environ["SHARED_CACHE"] = "off"
+    if args.cold:
+        os.environ["SQL_CACHE_MAX_ENTRIES"] = "0"
+        os.environ["RESULT_CACHE_MAX_BYTES"] = "0"
+        os.environ["COALESCE_REQUESTS"] = "false"
+
+
+async def drive(app, questions: list, total: int, concurrency: int, latencies: list, statuses: Counter):
+    """Send `total` /query requests from `concurrency` concurrent clients"""
+    import httpx
+
+    issued = 0
+
+    async def client_loop(client):
+        nonlocal issued
+        while issued < total:
+            question = questions[issued % len(questions)]
+            issued += 1
+            start = time.perf_counter()
+            try:
+                response = await client.post("/query", json={"question": question})
+                statuses[str(response.status_code)] += 1
+            except Exception as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - start)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=300) as client:
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+
+
+def run(args) -> dict:
+    fixture_counts = None
+    database_url = args.database_url
+    if not database_url:
+        db_path = os.path.join(WORKDIR, "fixture.db")
+        fixture_counts = fixture.build_sqlite(db_path, args.data, args.scale)
+        database_url = f"sqlite:///{db_path}"
+    configure_environment(args, database_url)
+
+    # The service logs a JSON line per stage; keep it off the terminal unless asked
+    quiet = contextlib.redirect_stdout(open(os.devnull, "w")) if not args.verbose else contextlib.nullcontext()
+    with quiet:
+        from app import main, metrics, vanna_config
+
+        vanna = vanna_config.get_vanna_instance()
+        dialect = vanna.engine.dialect.name
+        vanna.groq_client = FakeGroq(dialect=dialect, latency_ms=args.llm_latency_ms,
+                                     jitter_ms=args.llm_jitter_ms, seed=args.seed)
+        vanna.async_groq_client = FakeGroq(dialect=dialect, latency_ms=args.llm_latency_ms,
+                                           jitter_ms=args.llm_jitter_ms, seed=args.seed, asynchronous=True)
+        vanna.warm_up()
+
+        questions = [item.question for item in CORPUS]
+        stages = defaultdict(list)
+        latencies, statuses = [], Counter()
+        measured = {}
+
+        async def session():
+            # One event loop for warm-up and measurement, as in the server
+            if args.warmup:
+                await drive(main.app, questions, args.warmup, min(args.concurrency, args.warmup), [], Counter())
+            metrics.add_stage_listener(lambda stage, seconds: stages[stage].append(seconds))
+            measured["rss_before"] = max_rss_mb()
+            if args.tracemalloc:
+                tracemalloc.start()
+            start = time.perf_counter()
+            await drive(main.app, questions, args.requests, args.concurrency, latencies, statuses)
+            measured["elapsed"] = time.perf_counter() - start
+            if args.tracemalloc:
+                measured["python_peak"] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+        asyncio.run(session())
+        elapsed, rss_before, python_peak = measured["elapsed"], measured["rss_before"], measured.get("python_peak")
+        caches = {
+            "sql": vanna.sql_cache.stats(),
+            "results": vanna.result_cache.stats(),
+            "llm": vanna.llm_dispatcher.stats(),
+            "rollups": vanna.rollups.stats(),
+        }
+
+    ok = statuses.get("200", 0)
+    return {
+        "benchmark": "query_load",
+        "version": RESULT_VERSION,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "warmup": args.warmup,
+            "cold": args.cold,
+            "llm_latency_ms": args.llm_latency_ms,
+            "llm_jitter_ms": args.llm_jitter_ms,
+            "seed": args.seed,
+            "database": dialect,
+            "scale": args.scale if fixture_counts else None,
+            "fixture_rows": fixture_counts,
+            "questions": len(questions),
+        },
+        "requests": {
+            "total": len(latencies),
+            "ok": ok,
+            "statuses": dict(statuses),
+            "seconds": round(elapsed, 3),
+            "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        },
+        "latency_ms": summarize(latencies),
+        "stages_ms": {stage: summarize(samples) for stage, samples in sorted(stages.items())},
+        "memory": {
+            "max_rss_mb": max_rss_mb(),
+            "rss_growth_mb": round(max_rss_mb() - rss_before, 1),
+            "python_peak_mb": round(python_peak / (1024 * 1024), 1) if python_peak is not None else None,
+        },
+        "llm_calls": vanna.async_groq_client.calls + vanna.groq_client.calls,
+        "caches": caches,
+    }
+
+
+def regressions(result: dict, baseline: dict, tolerance: float, min_delta_ms: float) -> list[str]:
+    """Metrics in `result` worse than `baseline` by more than `tolerance` (relative)"""
+    found = []
+
+    def slower(name, now, before):
+        if now is None or before is None:
+            return
+        if now > before * (1 + tolerance) and now - before >= min_delta_ms:
+            found.append(f"{name}: {before:.3f} -> {now:.3f} ms (+{(now / before - 1) * 100 if before else 0:.0f}%)")
+
+    before_rps, now_rps = baseline["requests"].get("throughput_rps"), result["requests"].get("throughput_rps")
+    if before_rps and now_rps is not None and now_rps < before_rps * (1 - tolerance):
+        found.append(f"throughput: {before_rps:.1f} -> {now_rps:.1f} req/s ({(now_rps / before_rps - 1) * 100:.0f}%)")
+    for p in ("p50", "p95", "p99"):
+        slower(f"latency {p}", result["latency_ms"].get(p), baseline["latency_ms"].get(p))
+    for stage, summary in result["stages_ms"].items():
+        for p in ("p95", "p99"):
+            slower(f"stage {stage} {p}", summary.get(p), baseline["stages_ms"].get(stage, {}).get(p))
+    before_rss, now_rss = baseline["memory"].get("max_rss_mb"), result["memory"].get("max_rss_mb")
+    if before_rss and now_rss and now_rss > before_rss * (1 + tolerance):
+        found.append(f"max RSS: {before_rss:.1f} -> {now_rss:.1f} MB")
+    if result["requests"]["ok"] < result["requests"]["total"] and \
+            baseline["requests"]["ok"] == baseline["requests"]["total"]:
+        found.append(f"errors: {result['requests']['statuses']}")
+    return found
+
+
+def print_report(result: dict):
+    requests, latency = result["requests"], result["latency_ms"]
+    config = result["config"]
+    print(f"{requests['total']} requests, concurrency {config['concurrency']}, {config['database']}, "
+          f"{'cold' if config['cold'] else 'warm'} caches, LLM {config['llm_latency_ms']:g}±{config['llm_jitter_ms']:g} ms")
+    print(f"  throughput  {requests['throughput_rps']} req/s over {requests['seconds']} s, statuses {requests['statuses']}")
+    print(f"  latency     p50 {latency.get('p50')} ms  p95 {latency.get('p95')} ms  p99 {latency.get('p99')} ms")
+    print(f"  memory      max RSS {result['memory']['max_rss_mb']} MB (+{result['memory']['rss_growth_mb']} MB during load)")
+    print(f"  {'stage':<16} {'count':>7} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+    for stage, summary in result["stages_ms"].items():
+        print(f"  {stage:<16} {summary['count']:>7} {summary['p50']:>10} {summary['p95']:>10} {summary['p99']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=len(CORPUS), help="Requests sent before measuring")
+    parser.add_argument("--cold", action="store_true", help="Disable SQL/result caches and coalescing")
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--llm-jitter-ms", type=float, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scale", type=int, default=20, help="Copies of the dataset in the SQLite fixture")
+    parser.add_argument("--data", default=fixture.DEFAULT_DATA)
+    parser.add_argument("--database-url", help="Use this database instead of the SQLite fixture")
+    parser.add_argument("--tracemalloc", action="store_true", help="Also report the Python heap peak (slower)")
+    parser.add_argument("--output", help="Write the JSON result to this file ('-' for stdout)")
+    parser.add_argument("--baseline", help="Previous JSON result to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="Ignore latency changes smaller than this")
+    parser.add_argument("--verbose", action="store_true", help="Show the service's log output")
+    args = parser.parse_args()
+
+    try:
+        result = run(args)
+    finally:
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+    if args.output == "-":
+        print(json.dumps(result, indent=2, default=str))
+    else:
+        print_report(result)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(result, f, indent=2, default=str)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        different = {key: (baseline["config"].get(key), value) for key, value in result["config"].items()
+                     if key in COMPARABLE and baseline["config"].get(key) != value}
+        if different:
+            print(f"Warning: baseline was run with a different configuration: {different}", file=sys.stderr)
+        found = regressions(result, baseline, args.tolerance, args.min_delta_ms)
+        if found:
+            print(f"Regressions against {args.baseline}:", file=sys.stderr)
+            for line in found:
+                print(f"  {line}", file=sys.stderr)
+            sys.exit(1)
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Compare the per-row dict post-processing run_sql used to do with the
+column-wise engine in app/postprocess.py.
+
+Builds a synthetic invoices-like result (numbers, dates, decimals, short
+and occasionally long text, a binary attachment column) and times turning
+it into display rows, with and without numpy.
+
+    python -m benchmarks.postprocess_bench [--rows 100000] [--rounds 5]
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app import postprocess  # noqa: E402
+
+COLUMNS = ["id", "invoiceNumber", "date", "amount", "tax", "total", "status",
+           "vendorId", "notes", "createdAt", "pdfAttachment"]
+
+
+def baseline(columns, rows, keep_columns=None):
+    """The previous run_sql implementation, kept verbatim for comparison"""
+    if keep_columns:
+        cols_to_return = [c for c in keep_columns if c in columns]
+    else:
+        exclude_pattern = re.compile(r"blob|binary|file|attachment|pdf|document|image|base64|content", re.I)
+        cols_to_return = [c for c in columns if not exclude_pattern.search(c)]
+    results = []
+    for row in rows:
+        row_map = dict(zip(columns, row))
+        filtered = {}
+        for col in cols_to_return:
+            val = row_map.get(col)
+            if isinstance(val, (bytes, bytearray)):
+                filtered[col] = "<binary data>"
+                continue
+            if isinstance(val, str) and len(val) > 200:
+                filtered[col] = val[:200] + "..."
+                continue
+            filtered[col] = val
+        results.append(filtered)
+    return results
+
+
+def make_rows(count: int) -> list[tuple]:
+    rows = []
+    for i in range(count):
+        notes = ("Long note " * 40) if i % 50 == 0 else (f"note {i}" if i % 3 else None)
+        rows.append((
+            i, f"INV-{i:06d}", date(2025, 1 + i % 12, 1 + i % 28), Decimal(f"{i % 997}.50"),
+            float(i % 13), Decimal(f"{i % 1009}.75"), ("paid", "pending", "overdue")[i % 3],
+            i % 50, notes, datetime(2025, 1, 1, 12, i % 60), b"%PDF-1.4" if i % 10 == 0 else None,
+        ))
+    return rows
+
+
+def best_of(rounds: int, fn) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    expected = baseline(COLUMNS, rows)
+    if postprocess.display_rows(COLUMNS, rows) != expected:
+        sys.exit("column-wise output differs from the baseline")
+
+    variants = [("baseline (per-row dicts)", lambda: baseline(COLUMNS, rows))]
+    variants.append(("column-wise" + (" + numpy" if postprocess.numpy is not None else ""),
+                     lambda: postprocess.display_rows(COLUMNS, rows)))
+    if postprocess.numpy is not None:
+        def pure_python():
+            numpy, postprocess.numpy = postprocess.numpy, None
+            try:
+                postprocess.display_rows(COLUMNS, rows)
+            finally:
+                postprocess.numpy = numpy
+        variants.append(("column-wise, pure Python", pure_python))
+    variants.append(("column-wise, keep_columns=[id,total,notes]",
+                     lambda: postprocess.display_rows(COLUMNS, rows, ["id", "total", "notes"])))
+
+    print(f"{args.rows} rows x {len(COLUMNS)} columns, best of {args.rounds}")
+    base = None
+    for label, fn in variants:
+        seconds = best_of(args.rounds, fn)
+        base = base or seconds
+        print(f"  {label:<44} {seconds * 1000:9.1f} ms  {args.rows / seconds:>12,.0f} rows/s  x{base / seconds:.2f}")
+
+
+if __name__ == "__main__":
+    main()
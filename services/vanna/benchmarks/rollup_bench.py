@@ -0,0 +1,113 @@
+"""
+Compare dashboard aggregates answered by PostgreSQL with the same queries
+answered from the in-memory rollup cubes (app/rollups.py).
+
+Every query, including MySQL date queries passed through the SQL
+translator, is first checked to return identical columns and rows both
+ways, then timed on the database, folded from the cube cells, and served
+from the per-plan memo of an unchanged cube. Needs a seeded PostgreSQL
+database:
+
+    DATABASE_URL=postgresql://... python -m benchmarks.rollup_bench [--rounds 50]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import inspect, text  # noqa: E402
+
+from app import db  # noqa: E402
+from app.rollups import RollupStore  # noqa: E402
+from app.sql_translate import SQLTranslator  # noqa: E402
+
+QUERIES = {
+    "spend by status": 'SELECT status, COUNT(*) AS invoices, SUM(total) AS spend FROM invoices '
+                       'GROUP BY status ORDER BY spend DESC',
+    "top vendors": 'SELECT v.name, SUM(i.total) AS spend FROM invoices i JOIN vendors v ON v.id = i."vendorId" '
+                   'GROUP BY v.name ORDER BY spend DESC LIMIT 10',
+    "monthly trend": "SELECT DATE_TRUNC('month', date) AS month, ROUND(SUM(total), 2) AS spend FROM invoices "
+                     "WHERE date >= '2025-01-01' GROUP BY 1 ORDER BY 1",
+    "category spend": 'SELECT l.category, SUM(l.amount) AS spend FROM line_items l '
+                      'JOIN invoices i ON i.id = l."invoiceId" WHERE i.status = \'paid\' '
+                      'GROUP BY l.category ORDER BY spend DESC',
+    "payment outflow": 'SELECT TO_CHAR("paymentDate", \'YYYY-MM\') AS month, SUM(amount) AS outflow '
+                       'FROM payments GROUP BY 1 ORDER BY 1',
+}
+
+# Date questions as the model writes them (MySQL); timed after going through the service's translator
+MYSQL_QUERIES = {
+    "monthly totals": "SELECT DATE_FORMAT(date, '%Y-%m') AS month, SUM(total) AS total FROM invoices "
+                      "GROUP BY month ORDER BY month",
+    "yearly totals": "SELECT YEAR(date) AS year, SUM(total) AS total FROM invoices GROUP BY YEAR(date) ORDER BY year",
+    "months of 2025": "SELECT MONTH(date) AS month, SUM(total) FROM invoices WHERE YEAR(date) = 2025 "
+                      "GROUP BY MONTH(date) ORDER BY month",
+    "payments by month": "SELECT YEAR(paymentDate) AS y, MONTH(paymentDate) AS m, SUM(amount) AS paid "
+                         "FROM payments GROUP BY y, m ORDER BY y, m",
+}
+
+
+def best_of(rounds: int, fn) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    url = os.getenv("DATABASE_URL", "")
+    if not url.startswith("postgres"):
+        sys.exit("Set DATABASE_URL to a seeded PostgreSQL database")
+    engine = db.get_engine(url)
+    store = RollupStore(engine, refresh_interval=3600)
+    start = time.perf_counter()
+    if not store.refresh(force=True):
+        sys.exit("Could not build the rollup cubes")
+    print(f"cubes built in {(time.perf_counter() - start) * 1000:.1f} ms: {store.stats()}")
+
+    def on_database(sql):
+        with engine.connect() as conn:
+            result = conn.execute(text(sql))
+            return list(result.keys()), [tuple(row) for row in result]
+
+    translator = SQLTranslator()
+    schema = inspect(engine)
+    names = set(schema.get_table_names())
+    for table in list(names):
+        names.update(column["name"] for column in schema.get_columns(table))
+    translator.set_identifiers(names)
+    queries = dict(QUERIES)
+    queries.update({f"{label} (MySQL)": translator.translate(sql) for label, sql in MYSQL_QUERIES.items()})
+
+    print(f"best of {args.rounds}")
+    for label, sql in queries.items():
+        routed = store.answer(sql)
+        if routed is None:
+            sys.exit(f"{label}: not answered from the cubes")
+        if routed != on_database(sql):
+            sys.exit(f"{label}: cube result differs from PostgreSQL")
+        plan = store._plan(sql)
+
+        def fold():
+            # Aggregate the cells again, as after a refresh changed the cube
+            plan.memo = None
+            store.answer(sql)
+
+        database = best_of(args.rounds, lambda: on_database(sql))
+        folded = best_of(args.rounds, fold)
+        memo = best_of(args.rounds, lambda: store.answer(sql))
+        print(f"  {label:<26} database {database * 1000:7.3f} ms   cube fold {folded * 1000:7.3f} ms"
+              f"   unchanged cube {memo * 1000:7.3f} ms   x{database / memo:.0f}")
+
+
+if __name__ == "__main__":
+    main()